@@ -1,23 +1,42 @@
 # api/routes.py
-from fastapi import APIRouter, HTTPException, status
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, status, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional, Union
 from datetime import datetime
 import json
+import os
+import time
+import asyncio
+import secrets
+import numpy as np
+import pandas as pd
 
 # Importa os serviços
 from backend.services.finder import ServicoFinder
 from backend.services.reasoner import ReasonerAgent
 from backend.services.classifier_agent import ClassifierAgent
 from backend.services.web_researcher_agent import WebResearcherAgent
+from backend.services.ingest import standardize_columns, parse_prices
+from backend.services.result_cache import config_digest
+from backend.services.semantic_cache import numeric_signature
 from backend.core.text_utils import extract_core_keywords, get_neighborhood, format_neighbor_as_result
+from backend.core.concurrency import run_cpu_bound, run_speculative, StageGraph, SingleFlight
 
 # Modelos Pydantic
+class PriceContext(BaseModel):
+    uf: str = Field(..., min_length=2, max_length=2, example="RS")
+    mes: Optional[str] = Field(None, example="2025-07", description="Mês de referência; padrão: o mais recente com preço")
+    desonerado: bool = Field(False, description="Regime com desoneração da folha")
+
 class SearchQuery(BaseModel):
     texto_busca: str = Field(..., min_length=3, example="concreto usinado 30mpa")
     top_k: int = Field(3, gt=0, le=10, example=3)
     project_profile: Optional[str] = Field("default", description="Perfil do projeto para prioridades")
     user_guidance: Optional[str] = Field(None, description="Orientação manual do especialista")
+    versao: Optional[str] = Field(None, description="Versão do catálogo (mês de referência); padrão: catálogo principal")
+    contexto_preco: Optional[PriceContext] = Field(None, description="Retorna também o preço por UF / mês / desoneração")
 
 class SearchResultItem(BaseModel):
     rank: int
@@ -27,6 +46,15 @@ class SearchResultItem(BaseModel):
     preco: float
     unidade: str
     fonte: str
+    preco_contexto: Optional[float] = None
+
+class PriceLookupItem(BaseModel):
+    codigo: str
+    fonte: str
+
+class PriceLookupRequest(BaseModel):
+    itens: List[PriceLookupItem] = Field(..., min_length=1)
+    contexto: PriceContext
 
 class SearchResponse(BaseModel):
     query: SearchQuery
@@ -34,86 +62,479 @@ class SearchResponse(BaseModel):
     detailed_reasoning: str = Field(default="", description="Log detalhado do processo de raciocínio da IA")
     trace: dict = Field(default_factory=dict, description="Dicionário detalhado do trace de execução")
 
+# Consultas por requisição em /buscar/lote
+MAX_BATCH_QUERIES = 500
+
+class BatchSearchRequest(BaseModel):
+    # Cada consulta é validada à parte (ver /buscar/lote): uma inválida não recusa as demais
+    consultas: List[dict] = Field(..., min_length=1, max_length=MAX_BATCH_QUERIES,
+                                  description="Consultas no formato de /buscar")
+
+class BatchSearchItem(BaseModel):
+    indice: int = Field(..., description="Posição da consulta na requisição")
+    status: str = Field(..., description="'ok', 'nao_encontrado' ou 'erro'")
+    status_code: int
+    detail: Optional[str] = None
+    resposta: Optional[SearchResponse] = None
+
+class BatchSearchResponse(BaseModel):
+    resultados: List[BatchSearchItem]
+    estatisticas: dict = Field(default_factory=dict)
+
+class CatalogItem(BaseModel):
+    codigo: str
+    descricao: str = Field(..., min_length=1)
+    unidade: str
+    fonte: str
+    grupo: str = ""
+    preco: Union[float, str] = Field(..., description="Número ou texto no formato brasileiro (ex.: '1.234,56')")
+
+class CatalogDeletion(BaseModel):
+    codigo: str
+    fonte: Optional[str] = Field(None, description="Se omitida, remove o código em todas as fontes")
+
+class CatalogDelta(BaseModel):
+    upserts: List[CatalogItem] = Field(default_factory=list)
+    deletes: List[CatalogDeletion] = Field(default_factory=list)
+
 # Router
 router = APIRouter()
+admin_router = APIRouter(prefix="/admin")
 
 # Instâncias globais dos serviços (serão inicializadas no main.py)
-finder_instance = None
+# O finder em uso é obtido do gerenciador de índice a cada requisição (troca blue/green)
+index_manager = None
 reasoner_instance = None
 classifier_instance = None
 web_researcher_instance = None
+# Buscas em andamento neste worker, para coalescer requisições idênticas
+search_flights = SingleFlight()
+# Cache de respostas completas (memória + disco); None desativa
+result_cache = None
+# Cache de respostas por similaridade da consulta (quase duplicatas); None desativa
+answer_cache = None
+# Pipelines (chamadas aos LLMs) simultâneos por requisição de /buscar/lote
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 8))
 
-def set_service_instances(finder, reasoner, classifier, web_researcher):
+def set_service_instances(manager, reasoner, classifier, web_researcher, cache=None, semantic_cache=None):
     """Define as instâncias dos serviços."""
-    global finder_instance, reasoner_instance, classifier_instance, web_researcher_instance
-    finder_instance = finder
+    global index_manager, reasoner_instance, classifier_instance, web_researcher_instance, result_cache, answer_cache
+    index_manager = manager
     reasoner_instance = reasoner
     classifier_instance = classifier
     web_researcher_instance = web_researcher
+    result_cache = cache
+    answer_cache = semantic_cache
 
 @router.post("/buscar",
              response_model=SearchResponse,
              tags=["Busca Semântica com Agente"],
              summary="Realiza uma busca semântica refinada por um agente de IA")
 async def buscar_servicos(query: SearchQuery):
-    """Endpoint principal para busca semântica de serviços."""
+    """
+    Endpoint principal para busca semântica de serviços.
+    As chamadas aos LLMs são assíncronas e as etapas de CPU (busca híbrida,
+    vizinhos, preços) rodam no pool limitado de `run_cpu_bound`: o event loop
+    nunca bloqueia e um worker mantém várias buscas em andamento.
+
+    O pipeline é um DAG de etapas (ver `build_search_graph`): extração de
+    palavras-chave e classificação rodam juntas, e a busca de fallback com as
+    palavras-chave é disparada especulativamente enquanto o raciocinador analisa
+    os candidatos, sendo descartada se não for necessária.
+    """
+    finder = current_finder(query)
+    key = search_key(finder, query)
+    cached, cache_key, semantic = await lookup_caches(finder, query, key)
+    if cached is not None:
+        return SearchResponse(query=query, **cached)
+
+    async def search_and_store():
+        outcome = await execute_search(finder, query, query_embedding=semantic[1] if semantic else None)
+        await store_outcome(query, outcome, cache_key, semantic)
+        return outcome
+
+    # Buscas idênticas simultâneas (planilhas, vários usuários, novas tentativas do
+    # frontend) aguardam a mesma execução do pipeline em vez de repeti-la
+    outcome, coalesced = await search_flights.run(key, search_and_store)
+    return SearchResponse(
+        query=query,
+        results=outcome["results"],
+        detailed_reasoning=outcome["detailed_reasoning"],
+        trace={**outcome["trace"], "coalesced": coalesced, "cache": None}
+    )
+
+@router.post("/buscar/stream",
+             tags=["Busca Semântica com Agente"],
+             summary="Busca semântica com eventos (Server-Sent Events) a cada etapa concluída")
+async def buscar_servicos_stream(query: SearchQuery):
+    """
+    Mesmo pipeline de `/buscar`, respondido como `text/event-stream`. Eventos,
+    na ordem em que as etapas terminam:
+    - `classificacao`: grupo e unidade previstos;
+    - `candidatos`: resultados da busca híbrida inicial (em milissegundos);
+    - `raciocinio_token`: trechos da resposta do raciocinador, conforme chegam do LLM;
+    - `decisao`: código escolhido e raciocínio completo;
+    - `busca_refinada`: candidatos da nova busca, se o raciocinador pedir;
+    - `resultado`: a resposta final, no formato de `/buscar`;
+    - `erro`: status e detalhe, se a busca falhar.
+    Respostas em cache vêm direto como `resultado`. Não há coalescência com
+    buscas idênticas em andamento: cada stream acompanha a própria execução.
+    """
+    finder = current_finder(query)
+    key = search_key(finder, query)
+    events = asyncio.Queue()
+
+    def emit(event: str, data):
+        events.put_nowait((event, data))
+
+    async def produce():
+        try:
+            cached, cache_key, semantic = await lookup_caches(finder, query, key)
+            if cached is None:
+                outcome = await execute_search(finder, query, emit=emit,
+                                               query_embedding=semantic[1] if semantic else None)
+                await store_outcome(query, outcome, cache_key, semantic)
+                cached = {**outcome, "trace": {**outcome["trace"], "coalesced": False, "cache": None}}
+            emit("resultado", SearchResponse(query=query, **cached).model_dump(mode="json"))
+        except HTTPException as e:
+            emit("erro", {"status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            emit("erro", {"status": status.HTTP_500_INTERNAL_SERVER_ERROR, "detail": str(e)})
+        finally:
+            events.put_nowait(None)
+
+    async def stream():
+        producer = asyncio.create_task(produce())
+        try:
+            while (item := await events.get()) is not None:
+                event, data = item
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+        finally:
+            # Cliente desconectado: interrompe o pipeline (e a chamada ao LLM)
+            producer.cancel()
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.post("/buscar/lote",
+             response_model=BatchSearchResponse,
+             tags=["Busca Semântica com Agente"],
+             summary="Busca semântica em lote (planilhas), com resultado e status por consulta")
+async def buscar_servicos_lote(request: BatchSearchRequest):
+    """
+    Até MAX_BATCH_QUERIES consultas em uma requisição, respondidas na ordem de
+    entrada. Consultas repetidas (mesma chave de `/buscar`) são executadas uma
+    só vez; as distintas são codificadas em um único lote, e o embedding serve
+    ao cache semântico. Para as que não estão em cache, a busca semântica
+    inicial é uma única multiplicação de matrizes (por versão do catálogo), e
+    cada pipeline parte desses candidatos. Os pipelines com LLM rodam com no
+    máximo BATCH_LLM_CONCURRENCY em paralelo e coalescem com buscas idênticas
+    em andamento. Falhas de uma consulta não afetam as demais: uma consulta
+    inválida (por exemplo, texto com menos de 3 caracteres) recebe status
+    'erro' com código 422 só na sua posição.
+    """
+    started = time.perf_counter()
+    finder = current_finder()
+    queries = [None] * len(request.consultas)
+    items = [None] * len(queries)
+
+    # Consultas distintas -> posições na requisição
+    groups = {}
+    for position, raw_query in enumerate(request.consultas):
+        try:
+            queries[position] = query = SearchQuery.model_validate(raw_query)
+        except ValidationError as e:
+            items[position] = batch_error(position, status.HTTP_422_UNPROCESSABLE_ENTITY, validation_detail(e))
+            continue
+        try:
+            check_version(finder, query)
+        except HTTPException as e:
+            items[position] = batch_error(position, e.status_code, e.detail)
+            continue
+        groups.setdefault(search_key(finder, query), []).append(position)
+    distinct = list(groups.items())
+
+    embeddings = None
+    if distinct:
+        embeddings = await run_cpu_bound(finder.encode_queries, [queries[positions[0]].texto_busca
+                                                                  for _, positions in distinct])
+    llm_slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    stats = {"consultas": len(queries), "distintas": len(distinct), "cache": 0, "executadas": 0, "coalescidas": 0}
+
+    lookups = await asyncio.gather(*(lookup_caches(finder, queries[positions[0]], key, vector=embeddings[number])
+                                     for number, (key, positions) in enumerate(distinct)),
+                                   return_exceptions=True)
+    # Busca semântica inicial das consultas fora do cache: uma matriz de consultas por versão do catálogo
+    misses = {}
+    for number, ((_, positions), lookup) in enumerate(zip(distinct, lookups)):
+        if not isinstance(lookup, Exception) and lookup[0] is None:
+            misses.setdefault(queries[positions[0]].versao, []).append(number)
+    candidates = {}
+    for versao, numbers in misses.items():
+        found = await run_cpu_bound(finder.semantic_candidates, embeddings[numbers], versao)
+        candidates.update(zip(numbers, found))
+
+    async def resolve(number, key, query):
+        lookup = lookups[number]
+        if isinstance(lookup, Exception):
+            raise lookup
+        cached, cache_key, semantic = lookup
+        if cached is not None:
+            stats["cache"] += 1
+            return cached
+
+        async def search_and_store():
+            outcome = await execute_search(finder, query, query_embedding=embeddings[number],
+                                           semantic_candidates=candidates[number])
+            await store_outcome(query, outcome, cache_key, semantic)
+            return outcome
+
+        async with llm_slots:
+            outcome, coalesced = await search_flights.run(key, search_and_store)
+        stats["coalescidas" if coalesced else "executadas"] += 1
+        return {**outcome, "trace": {**outcome["trace"], "coalesced": coalesced, "cache": None}}
+
+    outcomes = await asyncio.gather(*(resolve(number, key, queries[positions[0]])
+                                      for number, (key, positions) in enumerate(distinct)),
+                                    return_exceptions=True)
+    for (key, positions), outcome in zip(distinct, outcomes):
+        for position in positions:
+            if isinstance(outcome, HTTPException):
+                items[position] = batch_error(position, outcome.status_code, outcome.detail)
+            elif isinstance(outcome, Exception):
+                items[position] = batch_error(position, status.HTTP_500_INTERNAL_SERVER_ERROR, str(outcome))
+            elif not outcome["results"]:
+                # execute_search devolve os erros do pipeline como resposta sem resultados
+                items[position] = batch_error(position, status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                              outcome["detailed_reasoning"])
+            else:
+                items[position] = BatchSearchItem(indice=position, status="ok", status_code=status.HTTP_200_OK,
+                                                  resposta=SearchResponse(query=queries[position], **outcome))
+
+    stats["duracao_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return BatchSearchResponse(resultados=items, estatisticas=stats)
+
+def batch_error(position: int, status_code: int, detail: str) -> BatchSearchItem:
+    return BatchSearchItem(indice=position, status_code=status_code, detail=str(detail),
+                           status="nao_encontrado" if status_code == status.HTTP_404_NOT_FOUND else "erro")
+
+def validation_detail(error: ValidationError) -> str:
+    """Erros de validação de uma consulta em uma linha (ex.: "texto_busca: String should have at least 3 characters")."""
+    return "; ".join(f"{'.'.join(str(part) for part in e['loc']) or 'consulta'}: {e['msg']}" for e in error.errors())
+
+def current_finder(query: SearchQuery = None):
+    """Finder em uso para a requisição; 503 sem serviços e 404 para versão de catálogo inexistente."""
+    if not all([index_manager, reasoner_instance, classifier_instance, web_researcher_instance]):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Serviços não inicializados"
+        )
+    # A requisição inteira usa a mesma geração do índice, mesmo que haja uma troca no meio
+    finder = index_manager.current
+    if query is not None:
+        check_version(finder, query)
+    return finder
+
+def check_version(finder, query: SearchQuery):
+    if query.versao and (finder.versions is None or query.versao not in finder.versions.names()):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Versão de catálogo '{query.versao}' não encontrada"
+        )
+
+async def lookup_caches(finder, query: SearchQuery, key: tuple, vector: np.ndarray = None):
+    """
+    Consulta o cache de resultados e o semântico. Retorna (resposta em cache ou
+    None, chave do cache de resultados, (partição, vetor, números) para gravar
+    no cache semântico depois da busca). `vector` é o embedding da consulta, se
+    já codificado (ver `finder.encode_queries`).
+    """
+    # A chave do cache inclui a configuração dos agentes: editar prompts ou prioridades invalida as respostas
+    cache_key = result_cache.make_key(config_digest(), *key) if result_cache is not None else None
+    if cache_key is not None:
+        cached, tier = await run_in_threadpool(result_cache.get, cache_key)
+        if cached is not None:
+            return {
+                "results": cached["results"],
+                "detailed_reasoning": cached["detailed_reasoning"],
+                "trace": {**cached["trace"], "coalesced": False, "cache": tier}
+            }, cache_key, None
+
+    # Quase duplicatas ("Fase-A" x "Fase-B", caixa, espaços): resposta de uma consulta
+    # semelhante já respondida, sem classificação, recuperação nem raciocínio
+    semantic = None
+    if answer_cache is not None and answer_cache.enabled:
+        partition = (config_digest(), key[0], *key[2:])
+        numbers = numeric_signature(key[1])
+        if vector is None:
+            vector = await run_cpu_bound(finder.encode_query, query.texto_busca)
+        similar, similarity = await run_cpu_bound(answer_cache.lookup, partition, vector, numbers)
+        if similar is not None:
+            return {
+                "results": similar["results"],
+                "detailed_reasoning": (f"♻️ **RESPOSTA REAPROVEITADA** da consulta semelhante '{similar['consulta']}' "
+                                       f"(similaridade {similarity:.4f})\n\n" + similar["detailed_reasoning"]),
+                "trace": {**similar["trace"], "coalesced": False, "cache": "semantico",
+                          "semantic_cache": {"consulta_em_cache": similar["consulta"], "similaridade": similarity}}
+            }, cache_key, None
+        semantic = (partition, vector, numbers)
+    return None, cache_key, semantic
+
+async def store_outcome(query: SearchQuery, outcome: dict, cache_key, semantic):
+    """Grava a resposta nos caches; respostas de erro não são guardadas."""
+    if not outcome["results"]:
+        return
+    if cache_key is not None:
+        await run_in_threadpool(result_cache.put, cache_key, outcome)
+    if semantic is not None:
+        partition, vector, numbers = semantic
+        answer_cache.add(partition, vector, numbers, query.texto_busca, outcome)
+
+def search_key(finder, query: SearchQuery) -> tuple:
+    """Chave da busca: índice em uso, consulta normalizada e os parâmetros que mudam o resultado."""
+    return (
+        finder.index_id,
+        finder.normalizer.normalize(query.texto_busca),
+        query.top_k,
+        query.project_profile,
+        (query.user_guidance or "").strip(),
+        query.versao,
+        query.contexto_preco.model_dump_json() if query.contexto_preco else None,
+    )
+
+async def execute_search(finder, query: SearchQuery, emit=None, query_embedding: np.ndarray = None,
+                         semantic_candidates: tuple = None) -> dict:
+    """
+    Executa o pipeline de busca; retorna resultados, raciocínio detalhado e trace.
+    Com `emit`, cada etapa concluída chama `emit(evento, dados)` (ver `/buscar/stream`).
+    `query_embedding`, se informado, evita recodificar a consulta na busca inicial;
+    `semantic_candidates` (ver `finder.semantic_candidates`), recalcular a similaridade.
+    """
     # Inicializa o trace detalhado
     trace = {"steps": []}
     
     try:
-        if not all([finder_instance, reasoner_instance, classifier_instance, web_researcher_instance]):
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="Serviços não inicializados"
-            )
+        graph = build_search_graph(finder, query, trace, emit, query_embedding, semantic_candidates)
+        results = await graph.run()
+        trace["stages"] = graph.timings
+
+        detailed_reasoning = results["busca_inicial"][3]
+        search_results = results["busca_inicial"][0]
+        if results["busca_refinada"] is not None:
+            search_results, _, _, additional_reasoning = results["busca_refinada"]
+            # Adiciona o log da segunda busca ao reasoning detalhado
+            detailed_reasoning += "\n\n🔄 **SEGUNDA BUSCA COM PALAVRAS-CHAVE REFINADAS**\n" + additional_reasoning
+
+        # Limita aos top_k solicitados
+        final_results = search_results[:query.top_k]
+
+        # Vizinhos e preços por contexto leem o catálogo: também fora do event loop
+        neighbors_added = await run_cpu_bound(complete_results, finder, query, final_results)
+
+        trace["steps"].append({
+            "step_name": "Adição de Vizinhos",
+            "input": {"needed": query.top_k - len(final_results) + neighbors_added},
+            "output": {"neighbors_added": neighbors_added},
+            "timestamp": datetime.now().isoformat()
+        })
         
-        # Carrega prioridades do projeto
-        priority_list = None
-        try:
-            with open("agents_config.json", 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                priority_list = config.get('project_priorities', {}).get(query.project_profile, 
-                                config.get('project_priorities', {}).get('default', []))
-            trace["steps"].append({
-                "step_name": "Carregamento de Prioridades",
-                "input": query.project_profile,
-                "output": priority_list,
-                "timestamp": datetime.now().isoformat()
-            })
-        except Exception as e:
-            trace["steps"].append({
-                "step_name": "Carregamento de Prioridades",
-                "input": query.project_profile,
-                "output": None,
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            })
+        return {"results": final_results, "detailed_reasoning": detailed_reasoning, "trace": trace}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        # Adiciona erro ao trace
+        trace["steps"].append({
+            "step_name": "Erro",
+            "input": None,
+            "output": None,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        })
         
-        # Extrai palavras-chave da query
-        core_keywords = extract_core_keywords(query.texto_busca)
+        # Retorna resposta com trace mesmo em caso de erro
+        return {"results": [], "detailed_reasoning": f"❌ Erro durante o processamento: {str(e)}", "trace": trace}
+
+def load_priority_list(project_profile: str, trace: dict):
+    """Prioridades de fontes do perfil do projeto (ou as padrão), registradas no trace."""
+    try:
+        with open("agents_config.json", 'r', encoding='utf-8') as f:
+            config = json.load(f)
+            priority_list = config.get('project_priorities', {}).get(project_profile,
+                            config.get('project_priorities', {}).get('default', []))
+        trace["steps"].append({
+            "step_name": "Carregamento de Prioridades",
+            "input": project_profile,
+            "output": priority_list,
+            "timestamp": datetime.now().isoformat()
+        })
+        return priority_list
+    except Exception as e:
+        trace["steps"].append({
+            "step_name": "Carregamento de Prioridades",
+            "input": project_profile,
+            "output": None,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        })
+        return None
+
+def build_search_graph(finder, query: SearchQuery, trace: dict, emit=None,
+                       query_embedding: np.ndarray = None, semantic_candidates: tuple = None) -> StageGraph:
+    """
+    Etapas do pipeline de busca e suas dependências:
+    - prioridades, keywords e classificacao são independentes e rodam juntas;
+    - busca_inicial depende de prioridades e classificacao; raciocinio, dela;
+    - busca_especulativa (com as palavras-chave extraídas) roda junto com o raciocínio,
+      no pool especulativo de baixa prioridade, e é pulada se ele estiver ocupado;
+    - busca_refinada só acontece se o raciocinador pedir nova busca, e reaproveita
+      a especulativa quando as palavras-chave pedidas são as mesmas (após normalização).
+    `emit`, se informado, recebe os eventos de progresso de `/buscar/stream`.
+    """
+    graph = StageGraph()
+    # Os tokens do LLM só são pedidos em streaming quando alguém vai consumi-los
+    streaming = emit is not None
+    if emit is None:
+        def emit(event, data):
+            pass
+
+    async def prioridades(g):
+        return load_priority_list(query.project_profile, trace)
+
+    async def keywords(g):
+        core_keywords = await extract_core_keywords(query.texto_busca)
         trace["steps"].append({
             "step_name": "Extração de Keywords",
             "input": query.texto_busca,
             "output": core_keywords,
             "timestamp": datetime.now().isoformat()
         })
-        
-        # Classifica a query
-        predicted_group, predicted_unit = classifier_instance.classify(query.texto_busca)
+        return core_keywords
+
+    async def classificacao(g):
+        predicted_group, predicted_unit = await classifier_instance.classify(query.texto_busca)
         trace["steps"].append({
             "step_name": "Classificação",
             "input": query.texto_busca,
             "output": (predicted_group, predicted_unit),
             "timestamp": datetime.now().isoformat()
         })
-        
-        # Busca inicial com log detalhado
-        initial_results, score_semantico, indice_original, detailed_reasoning = finder_instance.hybrid_search(
-            query.texto_busca, 
+        emit("classificacao", {"grupo": predicted_group, "unidade": predicted_unit})
+        return predicted_group, predicted_unit
+
+    async def busca_inicial(g):
+        predicted_group, predicted_unit = g.results["classificacao"]
+        priority_list = g.results["prioridades"]
+        initial_results, score_semantico, indice_original, detailed_reasoning = await run_cpu_bound(
+            finder.hybrid_search,
+            query.texto_busca,
             top_k=min(query.top_k * 2, 10),
             predicted_group=predicted_group,
             predicted_unit=predicted_unit,
-            priority_list=priority_list
+            priority_list=priority_list,
+            versao=query.versao,
+            query_embedding=query_embedding,
+            semantic_candidates=semantic_candidates
         )
         trace["steps"].append({
             "step_name": "Busca Inicial",
@@ -130,18 +551,27 @@ async def buscar_servicos(query: SearchQuery):
             },
             "timestamp": datetime.now().isoformat()
         })
-        
         if not initial_results:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Nenhum serviço encontrado para a busca especificada"
             )
-        
+        emit("candidatos", {"results": initial_results})
+        return initial_results, score_semantico, indice_original, detailed_reasoning
+
+    async def busca_especulativa(g):
+        # Sob carga (pool especulativo ocupado) retorna None e não disputa CPU com as buscas
+        return await run_speculative(finder.hybrid_search, g.results["keywords"], top_k=query.top_k,
+                                     priority_list=g.results["prioridades"], versao=query.versao)
+
+    async def raciocinio(g):
+        initial_results = g.results["busca_inicial"][0]
         # Raciocínio com LLM (com orientação do usuário se fornecida)
-        reasoning_result = reasoner_instance.choose_best_option(
+        reasoning_result = await reasoner_instance.choose_best_option(
             query.texto_busca,
             initial_results,
-            user_guidance=query.user_guidance
+            user_guidance=query.user_guidance,
+            on_token=(lambda text: emit("raciocinio_token", {"texto": text})) if streaming else None
         )
         trace["steps"].append({
             "step_name": "Raciocínio",
@@ -153,91 +583,131 @@ async def buscar_servicos(query: SearchQuery):
             "output": reasoning_result,
             "timestamp": datetime.now().isoformat()
         })
-        
-        # Verifica se precisa de nova busca
-        if reasoning_result.get("codigo_final") == "N/A" and "palavras_chave_para_nova_busca" in reasoning_result:
-            # Nova busca com palavras-chave refinadas
-            new_query = reasoning_result["palavras_chave_para_nova_busca"]
-            initial_results, _, _, additional_reasoning = finder_instance.hybrid_search(
-                new_query, 
-                top_k=query.top_k,
-                priority_list=priority_list
-            )
-            # Adiciona o log da segunda busca ao reasoning detalhado
-            detailed_reasoning += "\n\n🔄 **SEGUNDA BUSCA COM PALAVRAS-CHAVE REFINADAS**\n" + additional_reasoning
-            
-            trace["steps"].append({
-                "step_name": "Busca Web/Refinada",
-                "input": new_query,
-                "output": {
-                    "results_count": len(initial_results),
-                    "refined_query": new_query
-                },
-                "timestamp": datetime.now().isoformat()
-            })
-        
-        # Limita aos top_k solicitados
-        final_results = initial_results[:query.top_k]
-        
-        # Adiciona vizinhos se necessário
-        neighbors_added = 0
-        if len(final_results) < query.top_k:
-            needed = query.top_k - len(final_results)
-            df = finder_instance.df
-            
-            for result in final_results:
-                try:
-                    idx = df[df['codigo'] == result['codigo']].index[0]
-                    neighbors = get_neighborhood(df, idx, radius=2)
-                    
-                    for neighbor in neighbors:
-                        if len(final_results) >= query.top_k:
-                            break
-                        if neighbor['codigo'] not in [r['codigo'] for r in final_results]:
-                            final_results.append(format_neighbor_as_result(neighbor))
-                            neighbors_added += 1
-                            needed -= 1
-                            if needed <= 0:
-                                break
-                    
-                    if needed <= 0:
-                        break
-                except (IndexError, KeyError):
-                    continue
-        
-        trace["steps"].append({
-            "step_name": "Adição de Vizinhos",
-            "input": {"needed": query.top_k - len(final_results) + neighbors_added},
-            "output": {"neighbors_added": neighbors_added},
-            "timestamp": datetime.now().isoformat()
-        })
-        
-        return SearchResponse(
-            query=query,
-            results=final_results,
-            detailed_reasoning=detailed_reasoning,
-            trace=trace
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        # Adiciona erro ao trace
+        emit("decisao", reasoning_result)
+        return reasoning_result
+
+    async def busca_refinada(g):
+        # Só há nova busca se o raciocinador não encontrou um serviço adequado
+        reasoning_result = g.results["raciocinio"]
+        if reasoning_result.get("codigo_final") != "N/A" or "palavras_chave_para_nova_busca" not in reasoning_result:
+            return None
+        new_query = reasoning_result["palavras_chave_para_nova_busca"]
+        refined = None
+        if finder.normalizer.normalize(new_query) == finder.normalizer.normalize(g.results["keywords"]):
+            refined = await g.result("busca_especulativa")
+        speculative = refined is not None
+        if not speculative:
+            refined = await run_cpu_bound(finder.hybrid_search, new_query, top_k=query.top_k,
+                                          priority_list=g.results["prioridades"], versao=query.versao)
         trace["steps"].append({
-            "step_name": "Erro",
-            "input": None,
-            "output": None,
-            "error": str(e),
+            "step_name": "Busca Web/Refinada",
+            "input": new_query,
+            "output": {
+                "results_count": len(refined[0]),
+                "refined_query": new_query,
+                "speculative_hit": speculative
+            },
             "timestamp": datetime.now().isoformat()
         })
-        
-        # Retorna resposta com trace mesmo em caso de erro
-        return SearchResponse(
-            query=query,
-            results=[],
-            detailed_reasoning=f"❌ Erro durante o processamento: {str(e)}",
-            trace=trace
-        )
+        emit("busca_refinada", {"query": new_query, "results": refined[0]})
+        return refined
+
+    graph.add("prioridades", prioridades)
+    graph.add("keywords", keywords)
+    graph.add("classificacao", classificacao)
+    graph.add("busca_inicial", busca_inicial, deps=("prioridades", "classificacao"))
+    # Depois da busca inicial, para não disputar o pool de CPU com o caminho crítico
+    graph.add("busca_especulativa", busca_especulativa, deps=("prioridades", "keywords", "busca_inicial"),
+              speculative=True)
+    graph.add("raciocinio", raciocinio, deps=("busca_inicial",))
+    graph.add("busca_refinada", busca_refinada, deps=("raciocinio", "keywords"))
+    return graph
+
+def complete_results(finder, query: SearchQuery, final_results: list) -> int:
+    """
+    Completa `final_results` (no lugar) com vizinhos no catálogo até top_k e,
+    se pedido, com o preço no contexto. Retorna o número de vizinhos adicionados.
+    """
+    neighbors_added = 0
+    if len(final_results) < query.top_k:
+        needed = query.top_k - len(final_results)
+        catalog = finder.versions.catalog(query.versao) if query.versao else finder.catalog
+
+        for result in final_results:
+            try:
+                idx = catalog.row_of(result['codigo'])
+                if idx is None:
+                    continue
+                neighbors = get_neighborhood(catalog, idx, radius=2)
+
+                for neighbor in neighbors:
+                    if len(final_results) >= query.top_k:
+                        break
+                    if neighbor['codigo'] not in [r['codigo'] for r in final_results]:
+                        final_results.append(format_neighbor_as_result(neighbor))
+                        neighbors_added += 1
+                        needed -= 1
+                        if needed <= 0:
+                            break
+
+                if needed <= 0:
+                    break
+            except (IndexError, KeyError):
+                continue
+
+    if query.contexto_preco and finder.price_cube is not None:
+        context_prices = lookup_context_prices(finder.price_cube, final_results, query.contexto_preco)
+        for result, price in zip(final_results, context_prices):
+            result['preco_contexto'] = price
+    return neighbors_added
+
+def lookup_context_prices(price_cube, items: list, context: PriceContext) -> list:
+    """Preços dos itens (dicts com 'fonte' e 'codigo') no contexto; None onde não houver preço."""
+    prices = price_cube.lookup([item['fonte'] for item in items], [item['codigo'] for item in items],
+                               uf=context.uf, mes=context.mes, desonerado=context.desonerado)
+    return [None if np.isnan(price) else round(float(price), 2) for price in prices]
+
+@router.post("/precos/consulta",
+             tags=["Preços"],
+             summary="Consulta em lote de preços por UF, mês de referência e desoneração")
+async def consultar_precos(request: PriceLookupRequest):
+    finder = index_manager.current if index_manager else None
+    if finder is None or finder.price_cube is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cubo de preços não carregado")
+    items = [item.model_dump() for item in request.itens]
+    prices = lookup_context_prices(finder.price_cube, items, request.contexto)
+    return {"contexto": request.contexto, "itens": [{**item, "preco": price} for item, price in zip(items, prices)]}
+
+@router.get("/precos/eixos",
+            tags=["Preços"],
+            summary="UFs, meses e regimes disponíveis no cubo de preços")
+async def eixos_precos():
+    finder = index_manager.current if index_manager else None
+    if finder is None or finder.price_cube is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cubo de preços não carregado")
+    return finder.price_cube.describe()
+
+@router.get("/versoes",
+            tags=["Versões do Catálogo"],
+            summary="Lista as versões do catálogo carregadas")
+async def listar_versoes():
+    finder = index_manager.current if index_manager else None
+    if finder is None or finder.versions is None:
+        return {"versoes": []}
+    return {"versoes": [{"nome": name, "registros": len(finder.versions.catalog(name))}
+                        for name in finder.versions.names()]}
+
+@router.get("/versoes/diff",
+            tags=["Versões do Catálogo"],
+            summary="Compara duas versões do catálogo: códigos adicionados, removidos e repreciados")
+async def diff_versoes(de: str, para: str, limite: int = 100):
+    finder = index_manager.current if index_manager else None
+    if finder is None or finder.versions is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Nenhuma versão de catálogo carregada")
+    try:
+        return await run_in_threadpool(finder.versions.diff, de, para, limite)
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e.args[0]))
 
 @router.get("/health",
            tags=["Sistema"],
@@ -245,7 +715,7 @@ async def buscar_servicos(query: SearchQuery):
 async def health_check():
     """Endpoint para verificar a saúde dos serviços."""
     services_status = {
-        "finder": finder_instance is not None,
+        "finder": index_manager is not None,
         "reasoner": reasoner_instance is not None,
         "classifier": classifier_instance is not None,
         "web_researcher": web_researcher_instance is not None
@@ -255,5 +725,115 @@ async def health_check():
     
     return {
         "status": "healthy" if all_healthy else "unhealthy",
-        "services": services_status
-    }
\ No newline at end of file
+        "services": services_status,
+        "buscas": {"em_andamento": len(search_flights), **search_flights.stats}
+    }
+
+# --- API administrativa ---
+def _check_admin_token(token: Optional[str]):
+    """Valida o cabeçalho X-Admin-Token contra a variável de ambiente ADMIN_API_TOKEN."""
+    expected = os.getenv("ADMIN_API_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail="API administrativa desabilitada (ADMIN_API_TOKEN não configurado)")
+    if not token or not secrets.compare_digest(token, expected):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token administrativo inválido")
+
+@admin_router.post("/catalogo/delta",
+                   tags=["Administração"],
+                   summary="Insere, atualiza ou remove serviços do índice em execução")
+async def atualizar_catalogo(delta: CatalogDelta, x_admin_token: Optional[str] = Header(None)):
+    """
+    Aplica upserts (por fonte + código) e remoções no índice carregado, sem
+    reindexação completa. As buscas continuam sendo atendidas durante a atualização.
+    Durante uma reconstrução, a atualização vale imediatamente e é reaplicada
+    na nova geração antes da troca.
+    """
+    _check_admin_token(x_admin_token)
+    if index_manager is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Serviços não inicializados")
+    if not delta.upserts and not delta.deletes:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Nenhuma alteração informada")
+
+    upserts = None
+    if delta.upserts:
+        upserts = pd.DataFrame([item.model_dump() for item in delta.upserts]).rename(columns={'descricao': 'descricao_original'})
+        upserts = parse_prices(standardize_columns(upserts, "payload"))
+        invalid = upserts.loc[upserts['preco_invalido'], 'codigo'].tolist()
+        if invalid:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                                detail=f"Preços inválidos para os códigos: {invalid}")
+        upserts = upserts.drop(columns=['preco_invalido'])
+    deletes = [(item.codigo, item.fonte) for item in delta.deletes]
+
+    # A montagem do novo índice (normalização, embeddings) roda fora do event loop
+    return await run_in_threadpool(index_manager.apply_delta, upserts, deletes)
+
+@admin_router.post("/indice/reconstruir",
+                   status_code=status.HTTP_202_ACCEPTED,
+                   tags=["Administração"],
+                   summary="Reconstrói o índice em segundo plano e troca a geração em uso ao final")
+async def reconstruir_indice(force_reindex: bool = True, x_admin_token: Optional[str] = Header(None)):
+    _check_admin_token(x_admin_token)
+    if index_manager is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Serviços não inicializados")
+    if not index_manager.start_rebuild(force_reindex=force_reindex):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Já existe uma reconstrução em andamento")
+    return index_manager.describe()
+
+@admin_router.get("/indice/status",
+                  tags=["Administração"],
+                  summary="Estado da última reconstrução e gerações em uso")
+async def status_indice(x_admin_token: Optional[str] = Header(None)):
+    _check_admin_token(x_admin_token)
+    if index_manager is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Serviços não inicializados")
+    return index_manager.describe()
+
+@admin_router.get("/indice/validacao_precos",
+                  tags=["Administração"],
+                  summary="Relatório de validação de preços da última ingestão, por fonte")
+async def validacao_precos(x_admin_token: Optional[str] = Header(None)):
+    _check_admin_token(x_admin_token)
+    finder = index_manager.current if index_manager else None
+    if finder is None or finder.price_report is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Relatório de preços não disponível")
+    return finder.price_report
+
+@admin_router.get("/cache/estatisticas",
+                  tags=["Administração"],
+                  summary="Taxa de acerto, tamanhos, limites e TTLs do cache de resultados")
+async def estatisticas_cache(x_admin_token: Optional[str] = Header(None)):
+    _check_admin_token(x_admin_token)
+    if result_cache is None and answer_cache is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cache de resultados desativado")
+    stats = await run_in_threadpool(result_cache.describe) if result_cache is not None else {}
+    if answer_cache is not None:
+        stats["semantico"] = answer_cache.describe()
+    return stats
+
+@admin_router.post("/cache/limpar",
+                   tags=["Administração"],
+                   summary="Esvazia o cache de resultados (memória deste worker e disco) e o cache semântico")
+async def limpar_cache(x_admin_token: Optional[str] = Header(None)):
+    _check_admin_token(x_admin_token)
+    if result_cache is None and answer_cache is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cache de resultados desativado")
+    if result_cache is not None:
+        await run_in_threadpool(result_cache.clear)
+    if answer_cache is not None:
+        answer_cache.clear()
+    return await estatisticas_cache(x_admin_token)
+
+@admin_router.post("/indice/rollback",
+                   tags=["Administração"],
+                   summary="Volta para a geração anterior do índice")
+async def rollback_indice(x_admin_token: Optional[str] = Header(None)):
+    _check_admin_token(x_admin_token)
+    if index_manager is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Serviços não inicializados")
+    if not index_manager.rollback():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="Não há geração anterior disponível, há uma reconstrução ou atualização em andamento "
+                                   "ou o cache não pôde ser apontado para a geração anterior")
+    return index_manager.describe()
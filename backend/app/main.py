@@ -12,10 +12,13 @@ project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(_
 sys.path.insert(0, project_root)
 
 from backend.services.finder import ServicoFinder
+from backend.services.index_manager import IndexManager
 from backend.services.reasoner import ReasonerAgent
 from backend.services.classifier_agent import ClassifierAgent
 from backend.services.web_researcher_agent import WebResearcherAgent
-from backend.api.routes import router, set_service_instances
+from backend.services.result_cache import ResultCache
+from backend.services.semantic_cache import SemanticAnswerCache
+from backend.api.routes import router, admin_router, set_service_instances
 
 # --- Lógica de Inicialização e Ciclo de Vida da API ---
 # Instâncias globais
@@ -40,7 +43,22 @@ async def lifespan(app: FastAPI):
     DATA_FILE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'dados', 'banco_dados_servicos.txt')
     
     finder_instance = ServicoFinder()
-    finder_instance.load_and_index_services(data_filepath=DATA_FILE_PATH)
+    # Com INDEX_BUNDLE, o índice pré-construído é mapeado do bundle, sem reconstrução
+    bundle_path = os.getenv("INDEX_BUNDLE")
+    if bundle_path:
+        finder_instance.load_bundle(bundle_path)
+    else:
+        finder_instance.load_and_index_services(data_filepath=DATA_FILE_PATH)
+
+    # Versões do catálogo (um arquivo por mês de referência), se o diretório existir
+    VERSIONS_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'dados', 'versoes')
+    if os.path.isdir(VERSIONS_DIR):
+        finder_instance.load_versions(VERSIONS_DIR)
+
+    # Preços por UF / mês de referência / desoneração, se o arquivo existir
+    PRICES_FILE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'dados', 'precos_regionais.csv')
+    if os.path.exists(PRICES_FILE_PATH):
+        finder_instance.load_price_cube(PRICES_FILE_PATH)
     
     print("INFO: Inicializando o agente de raciocínio...")
     reasoner_instance = ReasonerAgent()
@@ -56,7 +74,11 @@ async def lifespan(app: FastAPI):
     print("INFO: Agente de pesquisa web inicializado com sucesso.")
     
     # Define as instâncias dos serviços no router
-    set_service_instances(finder_instance, reasoner_instance, classifier_instance, web_researcher_instance)
+    # O gerenciador permite reconstruir e trocar o índice sem reiniciar a aplicação
+    # Respostas da busca ficam em cache (memória + disco compartilhado entre workers)
+    result_cache = ResultCache.from_env(finder_instance.cache_dir)
+    set_service_instances(IndexManager(finder_instance, DATA_FILE_PATH), reasoner_instance, classifier_instance,
+                          web_researcher_instance, cache=result_cache, semantic_cache=SemanticAnswerCache())
     
     print("INFO: Aplicação pronta para receber requisições.")
     yield
@@ -74,6 +96,7 @@ app = FastAPI(
 
 # Inclui as rotas
 app.include_router(router)
+app.include_router(admin_router)
 
 
 # Endpoints são definidos em backend/api/routes.py
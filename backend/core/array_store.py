@@ -0,0 +1,302 @@
+# /core/array_store.py
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+def save_array(filepath: str, array) -> None:
+    """
+    Grava um array no formato .npy (cabeçalho pequeno + dados binários contíguos).
+    A escrita é feita em um arquivo temporário e publicada com rename, para que
+    um leitor nunca mapeie um arquivo pela metade.
+    """
+    array = np.ascontiguousarray(array)
+    tmp_path = f"{filepath}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array, allow_pickle=False)
+    os.replace(tmp_path, filepath)
+
+
+def load_array(filepath: str, mmap: bool = True) -> np.ndarray:
+    """
+    Abre um array .npy. Com mmap=True os dados não são copiados: o arquivo é
+    mapeado em modo copy-on-write, de forma que vários processos compartilham
+    as mesmas páginas físicas do cache de disco do sistema operacional.
+    """
+    return np.load(filepath, mmap_mode='c' if mmap else None, allow_pickle=False)
+
+
+def load_member(source, name: str, mmap: bool = True) -> np.ndarray:
+    """
+    Carrega o array `name` de `source`, que pode ser um diretório ou uma seção
+    de um bundle (objeto com `load_array(name, mmap)`), sem distinção para quem lê.
+    """
+    if isinstance(source, str):
+        return load_array(os.path.join(source, name), mmap=mmap)
+    return source.load_array(name, mmap=mmap)
+
+
+def read_json_member(source, name: str) -> dict:
+    """Lê o arquivo de metadados `name` de um diretório ou de uma seção de bundle."""
+    if isinstance(source, str):
+        with open(os.path.join(source, name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return source.read_json(name)
+
+
+class ArrayFileWriter:
+    """
+    Grava um array .npy de forma incremental, bloco a bloco, sem mantê-lo em
+    memória. Os blocos vão para um arquivo bruto e, no fechamento, o cabeçalho
+    .npy é escrito e os dados são copiados em streaming para o arquivo final.
+    """
+    def __init__(self, filepath: str, dtype, trailing_shape: tuple = None):
+        self.filepath = filepath
+        self.dtype = np.dtype(dtype)
+        # None: inferido do primeiro bloco (ex.: dimensão dos embeddings)
+        self.trailing_shape = trailing_shape
+        self.length = 0
+        self._raw_path = f"{filepath}.raw-{os.getpid()}"
+        self._raw = open(self._raw_path, 'wb')
+
+    def append(self, array):
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        if self.trailing_shape is None:
+            self.trailing_shape = array.shape[1:]
+        self._raw.write(array.tobytes())
+        self.length += len(array)
+
+    def close(self):
+        self._raw.close()
+        shape = (self.length,) + tuple(self.trailing_shape or ())
+        header = {'descr': np.lib.format.dtype_to_descr(self.dtype), 'fortran_order': False, 'shape': shape}
+        tmp_path = f"{self.filepath}.tmp-{os.getpid()}"
+        with open(tmp_path, 'wb') as out, open(self._raw_path, 'rb') as raw:
+            np.lib.format.write_array_header_1_0(out, header)
+            shutil.copyfileobj(raw, out, 1 << 20)
+        os.remove(self._raw_path)
+        os.replace(tmp_path, self.filepath)
+
+
+class TextColumn:
+    """
+    Coluna de texto em formato colunar: um blob UTF-8 contíguo e um vetor de
+    offsets (n + 1). Quando carregada do disco, ambos ficam mapeados em memória
+    e cada linha só é decodificada quando for lida.
+    """
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_texts(cls, texts):
+        encoded = [str(t).encode('utf-8') for t in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> str:
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return bytes(self.data[start:end]).decode('utf-8')
+
+    def take(self, indices) -> list[str]:
+        return [self[int(i)] for i in indices]
+
+    def to_list(self) -> list[str]:
+        return self.take(range(len(self)))
+
+    def extend(self, texts):
+        """Coluna com `texts` acrescentados ao final, sem copiar os dados atuais (ver AppendedTextColumn)."""
+        return AppendedTextColumn(self, tuple(str(t) for t in texts))
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + self.offsets.nbytes
+
+    def save(self, directory: str, name: str):
+        save_array(os.path.join(directory, f"{name}.data.npy"), self.data)
+        save_array(os.path.join(directory, f"{name}.offsets.npy"), self.offsets)
+
+    @classmethod
+    def load(cls, directory: str, name: str, mmap: bool = True):
+        return cls(load_member(directory, f"{name}.data.npy", mmap=mmap),
+                   load_member(directory, f"{name}.offsets.npy", mmap=mmap))
+
+
+class AppendedTextColumn:
+    """
+    TextColumn (em geral mapeada do disco) seguida de textos acrescentados em
+    memória pelas atualizações online. A base não é copiada; ao gravar, as duas
+    partes viram uma TextColumn contígua.
+    """
+    def __init__(self, base: TextColumn, tail: tuple):
+        self.base = base
+        self.tail = tail
+
+    def __len__(self):
+        return len(self.base) + len(self.tail)
+
+    def __getitem__(self, idx: int) -> str:
+        idx = int(idx)
+        return self.base[idx] if idx < len(self.base) else self.tail[idx - len(self.base)]
+
+    def take(self, indices) -> list[str]:
+        return [self[int(i)] for i in indices]
+
+    def to_list(self) -> list[str]:
+        return self.base.to_list() + list(self.tail)
+
+    def extend(self, texts):
+        return AppendedTextColumn(self.base, self.tail + tuple(str(t) for t in texts))
+
+    @property
+    def nbytes(self) -> int:
+        return self.base.nbytes + sum(len(t.encode('utf-8')) for t in self.tail)
+
+    def save(self, directory: str, name: str):
+        TextColumn.from_texts(self.to_list()).save(directory, name)
+
+
+class InternedTextColumn:
+    """
+    Coluna de texto com valores deduplicados: cada texto distinto é gravado uma
+    única vez e as linhas guardam apenas o id (int32) do seu texto.
+    """
+    def __init__(self, values: TextColumn, ids: np.ndarray):
+        self.values = values
+        self.ids = ids
+        # Texto -> id, montado na primeira chamada de `append` e compartilhado
+        # pelas colunas derivadas (só cresce: ids nunca são reaproveitados)
+        self._lookup = None
+
+    @classmethod
+    def from_texts(cls, texts):
+        ids, uniques = pd.factorize(pd.Series(texts, dtype=object).astype(str), sort=False)
+        return cls(TextColumn.from_texts(uniques), ids.astype(np.int32))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, idx: int) -> str:
+        return self.values[int(self.ids[idx])]
+
+    def take(self, indices) -> list[str]:
+        return [self[int(i)] for i in indices]
+
+    def to_list(self) -> list[str]:
+        return self.take(range(len(self)))
+
+    def append(self, texts):
+        """
+        Nova coluna com as linhas `texts` acrescentadas ao final; a coluna atual
+        não muda. Textos já existentes reaproveitam o id, os demais entram no
+        fim dos valores. Retorna a coluna e os textos novos, na ordem dos seus ids.
+        """
+        if self._lookup is None:
+            self._lookup = {text: i for i, text in enumerate(self.values.to_list())}
+        # Entradas acima do tamanho atual vêm de uma atualização que não chegou a ser usada
+        known = len(self.values)
+        new_texts, ids = {}, np.empty(len(texts), dtype=np.int32)
+        for i, text in enumerate(str(t) for t in texts):
+            text_id = self._lookup.get(text, known)
+            if text_id >= known:
+                text_id = new_texts.setdefault(text, known + len(new_texts))
+            ids[i] = text_id
+        column = InternedTextColumn(self.values.extend(new_texts) if new_texts else self.values,
+                                    np.concatenate([self.ids, ids]))
+        self._lookup.update(new_texts)
+        column._lookup = self._lookup
+        return column, list(new_texts)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.ids.nbytes
+
+    def save(self, directory: str, name: str):
+        self.values.save(directory, f"{name}.values")
+        save_array(os.path.join(directory, f"{name}.ids.npy"), self.ids)
+
+    @classmethod
+    def load(cls, directory: str, name: str, mmap: bool = True):
+        return cls(TextColumn.load(directory, f"{name}.values", mmap=mmap),
+                   load_member(directory, f"{name}.ids.npy", mmap=mmap))
+
+
+class TextColumnWriter:
+    """Grava uma TextColumn incrementalmente (blob UTF-8 + offsets) em `directory`."""
+    def __init__(self, directory: str, name: str):
+        self._data = ArrayFileWriter(os.path.join(directory, f"{name}.data.npy"), np.uint8)
+        self._offsets = ArrayFileWriter(os.path.join(directory, f"{name}.offsets.npy"), np.int64)
+        self._offsets.append(np.zeros(1, dtype=np.int64))
+        self._end = 0
+
+    def append(self, texts):
+        encoded = [str(t).encode('utf-8') for t in texts]
+        if not encoded:
+            return
+        ends = self._end + np.cumsum([len(e) for e in encoded], dtype=np.int64)
+        self._data.append(np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        self._offsets.append(ends)
+        self._end = int(ends[-1])
+
+    def close(self):
+        self._data.close()
+        self._offsets.close()
+
+
+class InternedTextWriter:
+    """
+    Grava uma InternedTextColumn incrementalmente. Para deduplicar, só o hash
+    de 16 bytes de cada texto distinto fica em memória, em um array ordenado
+    (~20 bytes por texto, contra ~150 de um dict); os textos vão direto para o disco.
+    """
+    def __init__(self, directory: str, name: str):
+        self._values = TextColumnWriter(directory, f"{name}.values")
+        self._ids = ArrayFileWriter(os.path.join(directory, f"{name}.ids.npy"), np.int32)
+        self._hashes = np.zeros(0, dtype='S16')
+        self._hash_ids = np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        """Número de textos distintos gravados."""
+        return len(self._hashes)
+
+    def append(self, texts):
+        """
+        Acrescenta as linhas. Retorna o id do texto de cada linha e os textos
+        vistos pela primeira vez, na ordem dos seus ids (ids >= len antes da chamada).
+        """
+        texts = [str(text) for text in texts]
+        hashes = np.array([hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest() for text in texts],
+                          dtype='S16')
+        uniques, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+        unique_ids = np.empty(len(uniques), dtype=np.int32)
+        positions = np.searchsorted(self._hashes, uniques)
+        known = positions < len(self._hashes)
+        known[known] = self._hashes[positions[known]] == uniques[known]
+        unique_ids[known] = self._hash_ids[positions[known]]
+
+        # Textos novos recebem ids na ordem da primeira ocorrência no bloco
+        new = np.flatnonzero(~known)
+        new = new[np.argsort(first[new], kind='stable')]
+        unique_ids[new] = len(self._hashes) + np.arange(len(new), dtype=np.int32)
+        new_texts = [texts[i] for i in first[new]]
+
+        added = np.sort(new)
+        self._hashes = np.insert(self._hashes, positions[added], uniques[added])
+        self._hash_ids = np.insert(self._hash_ids, positions[added], unique_ids[added])
+        ids = unique_ids[inverse.reshape(-1)] if len(texts) else np.zeros(0, dtype=np.int32)
+        self._values.append(new_texts)
+        self._ids.append(ids)
+        return ids, new_texts
+
+    def close(self):
+        self._values.close()
+        self._ids.close()
@@ -0,0 +1,139 @@
+# /core/concurrency.py
+import os
+import asyncio
+import time
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Etapas de CPU da busca (embeddings da consulta, BM25, fusão) rodam neste pool,
+# fora do event loop. O limite evita que muitas buscas simultâneas disputem os
+# mesmos núcleos; as chamadas aos LLMs não ocupam o pool.
+CPU_WORKERS = int(os.getenv("SEARCH_CPU_WORKERS", min(4, os.cpu_count() or 1)))
+_cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="busca-cpu")
+
+
+async def run_cpu_bound(func, *args, **kwargs):
+    """Executa `func` no pool de CPU e aguarda o resultado sem bloquear o event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_cpu_executor, functools.partial(func, *args, **kwargs))
+
+
+# Trabalho especulativo (cujo resultado pode ser descartado) roda em um pool
+# próprio, pequeno e com prioridade baixa: cancelar a tarefa não interrompe a
+# thread, então a especulação nunca pode ocupar vagas do pool da busca.
+SPECULATIVE_WORKERS = int(os.getenv("SEARCH_SPECULATIVE_WORKERS", 1))
+_speculative_slots = threading.BoundedSemaphore(SPECULATIVE_WORKERS)
+
+
+def _lower_thread_priority():
+    # No Linux a prioridade (nice) vale por thread; em outros sistemas segue a padrão
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
+
+
+_speculative_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="busca-especulativa",
+                                           initializer=_lower_thread_priority)
+
+
+async def run_speculative(func, *args, **kwargs):
+    """
+    Executa `func` no pool especulativo. Se todas as vagas estiverem ocupadas,
+    não enfileira: retorna None sem executar, e quem precisar do resultado
+    faz o trabalho pelo caminho normal.
+    """
+    if not _speculative_slots.acquire(blocking=False):
+        return None
+    future = _speculative_executor.submit(func, *args, **kwargs)
+    # A vaga só é liberada quando a thread termina (ou a tarefa é cancelada antes de começar)
+    future.add_done_callback(lambda _: _speculative_slots.release())
+    return await asyncio.wrap_future(future)
+
+
+class StageGraph:
+    """
+    DAG de etapas assíncronas. Cada etapa começa assim que suas dependências
+    terminam, de forma que etapas independentes rodam ao mesmo tempo e a
+    latência total é a do caminho crítico.
+
+    Uma etapa é uma corrotina `func(graph)`; os resultados das dependências
+    estão em `graph.results`. Etapas especulativas (`speculative=True`) não
+    são aguardadas no final: quem precisar do resultado usa `await
+    graph.result(nome)`; se ninguém usar, são canceladas e descartadas.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.results = {}
+        self.timings = {}
+        self._tasks = {}
+        self._start = None
+
+    def add(self, name: str, func, deps=(), speculative: bool = False):
+        # Dependências precisam ser declaradas antes: o grafo é acíclico por construção
+        unknown = [dep for dep in deps if dep not in self.stages]
+        if unknown:
+            raise ValueError(f"Etapa '{name}' depende de etapas não declaradas: {unknown}")
+        self.stages[name] = (func, tuple(deps), speculative)
+
+    async def result(self, name: str):
+        """Aguarda o resultado de uma etapa (inclusive especulativa)."""
+        return await self._tasks[name]
+
+    async def _run_stage(self, name: str):
+        func, deps, _ = self.stages[name]
+        for dep in deps:
+            await self._tasks[dep]
+        started = time.perf_counter()
+        result = await func(self)
+        self.results[name] = result
+        self.timings[name] = {'inicio_ms': round((started - self._start) * 1000, 1),
+                              'duracao_ms': round((time.perf_counter() - started) * 1000, 1)}
+        return result
+
+    async def run(self) -> dict:
+        """Executa o grafo e retorna os resultados das etapas concluídas. Se uma etapa falhar, as demais são canceladas."""
+        self._start = time.perf_counter()
+        self._tasks = {name: asyncio.ensure_future(self._run_stage(name)) for name in self.stages}
+        required = [task for name, task in self._tasks.items() if not self.stages[name][2]]
+        try:
+            await asyncio.gather(*required)
+        finally:
+            for task in self._tasks.values():
+                task.cancel()
+            # Recolhe cancelamentos e erros de etapas descartadas
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        return self.results
+
+
+class SingleFlight:
+    """
+    Coalescência de chamadas idênticas em andamento: enquanto a primeira
+    chamada de uma chave não termina, as seguintes aguardam o mesmo resultado
+    (ou a mesma exceção) em vez de repetir o trabalho. Nada fica guardado
+    depois que a chamada termina.
+    """
+    def __init__(self):
+        self._inflight = {}
+        self.stats = {'executadas': 0, 'compartilhadas': 0}
+
+    def __len__(self):
+        return len(self._inflight)
+
+    async def run(self, key, func):
+        """
+        Executa `func()` (corrotina) para `key`, ou aguarda a execução já em
+        andamento. Retorna (resultado, compartilhado). O cancelamento de um dos
+        chamadores (ex.: cliente desconectado) não cancela a execução dos demais.
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+        if shared:
+            self.stats['compartilhadas'] += 1
+        else:
+            self.stats['executadas'] += 1
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task), shared
@@ -1,47 +1,106 @@
 # /core/text_utils.py
 import re
 import unicodedata
-from openai import OpenAI
+from functools import lru_cache
+from openai import AsyncOpenAI
 
 class TextNormalizer:
-    def __init__(self):
+    """
+    Normalizador de descrições de serviços.
+    Todas as substituições são compiladas em uma única expressão com alternância,
+    resolvida por uma tabela de despacho em uma só passada pelo texto.
+    """
+    # Incrementar sempre que a saída de normalize mudar: invalida os índices em cache
+    VERSION = 1
+
+    def __init__(self, cache_size: int = 4096):
         self.substitutions = {
             r'\b(m2|m²)\b': ' metro_quadrado ', r'\b(m3|m³)\b': ' metro_cubico ',
-            r'\b(pol|polegadas|")\b': ' polegada ', r'\b(ø)\b': ' diametro ',
+            # As aspas não casam quando vizinhas de m2/m3: na aplicação sequencial
+            # original a substituição anterior já as teria cercado de espaços
+            r'\b(pol|polegadas|(?<!\bm[23])"(?!m[23]\b))\b': ' polegada ', r'\b(ø)\b': ' diametro ',
             r'\b(conc)\b': 'concreto', r'\b(arm)\b': 'armado', r'\b(est)\b': 'estrutural',
             r'\b(galv)\b': 'galvanizado', r'\b(exec)\b': 'execucao',
             r'\b(fornec)\b': 'fornecimento', r'\b(inst)\b': 'instalacao',
             r'\b(diam)\b': 'diametro', r'\bfck\b': 'fck', r'\b(mpa)\b': 'mpa',
             r'\b(kv)\b': 'kv', r'\b(mm2|mm²)\b': 'mm2', r'\b(btu)\b': 'btu'
         }
+        self._compile()
+        # Memo limitado para as chamadas em tempo de consulta (a mesma query é
+        # normalizada pelas buscas semântica e por palavras-chave)
+        self._normalize_cached = lru_cache(maxsize=cache_size)(self._normalize_uncached)
 
-    def normalize(self, text: str) -> str:
-        if not isinstance(text, str): return ''
+    def _compile(self):
+        """
+        Compila as substituições em uma única regex.
+        Cada padrão vira um grupo nomeado; o nome do grupo que casou indexa a
+        tabela de despacho com o texto de substituição.
+        """
+        alternatives = []
+        self._dispatch = {}
+        for i, (pattern, replacement) in enumerate(self.substitutions.items()):
+            group_name = f"s{i}"
+            alternatives.append(f"(?P<{group_name}>{pattern})")
+            self._dispatch[group_name] = replacement
+        self._combined_pattern = re.compile('|'.join(alternatives), flags=re.IGNORECASE)
+        self._cleanup_pattern = re.compile(r'[^a-z0-9_., ]')
+
+    def _replace_match(self, match) -> str:
+        return self._dispatch[match.lastgroup]
+
+    def _normalize_uncached(self, text: str) -> str:
         text = text.lower()
         text = str(unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('utf-8', 'ignore'))
 
-        for pattern, replacement in self.substitutions.items():
-            text = re.sub(pattern, replacement, text, flags=re.IGNORECASE)
-            
+        text = self._combined_pattern.sub(self._replace_match, text)
+
         # Remove caracteres especiais mas PRESERVA números, pontos e vírgulas (para decimais)
-        text = re.sub(r'[^a-z0-9_., ]', ' ', text)
+        text = self._cleanup_pattern.sub(' ', text)
         text = ' '.join(text.split())
         return text
 
+    def normalize(self, text: str) -> str:
+        if not isinstance(text, str): return ''
+        return self._normalize_cached(text)
+
+    def normalize_many(self, texts) -> list[str]:
+        """
+        Normaliza uma coleção de textos de uma só vez (caminho de ingestão).
+        Textos repetidos são normalizados apenas uma vez e o memo de consultas
+        não é poluído com o catálogo inteiro.
+        """
+        unique_results = {}
+        results = []
+        for text in texts:
+            if not isinstance(text, str):
+                results.append('')
+                continue
+            normalized = unique_results.get(text)
+            if normalized is None:
+                normalized = self._normalize_uncached(text)
+                unique_results[text] = normalized
+            results.append(normalized)
+        return results
 
-def get_neighborhood(df, center_index, radius=5):
-    """Função auxiliar para pegar os vizinhos de um item no DataFrame."""
+
+def get_neighborhood(catalog, center_index, radius=5):
+    """Função auxiliar para pegar os vizinhos de um item no catálogo."""
     start = max(0, center_index - radius)
-    end = min(len(df), center_index + radius + 1)
-    return df.iloc[start:end].to_dict('records')
+    end = min(len(catalog), center_index + radius + 1)
+    return catalog.rows(range(start, end))
+
 
+_keywords_client = None
 
-def extract_core_keywords(query: str):
-    """Usa um LLM para extrair os termos chave de uma query."""
-    client = OpenAI()
+async def extract_core_keywords(query: str):
+    """Usa um LLM para extrair os termos chave de uma query (chamada assíncrona, sem bloquear o event loop)."""
+    global _keywords_client
+    if _keywords_client is None:
+        # Um cliente por processo: reaproveita as conexões HTTP entre requisições
+        _keywords_client = AsyncOpenAI()
     prompt = f"Extraia os 3-4 substantivos ou termos técnicos mais importantes da seguinte solicitação de construção civil: '{query}'. Retorne apenas os termos separados por espaço."
     try:
-        response = client.chat.completions.create(
+        response = await _keywords_client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.0
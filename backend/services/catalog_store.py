@@ -0,0 +1,362 @@
+# /services/catalog_store.py
+import os
+import copy
+import json
+import numpy as np
+import pandas as pd
+from backend.core.array_store import (save_array, load_member, ArrayFileWriter, TextColumn, TextColumnWriter,
+                                     InternedTextColumn, InternedTextWriter)
+
+
+class CatalogStore:
+    """
+    Catálogo de serviços em representação compacta e colunar.
+    As colunas "quentes" ficam em memória: códigos, atributos de baixa
+    cardinalidade (fonte, grupo, unidade) como categorias e o preço como float64
+    (float32 não representa centavos exatos e altera os valores devolvidos).
+    As descrições são deduplicadas, mapeadas do disco e lidas sob demanda,
+    por id de linha, apenas na montagem dos resultados.
+
+    Atualizações online (`apply_delta`) acrescentam linhas ao final e marcam as
+    substituídas/removidas em `deleted` (tombstones); elas continuam nos arrays,
+    mas não aparecem nas buscas, no índice por código nem em `len`.
+    """
+    CATEGORICAL_COLUMNS = ['unidade', 'fonte', 'grupo']
+    TEXT_COLUMNS = ['descricao_original', 'descricao_normalizada']
+    # Colunas de texto devolvidas ao hidratar uma linha; a descrição normalizada
+    # só interessa à indexação e não entra no caminho de busca
+    ROW_TEXT_COLUMNS = ['descricao_original']
+    # Coluna cujos textos distintos são os documentos do índice de busca (BM25 e embeddings)
+    INDEXED_TEXT_COLUMN = 'descricao_normalizada'
+    META_FILENAME = 'catalog.json'
+
+    def __init__(self, codigos: np.ndarray, categorical_columns: dict, precos: np.ndarray, text_columns: dict):
+        self.codigos = codigos
+        self.categorical_columns = categorical_columns
+        self.precos = precos
+        self.text_columns = text_columns
+        # Máscara das linhas removidas por atualizações online, ou None
+        self.deleted = None
+        self._text_members = None
+        # Índice por código das linhas carregadas (hash montado na primeira consulta)
+        # e, à parte, as linhas acrescentadas por atualizações online
+        self.code_index = pd.Index(codigos)
+        self._appended_codes = {}
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame, text_columns: dict = None):
+        """
+        Monta o catálogo a partir do DataFrame de ingestão. `text_columns` permite
+        passar colunas de texto já internadas (ex.: compartilhadas entre versões).
+        """
+        codigos = df['codigo'].astype(str).to_numpy(dtype=object)
+        categorical_columns = {col: pd.Categorical(df[col].astype(str)) for col in cls.CATEGORICAL_COLUMNS}
+        precos = df['preco'].to_numpy(dtype=np.float64)
+        if text_columns is None:
+            text_columns = {col: InternedTextColumn.from_texts(df[col]) for col in cls.TEXT_COLUMNS}
+        return cls(codigos, categorical_columns, precos, text_columns)
+
+    def __len__(self):
+        """Número de linhas vivas (sem as removidas por atualizações online)."""
+        return len(self.codigos) - (0 if self.deleted is None else int(self.deleted.sum()))
+
+    def live_rows(self) -> np.ndarray:
+        """Ids das linhas vivas, em ordem."""
+        if self.deleted is None:
+            return np.arange(len(self.codigos))
+        return np.flatnonzero(~self.deleted)
+
+    def column(self, name: str):
+        """Retorna uma coluna do catálogo (array em memória ou coluna de texto lazy)."""
+        if name == 'codigo':
+            return self.codigos
+        if name == 'preco':
+            return self.precos
+        if name in self.categorical_columns:
+            return self.categorical_columns[name]
+        return self.text_columns[name]
+
+    def rows_of_codes(self, codigos) -> np.ndarray:
+        """Linhas vivas, em ordem, com algum dos códigos."""
+        codigos = [str(codigo) for codigo in codigos]
+        positions = self.code_index.get_indexer_non_unique(pd.Index(codigos, dtype=object))[0]
+        rows = [positions[positions >= 0]]
+        rows += [np.asarray(self._appended_codes[codigo]) for codigo in codigos if codigo in self._appended_codes]
+        rows = np.unique(np.concatenate(rows).astype(np.int64))
+        return rows if self.deleted is None else rows[~self.deleted[rows]]
+
+    def row_of(self, codigo: str):
+        """Retorna o id da (primeira) linha de um código, ou None se não existir."""
+        rows = self.rows_of_codes([codigo])
+        return int(rows[0]) if len(rows) else None
+
+    def row(self, idx: int) -> dict:
+        """Hidrata uma linha completa do catálogo."""
+        idx = int(idx)
+        record = {'codigo': self.codigos[idx], 'preco': float(self.precos[idx])}
+        for col, values in self.categorical_columns.items():
+            record[col] = values[idx]
+        for col in self.ROW_TEXT_COLUMNS:
+            record[col] = self.text_columns[col][idx]
+        return record
+
+    def rows(self, indices) -> list[dict]:
+        return [self.row(idx) for idx in indices]
+
+    def indexed_texts(self) -> list[str]:
+        """Textos distintos indexados, na ordem dos ids usados pelo índice de busca."""
+        return self.text_columns[self.INDEXED_TEXT_COLUMN].values.to_list()
+
+    def text_weights(self) -> np.ndarray:
+        """Número de linhas de cada texto indexado (0 para textos sem linhas neste catálogo)."""
+        return np.diff(self._members()[1]).astype(np.int32)
+
+    def _members(self):
+        """
+        Linhas agrupadas por texto indexado (ordem, offsets) e máscara dos textos
+        sem linhas (ou None), calculadas na primeira busca.
+        """
+        if self._text_members is None:
+            column = self.text_columns[self.INDEXED_TEXT_COLUMN]
+            ids = np.asarray(column.ids)
+            rows = None
+            if self.deleted is not None:
+                rows = self.live_rows()
+                ids = ids[rows]
+            offsets = np.zeros(len(column.values) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(ids, minlength=len(column.values)), out=offsets[1:])
+            missing = offsets[1:] == offsets[:-1]
+            order = np.argsort(ids, kind='stable')
+            self._text_members = (order if rows is None else rows[order], offsets, missing if missing.any() else None)
+        return self._text_members
+
+    def missing_texts(self):
+        """Máscara dos textos indexados sem nenhuma linha neste catálogo, ou None se todos têm linhas."""
+        return self._members()[2]
+
+    def expand_texts(self, text_ids, limit: int):
+        """
+        Fan-out de resultados do índice (um por texto distinto) para as linhas
+        do catálogo: até `limit` linhas, na ordem de `text_ids` e, dentro de
+        cada texto, na ordem do catálogo. Retorna as linhas e, para cada uma,
+        a posição do seu texto em `text_ids`.
+        """
+        order, offsets, _ = self._members()
+        text_ids = np.asarray(text_ids, dtype=np.int64)
+        counts = offsets[text_ids + 1] - offsets[text_ids]
+        ends = np.cumsum(counts)
+        needed = int(np.searchsorted(ends, limit)) + 1
+        text_ids, counts, ends = text_ids[:needed], counts[:needed], ends[:needed]
+        positions = np.repeat(np.arange(len(text_ids)), counts)
+        rows = order[np.repeat(offsets[text_ids] - (ends - counts), counts) + np.arange(len(positions))]
+        return rows[:limit], positions[:limit]
+
+    def apply_delta(self, removed_rows, appended: pd.DataFrame):
+        """
+        Novo catálogo com `removed_rows` marcadas como removidas e as linhas de
+        `appended` (colunas de `from_dataframe`, com a descrição normalizada)
+        acrescentadas ao final, sem alterar este catálogo (buscas em andamento
+        continuam nele). Nada é reconstruído: os arrays por linha só ganham as
+        linhas novas e os agrupamentos por texto e por código só mudam nos
+        textos e códigos tocados. Retorna o catálogo e os textos indexados
+        novos, na ordem dos seus ids.
+        """
+        removed_rows = np.unique(np.asarray(removed_rows, dtype=np.int64))
+        start = len(self.codigos)
+        appended_rows = np.arange(start, start + len(appended))
+        old_ids = np.asarray(self.text_columns[self.INDEXED_TEXT_COLUMN].ids)
+        order, offsets, _ = self._members()
+
+        catalog = copy.copy(self)
+        catalog.codigos = np.concatenate([self.codigos, appended['codigo'].astype(str).to_numpy(dtype=object)])
+        catalog.precos = np.concatenate([self.precos, appended['preco'].to_numpy(dtype=np.float64)])
+        catalog.categorical_columns = {col: _append_categorical(values, appended[col].astype(str))
+                                       for col, values in self.categorical_columns.items()}
+        catalog.text_columns, new_texts = {}, {}
+        for col, column in self.text_columns.items():
+            catalog.text_columns[col], new_texts[col] = column.append(appended[col].tolist())
+
+        deleted = np.zeros(len(catalog.codigos), dtype=bool)
+        if self.deleted is not None:
+            deleted[:start] = self.deleted
+        deleted[removed_rows] = True
+        catalog.deleted = deleted if deleted.any() else None
+
+        catalog._appended_codes = dict(self._appended_codes)
+        for row, codigo in zip(appended_rows, catalog.codigos[start:]):
+            catalog._appended_codes[codigo] = catalog._appended_codes.get(codigo, ()) + (int(row),)
+
+        # Agrupamento por texto: tira as linhas removidas e põe as novas no fim do grupo do seu texto
+        new_ids = np.asarray(catalog.text_columns[self.INDEXED_TEXT_COLUMN].ids)[start:]
+        text_count = len(catalog.text_columns[self.INDEXED_TEXT_COLUMN].values)
+        removed_ids = old_ids[removed_rows]
+        positions = np.array([offsets[t] + np.searchsorted(order[offsets[t]:offsets[t + 1]], row)
+                              for row, t in zip(removed_rows, removed_ids)], dtype=np.int64)
+        counts = np.zeros(text_count, dtype=np.int64)
+        counts[:len(offsets) - 1] = np.diff(offsets)
+        counts -= np.bincount(removed_ids, minlength=text_count)
+        group_ends = np.cumsum(counts)
+        by_text = np.argsort(new_ids, kind='stable')
+        order = np.insert(np.delete(order, positions), group_ends[new_ids[by_text]], appended_rows[by_text])
+        counts += np.bincount(new_ids, minlength=text_count)
+        offsets = np.zeros(text_count + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        missing = counts == 0
+        catalog._text_members = (order, offsets, missing if missing.any() else None)
+        return catalog, new_texts[self.INDEXED_TEXT_COLUMN]
+
+    def to_dataframe(self, indices=None) -> pd.DataFrame:
+        """Materializa as linhas indicadas (todas as vivas, por padrão) no formato de ingestão."""
+        indices = self.live_rows() if indices is None else np.asarray(indices, dtype=np.int64)
+        frame = {'codigo': self.codigos[indices]}
+        for col, values in self.categorical_columns.items():
+            frame[col] = np.asarray(values, dtype=object)[indices]
+        frame['preco'] = self.precos[indices]
+        frame['descricao_original'] = self.text_columns['descricao_original'].take(indices)
+        return pd.DataFrame(frame)
+
+    def match_rows(self, new_df: pd.DataFrame) -> np.ndarray:
+        """
+        Compara um novo DataFrame de origem com o catálogo atual, por código
+        (dentro de cada fonte). Retorna, para cada linha de `new_df`, a linha do
+        catálogo atual com conteúdo idêntico, ou -1 se a linha é nova ou mudou.
+        """
+        key = ['fonte', 'codigo']
+        compared = ['descricao_original', 'unidade', 'grupo', 'preco']
+        live = self.live_rows()
+        current = pd.DataFrame({
+            'codigo': self.codigos[live],
+            'fonte': np.asarray(self.categorical_columns['fonte'], dtype=object)[live],
+            'unidade': np.asarray(self.categorical_columns['unidade'], dtype=object)[live],
+            'grupo': np.asarray(self.categorical_columns['grupo'], dtype=object)[live],
+            'preco': self.precos[live],
+            'descricao_original': self.text_columns['descricao_original'].take(live),
+            '_linha_atual': live,
+        }).drop_duplicates(key)
+        incoming = new_df[key + compared].astype({col: str for col in key + compared if col != 'preco'})
+        incoming = incoming.astype({'preco': np.float64})
+        merged = incoming.merge(current, on=key, how='left', suffixes=('', '_atual'))
+
+        same = merged['_linha_atual'].notna().to_numpy()
+        for col in compared:
+            same = same & (merged[col] == merged[f"{col}_atual"]).to_numpy()
+        return np.where(same, merged['_linha_atual'].fillna(-1).to_numpy(), -1).astype(np.int64)
+
+    def memory_usage(self) -> dict:
+        """
+        Bytes ocupados pelo catálogo. 'memoria' é o que fica residente no processo;
+        'mapeado' são as colunas de texto, servidas pelo cache de páginas do sistema.
+        """
+        resident = (pd.Series(self.codigos).memory_usage(deep=True, index=False)
+                    + self.precos.nbytes
+                    + sum(col.memory_usage(deep=True) for col in self.categorical_columns.values())
+                    + self.code_index.memory_usage(deep=True))
+        mapped = sum(col.nbytes for col in self.text_columns.values())
+        return {'memoria': int(resident), 'mapeado': int(mapped)}
+
+    def save(self, directory: str, shared_text_values: bool = False):
+        """
+        Grava o catálogo em `directory`. Com `shared_text_values`, as colunas de
+        texto gravam apenas os ids; os valores são gravados uma vez por quem os
+        compartilha e passados de volta a `load`.
+        Linhas removidas por atualizações online não são gravadas; os ids de
+        texto (e portanto BM25 e embeddings) continuam os mesmos.
+        """
+        if self.deleted is not None:
+            live = self.live_rows()
+            compact = CatalogStore(self.codigos[live], {col: values[live] for col, values in self.categorical_columns.items()},
+                                   self.precos[live], {col: InternedTextColumn(column.values, np.asarray(column.ids)[live])
+                                                       for col, column in self.text_columns.items()})
+            return compact.save(directory, shared_text_values=shared_text_values)
+        os.makedirs(directory, exist_ok=True)
+        TextColumn.from_texts(self.codigos).save(directory, 'codigo')
+        save_array(os.path.join(directory, 'preco.npy'), self.precos)
+        for col, values in self.categorical_columns.items():
+            save_array(os.path.join(directory, f"{col}.codes.npy"), values.codes)
+            TextColumn.from_texts(values.categories).save(directory, f"{col}.categories")
+        for col, values in self.text_columns.items():
+            if shared_text_values:
+                save_array(os.path.join(directory, f"{col}.ids.npy"), values.ids)
+            else:
+                values.save(directory, col)
+        # O arquivo de metadados é gravado por último e marca o catálogo como completo
+        with open(os.path.join(directory, self.META_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump({'rows': len(self), 'categorical_columns': self.CATEGORICAL_COLUMNS,
+                       'text_columns': self.TEXT_COLUMNS}, f)
+
+    @classmethod
+    def exists(cls, directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, cls.META_FILENAME))
+
+    @classmethod
+    def load(cls, directory, text_values: dict = None):
+        """
+        Carrega o catálogo de um diretório ou de uma seção de bundle. `text_values`
+        fornece os valores compartilhados das colunas de texto (ver `save`).
+        """
+        codigos = np.array(TextColumn.load(directory, 'codigo', mmap=False).to_list(), dtype=object)
+        precos = load_member(directory, 'preco.npy', mmap=False)
+        categorical_columns = {
+            col: pd.Categorical.from_codes(load_member(directory, f"{col}.codes.npy", mmap=False),
+                                           TextColumn.load(directory, f"{col}.categories", mmap=False).to_list())
+            for col in cls.CATEGORICAL_COLUMNS
+        }
+        if text_values is not None:
+            text_columns = {col: InternedTextColumn(text_values[col], load_member(directory, f"{col}.ids.npy"))
+                            for col in cls.TEXT_COLUMNS}
+        else:
+            text_columns = {col: InternedTextColumn.load(directory, col) for col in cls.TEXT_COLUMNS}
+        return cls(codigos, categorical_columns, precos, text_columns)
+
+
+def _append_categorical(values: pd.Categorical, new_values: pd.Series) -> pd.Categorical:
+    """Categorical com `new_values` ao final; categorias novas entram depois das existentes."""
+    categories = values.categories
+    unseen = pd.Index(new_values.unique()).difference(categories, sort=False)
+    if len(unseen):
+        categories = categories.append(unseen)
+    codes = categories.get_indexer(new_values)
+    return pd.Categorical.from_codes(np.concatenate([values.codes, codes]), categories=categories)
+
+
+class CatalogWriter:
+    """
+    Grava um catálogo no mesmo layout de `CatalogStore.save`, bloco a bloco,
+    para a ingestão em streaming. Nenhuma descrição fica retida em memória.
+    """
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.rows = 0
+        self._codigos = TextColumnWriter(directory, 'codigo')
+        self._precos = ArrayFileWriter(os.path.join(directory, 'preco.npy'), np.float64)
+        self._codes = {col: ArrayFileWriter(os.path.join(directory, f"{col}.codes.npy"), np.int32)
+                       for col in CatalogStore.CATEGORICAL_COLUMNS}
+        self._categories = {col: {} for col in CatalogStore.CATEGORICAL_COLUMNS}
+        self._texts = {col: InternedTextWriter(directory, col) for col in CatalogStore.TEXT_COLUMNS}
+
+    def append(self, df: pd.DataFrame) -> dict:
+        """
+        Grava um bloco; retorna, por coluna de texto, (id do texto de cada linha,
+        textos distintos novos neste bloco), como em `InternedTextWriter.append`.
+        """
+        self._codigos.append(df['codigo'].astype(str))
+        self._precos.append(df['preco'].to_numpy(dtype=np.float64))
+        for col, categories in self._categories.items():
+            values = df[col].astype(str)
+            self._codes[col].append(np.array([categories.setdefault(v, len(categories)) for v in values], dtype=np.int32))
+        new_texts = {col: writer.append(df[col].tolist()) for col, writer in self._texts.items()}
+        self.rows += len(df)
+        return new_texts
+
+    def close(self):
+        self._codigos.close()
+        self._precos.close()
+        for col, writer in self._codes.items():
+            writer.close()
+            TextColumn.from_texts(list(self._categories[col])).save(self.directory, f"{col}.categories")
+        for writer in self._texts.values():
+            writer.close()
+        with open(os.path.join(self.directory, CatalogStore.META_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump({'rows': self.rows, 'categorical_columns': CatalogStore.CATEGORICAL_COLUMNS,
+                       'text_columns': CatalogStore.TEXT_COLUMNS}, f)
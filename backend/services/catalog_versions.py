@@ -0,0 +1,197 @@
+# /services/catalog_versions.py
+import os
+import glob
+import json
+import shutil
+import numpy as np
+import pandas as pd
+import torch
+from backend.core.array_store import save_array, load_array, TextColumn, InternedTextColumn
+from backend.services.catalog_store import CatalogStore
+from backend.services.keyword_index import KeywordIndex
+from backend.services.embedding_matrix import EmbeddingMatrix
+from backend.services.ingest import read_source
+from backend.services.index_manifest import build_manifest, is_compatible, source_unchanged
+
+# Extensões aceitas no diretório de versões; o nome do arquivo (sem extensão) é o nome da versão
+VERSION_FILE_PATTERNS = ('*.txt', '*.csv')
+
+
+def discover_versions(versions_dir: str) -> dict:
+    """Mapeia nome da versão (ex.: '2025-07') -> arquivo de dados, em ordem de nome."""
+    paths = sorted(path for pattern in VERSION_FILE_PATTERNS for path in glob.glob(os.path.join(versions_dir, pattern)))
+    return {os.path.splitext(os.path.basename(path))[0]: path for path in paths}
+
+
+class CatalogVersionSet:
+    """
+    Várias versões do catálogo (ex.: meses de referência do SINAPI/SICRO)
+    carregadas lado a lado. As descrições (original e normalizada) são
+    internadas em um único conjunto de textos distintos; embeddings e postings
+    do BM25 existem uma vez por texto distinto. Cada versão guarda apenas
+    códigos, preços, atributos categóricos e os ids dos seus textos, e tem
+    uma visão própria do BM25 (mesmos postings, pesos = linhas da versão).
+    """
+    MANIFEST_FILENAME = 'versoes.json'
+
+    def __init__(self, catalogs: dict, keyword_index: KeywordIndex, embeddings: torch.Tensor):
+        self.catalogs = catalogs
+        self.keyword_index = keyword_index
+        self.embeddings = embeddings
+        self._embedding_matrix = EmbeddingMatrix(embeddings)
+        # Estatísticas do BM25 por versão, iguais às do índice por linha do catálogo dessa versão
+        self.keyword_indexes = {name: keyword_index.reweighted(catalog.text_weights())
+                                for name, catalog in catalogs.items()}
+
+    def names(self) -> list[str]:
+        return list(self.catalogs)
+
+    def catalog(self, name: str) -> CatalogStore:
+        if name not in self.catalogs:
+            raise KeyError(f"Versão de catálogo desconhecida: '{name}'. Disponíveis: {self.names()}")
+        return self.catalogs[name]
+
+    def snapshot(self, name: str):
+        """
+        (catálogo, BM25, embeddings) da versão, no formato usado pela busca do
+        ServicoFinder. Os postings do BM25 são os compartilhados, mas pesados
+        pelas linhas da versão: os scores são os mesmos do índice construído só
+        com o catálogo dessa versão. A busca expande cada texto só para as
+        linhas da versão e ignora textos que ela não contém.
+        """
+        return self.catalog(name), self.keyword_indexes[name], self._embedding_matrix
+
+    @classmethod
+    def build(cls, sources: dict, normalizer, embedding_store, encode_fn, device: str = 'cpu'):
+        """Lê e indexa todas as versões; textos repetidos entre versões são processados uma única vez."""
+        frames = {}
+        for name, path in sources.items():
+            print(f"INFO: Lendo versão '{name}' do catálogo: {path}")
+            frames[name] = read_source(path).drop(columns=['preco_invalido'])
+        combined = pd.concat(frames.values(), ignore_index=True)
+        bounds = np.cumsum([0] + [len(df) for df in frames.values()])
+
+        # Internação global: o mesmo texto recebe o mesmo id em todas as versões
+        original_ids, original_values = pd.factorize(combined['descricao_original'])
+        normalized_values = normalizer.normalize_many(list(original_values))
+        normalized_ids, distinct_normalized = pd.factorize(pd.Series(normalized_values, dtype=object))
+        normalized_ids = normalized_ids[original_ids]
+        text_values = {'descricao_original': TextColumn.from_texts(original_values),
+                       'descricao_normalizada': TextColumn.from_texts(distinct_normalized)}
+        print(f"INFO: {len(combined)} linhas em {len(frames)} versões; "
+              f"{len(distinct_normalized)} descrições distintas indexadas.")
+
+        catalogs = {}
+        for (name, df), start, end in zip(frames.items(), bounds[:-1], bounds[1:]):
+            ids = {'descricao_original': original_ids[start:end], 'descricao_normalizada': normalized_ids[start:end]}
+            catalogs[name] = CatalogStore.from_dataframe(df, text_columns={
+                col: InternedTextColumn(text_values[col], ids[col].astype(np.int32)) for col in CatalogStore.TEXT_COLUMNS
+            })
+
+        distinct_texts = list(distinct_normalized)
+        # Índice salvo: um documento por texto distinto, pesado pelas linhas de todas as versões
+        keyword_index = KeywordIndex.from_partial_postings(
+            [KeywordIndex.partial_postings(text.split(" ") for text in distinct_texts)],
+            doc_weights=np.bincount(normalized_ids, minlength=len(distinct_texts)))
+        embeddings = torch.from_numpy(embedding_store.encode(distinct_texts, encode_fn)).to(device)
+        return cls(catalogs, keyword_index, embeddings)
+
+    def save(self, directory: str, sources: dict, model_id: str, normalizer_version: int):
+        """Grava o conjunto em um diretório temporário e o troca pelo anterior ao final."""
+        tmp_dir = f"{directory}.build-{os.getpid()}"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        any_catalog = next(iter(self.catalogs.values()))
+        for col in CatalogStore.TEXT_COLUMNS:
+            any_catalog.column(col).values.save(tmp_dir, col)
+        for name, catalog in self.catalogs.items():
+            catalog.save(os.path.join(tmp_dir, 'catalogos', name), shared_text_values=True)
+        self.keyword_index.save(os.path.join(tmp_dir, 'bm25'))
+        save_array(os.path.join(tmp_dir, 'embeddings.npy'), self.embeddings.cpu().numpy().astype(np.float32, copy=False))
+        manifest = {name: build_manifest(path, len(self.catalogs[name]), model_id, normalizer_version)
+                    for name, path in sources.items()}
+        with open(os.path.join(tmp_dir, self.MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+        old_dir = f"{directory}.old-{os.getpid()}"
+        if os.path.exists(directory):
+            os.rename(directory, old_dir)
+        os.rename(tmp_dir, directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def is_current(cls, directory: str, sources: dict, model_id: str, normalizer_version: int) -> bool:
+        """O cache vale se tiver exatamente as mesmas versões, sem mudança nos arquivos."""
+        try:
+            with open(os.path.join(directory, cls.MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        return (list(manifest) == list(sources)
+                and all(is_compatible(manifest[name], model_id, normalizer_version)
+                        and source_unchanged(manifest[name], path) for name, path in sources.items()))
+
+    @classmethod
+    def load(cls, directory: str, device: str = 'cpu'):
+        with open(os.path.join(directory, cls.MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+            names = list(json.load(f))
+        text_values = {col: TextColumn.load(directory, col) for col in CatalogStore.TEXT_COLUMNS}
+        catalogs = {name: CatalogStore.load(os.path.join(directory, 'catalogos', name), text_values=text_values)
+                    for name in names}
+        embeddings = torch.from_numpy(load_array(os.path.join(directory, 'embeddings.npy'))).to(device)
+        return cls(catalogs, KeywordIndex.load(os.path.join(directory, 'bm25')), embeddings)
+
+    def _keyed_frame(self, name: str) -> pd.DataFrame:
+        catalog = self.catalog(name)
+        return pd.DataFrame({
+            'fonte': np.asarray(catalog.column('fonte'), dtype=object),
+            'codigo': catalog.column('codigo'),
+            'preco': catalog.column('preco'),
+            'texto': catalog.column('descricao_normalizada').ids,
+            'linha': np.arange(len(catalog)),
+        }).drop_duplicates(['fonte', 'codigo'])
+
+    def diff(self, old: str, new: str, limit: int = 100) -> dict:
+        """
+        Compara duas versões por (fonte, código) com um hash join sobre o
+        catálogo inteiro. Os totais cobrem todas as linhas; as listas trazem
+        até `limit` itens (repreciados em ordem de maior variação).
+        """
+        old_catalog, new_catalog = self.catalog(old), self.catalog(new)
+        merged = self._keyed_frame(old).merge(self._keyed_frame(new), on=['fonte', 'codigo'], how='outer',
+                                              suffixes=('_de', '_para'), indicator=True)
+        added = merged[merged['_merge'] == 'right_only']
+        removed = merged[merged['_merge'] == 'left_only']
+        both = merged[merged['_merge'] == 'both']
+        repriced = both[both['preco_de'] != both['preco_para']]
+        text_changed = both['texto_de'] != both['texto_para']
+
+        variation = np.where(repriced['preco_de'] > 0,
+                             (repriced['preco_para'] - repriced['preco_de']) / repriced['preco_de'] * 100, np.nan)
+        repriced = repriced.assign(variacao=variation)
+        repriced = repriced.iloc[np.argsort(-np.abs(np.nan_to_num(variation, nan=np.inf)), kind='stable')]
+
+        def describe(frame, catalog, row_column):
+            rows = frame[row_column].astype(np.int64).to_numpy()[:limit]
+            return [{'codigo': record['codigo'], 'fonte': record['fonte'], 'descricao': record['descricao_original'],
+                     'preco': record['preco'], 'unidade': record['unidade']} for record in catalog.rows(rows)]
+
+        return {
+            'de': old,
+            'para': new,
+            'resumo': {
+                'adicionados': len(added),
+                'removidos': len(removed),
+                'repreciados': len(repriced),
+                'descricao_alterada': int(text_changed.sum()),
+                'inalterados': int(((both['preco_de'] == both['preco_para']) & ~text_changed).sum()),
+            },
+            'adicionados': describe(added, new_catalog, 'linha_para'),
+            'removidos': describe(removed, old_catalog, 'linha_de'),
+            'repreciados': [
+                {'codigo': row.codigo, 'fonte': row.fonte, 'preco_de': round(float(row.preco_de), 2),
+                 'preco_para': round(float(row.preco_para), 2),
+                 'variacao_percentual': None if np.isnan(row.variacao) else round(float(row.variacao), 2)}
+                for row in repriced.head(limit).itertuples(index=False)
+            ],
+        }
@@ -2,7 +2,7 @@
 import pandas as pd
 import os
 import json
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 class ClassifierAgent:
     """
@@ -10,7 +10,7 @@ class ClassifierAgent:
     Carrega configurações dinamicamente do agents_config.json.
     """
     def __init__(self, data_filepath):
-        self.client = OpenAI() # Reutiliza a chave do .env
+        self.client = AsyncOpenAI() # Reutiliza a chave do .env
         
         # Carrega configurações do agents_config.json
         self.model, self.base_prompt = self._load_config()
@@ -59,10 +59,11 @@ class ClassifierAgent:
         """
         return prompt
 
-    def classify(self, query: str) -> tuple[str, str]:
+    async def classify(self, query: str) -> tuple[str, str]:
+        """Grupo e unidade previstos para a query (chamada assíncrona ao LLM)."""
         prompt = self._build_prompt(query)
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.0,
@@ -0,0 +1,37 @@
+# /services/embedding_matrix.py
+import numpy as np
+import torch
+from sentence_transformers import util
+
+
+class EmbeddingMatrix:
+    """
+    Embeddings do índice de busca, um por texto distinto, em dois segmentos:
+    a matriz base (em geral mapeada do disco) e os textos acrescentados por
+    atualizações online. Acrescentar vetores nunca copia a base.
+    """
+    def __init__(self, base: torch.Tensor, tail: torch.Tensor = None):
+        self.base = base
+        self.tail = tail
+
+    def __len__(self):
+        return len(self.base) + (0 if self.tail is None else len(self.tail))
+
+    def append(self, vectors: np.ndarray):
+        """Nova matriz com `vectors` ao final; esta não muda."""
+        vectors = torch.from_numpy(np.asarray(vectors, dtype=np.float32)).to(self.base.device)
+        return EmbeddingMatrix(self.base, vectors if self.tail is None else torch.cat([self.tail, vectors]))
+
+    def similarity(self, queries: torch.Tensor) -> torch.Tensor:
+        """Similaridade de cosseno (consultas × textos)."""
+        scores = util.cos_sim(queries, self.base)
+        if self.tail is None:
+            return scores
+        return torch.cat([scores, util.cos_sim(queries, self.tail)], dim=1)
+
+    def numpy(self) -> np.ndarray:
+        """Matriz completa em float32 (para gravar uma geração)."""
+        base = self.base.cpu().numpy().astype(np.float32, copy=False)
+        if self.tail is None:
+            return base
+        return np.concatenate([base, self.tail.cpu().numpy().astype(np.float32, copy=False)])
@@ -0,0 +1,102 @@
+# /services/embedding_store.py
+import os
+import hashlib
+import sqlite3
+import time
+import numpy as np
+
+try:
+    from utils.logger import log_backend
+except ImportError:
+    # Fallback se o logger não estiver disponível
+    def log_backend(*args, **kwargs): pass
+
+
+class EmbeddingStore:
+    """
+    Armazenamento persistente de embeddings endereçado por conteúdo.
+    Cada vetor é guardado sob a chave (id do modelo, hash do texto normalizado),
+    de forma que textos idênticos, em qualquer fonte ou mês de referência, são
+    codificados uma única vez ao longo de todas as reindexações.
+    """
+    # Limite de parâmetros por consulta do SQLite
+    _QUERY_CHUNK = 900
+
+    def __init__(self, db_path: str, model_id: str):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db_path = db_path
+        self.model_id = model_id
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model_id TEXT NOT NULL, text_hash BLOB NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model_id, text_hash)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def get_many(self, hashes: list[bytes]) -> dict:
+        """Retorna {hash: vetor} apenas para os hashes já armazenados."""
+        found = {}
+        for start in range(0, len(hashes), self._QUERY_CHUNK):
+            chunk = hashes[start:start + self._QUERY_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model_id = ? AND text_hash IN ({placeholders})",
+                [self.model_id, *chunk]
+            )
+            for text_hash, vector in rows:
+                found[bytes(text_hash)] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def put_many(self, hashes: list[bytes], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model_id, text_hash, vector) VALUES (?, ?, ?)",
+            [(self.model_id, h, v.tobytes()) for h, v in zip(hashes, vectors)]
+        )
+        self.conn.commit()
+
+    def encode(self, texts: list[str], encode_fn, shard_size: int = 2048) -> np.ndarray:
+        """
+        Monta a matriz de embeddings (float32) de `texts`, na mesma ordem.
+        Somente os textos ainda não vistos pelo modelo são enviados a `encode_fn`,
+        que recebe uma lista de textos e devolve um array (n, dim).
+
+        A codificação é feita em shards de `shard_size` textos, e cada shard é
+        gravado no banco assim que termina. Se a construção for interrompida
+        (OOM, deploy, Ctrl-C), a próxima execução retoma do último shard concluído.
+        """
+        hashes = [self.text_hash(text) for text in texts]
+        unique_hashes = list(dict.fromkeys(hashes))
+        vectors = self.get_many(unique_hashes)
+
+        missing = [h for h in unique_hashes if h not in vectors]
+        print(f"INFO: Embeddings reaproveitados: {len(unique_hashes) - len(missing)} de {len(unique_hashes)} "
+              f"textos distintos. Codificando {len(missing)} novos.")
+        if missing:
+            text_by_hash = dict(zip(hashes, texts))
+            total_shards = (len(missing) + shard_size - 1) // shard_size
+            started = time.monotonic()
+            for shard_number, start in enumerate(range(0, len(missing), shard_size), 1):
+                shard = missing[start:start + shard_size]
+                shard_vectors = np.asarray(encode_fn([text_by_hash[h] for h in shard]), dtype=np.float32)
+                self.put_many(shard, shard_vectors)
+                vectors.update(zip(shard, shard_vectors))
+                self._report_progress(shard_number, total_shards, start + len(shard), len(missing), started)
+
+        if not hashes:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.stack([vectors[h] for h in hashes])
+
+    def _report_progress(self, shard_number, total_shards, done, total, started):
+        elapsed = time.monotonic() - started
+        eta = elapsed / done * (total - done)
+        message = (f"shard {shard_number}/{total_shards} gravado ({done}/{total} textos, "
+                   f"{elapsed:.0f}s decorridos, ETA {eta:.0f}s)")
+        print(f"INFO: Embeddings: {message}")
+        log_backend("Geração de embeddings", "em andamento" if done < total else "concluída", message)
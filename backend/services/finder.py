@@ -1,148 +1,511 @@
 # /app/finder.py
-import pandas as pd
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
 import torch
 import os
-from rank_bm25 import BM25Okapi
 from backend.core.text_utils import TextNormalizer # Importa nosso normalizador validado
-import pickle # Biblioteca para salvar/carregar objetos Python
+import numpy as np
+from backend.core.array_store import save_array, load_array
+from backend.services.catalog_store import CatalogStore
+from backend.services.keyword_index import KeywordIndex
+from backend.services.embedding_store import EmbeddingStore
+from backend.services.embedding_matrix import EmbeddingMatrix
+from backend.services.ingest import (ingest_file, read_source, stream_ingest, price_issue_counts,
+                                     price_validation_report, print_price_report, report_to_dict)
+from backend.services.index_bundle import IndexBundle
+from backend.services.price_cube import PriceCube
+from backend.services.catalog_versions import CatalogVersionSet, discover_versions
+from backend.services.index_manifest import build_manifest, read_manifest, write_manifest, is_compatible, source_unchanged
+from backend.services.index_generations import (generations_dir, current_generation_dir, new_build_dir,
+                                                publish_generation, prune_generations, append_delta_log,
+                                                read_delta_log, LOCK_FILENAME, DELTA_LOG_FILENAME)
+from backend.core.file_lock import FileLock
+import threading
+import uuid
+import pandas as pd
 import json
 import logging
 
+# A partir deste tamanho o arquivo de dados é ingerido em streaming, com memória limitada
+STREAMING_MIN_BYTES = 256 * 2**20
+PRICE_REPORT_FILENAME = 'validacao_precos.json'
+
 class ServicoFinder:
     """
     Versão final e otimizada do Recuperador.
     Inclui um sistema de cache robusto para uma inicialização quase instantânea.
+
+    BM25 e embeddings têm uma entrada por descrição normalizada distinta (os
+    ids de texto do catálogo); cada resultado do índice é expandido para as
+    linhas do catálogo com essa descrição antes da fusão e dos boosts.
     """
-    def __init__(self, model_name='paraphrase-multilingual-mpnet-base-v2'):
+    def __init__(self, model_name='paraphrase-multilingual-mpnet-base-v2', model=None):
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.model = SentenceTransformer(model_name, device=self.device)
+        self.model_name = model_name
+        # Um modelo já carregado pode ser compartilhado entre gerações do índice
+        self.model = model if model is not None else SentenceTransformer(model_name, device=self.device)
         self.normalizer = TextNormalizer()
-        self.dataframe = None
+        self.catalog = None
         self.corpus_embeddings = None
         self.bm25_index = None
+        self.data_filepath = None
+        self.generation_dir = None
+        # Identifica o conteúdo do índice em uso (geração, bundle ou atualização não publicada);
+        # entra na chave dos caches de resultados
+        self.index_id = None
+        # Versões do catálogo (meses de referência) carregadas lado a lado, se configuradas
+        self.versions = None
+        # Cubo de preços por UF / mês / desoneração, se configurado
+        self.price_cube = None
+        # Relatório de validação de preços da última ingestão (por fonte)
+        self.price_report = None
+        self.cache_dir = os.path.join('dados', 'cache')
+        self._embedding_store = None
+        # `_swap_lock` só protege a troca/leitura das referências do índice (tempo curto);
+        # `_update_lock` serializa as atualizações online, que são montadas fora da trava
+        self._swap_lock = threading.Lock()
+        self._update_lock = threading.Lock()
         print("INFO: ServicoFinder (versão com cache) inicializado.")
 
-    def _convert_price_to_float(self, price_value):
-        """
-        Converte um valor de preço (que pode ser string com vírgula) para float.
-        Retorna 0.0 se a conversão falhar.
-        """
-        if isinstance(price_value, (int, float)):
-            return float(price_value)
-        if isinstance(price_value, str):
-            try:
-                # Substitui a vírgula por ponto e converte para float
-                return float(price_value.replace('.', '').replace(',', '.'))
-            except (ValueError, AttributeError):
-                return 0.0
-        return 0.0
+    def _encode_texts(self, texts: list[str]):
+        # O progresso é reportado por shard pelo EmbeddingStore
+        return self.model.encode(texts, convert_to_numpy=True, show_progress_bar=False, device=self.device)
 
-    def _preprocess_data(self, filepath):
+    def _report_memory_footprint(self, dataframe=None):
         """
-        Lê e pré-processa o banco de dados principal de serviços.
+        Informa a memória ocupada pelo catálogo compacto e, quando disponível,
+        pelo DataFrame de ingestão que ele substitui.
         """
-        print(f"INFO: Processando arquivo de dados principal: {filepath}")
-        df = pd.read_csv(filepath, dtype={'codigo_da_composicao': str})
-        
-        # Renomeia para nosso padrão interno, garantindo que todas as colunas sejam lidas
-        df.rename(columns={
-            'codigo_da_composicao': 'codigo', 
-            'descricao_completa_do_servico_prestado': 'descricao_original',
-            'unidade_de_medida': 'unidade', 
-            'orgao_responsavel_pela_divulgacao': 'fonte',
-            'descricao_do_grupo_de_servico': 'grupo', 
-            'precos_unitarios_dos_servicos': 'preco'
-        }, inplace=True, errors='ignore')
-
-        # Garante que as colunas essenciais existam
-        essential_cols = ['codigo', 'descricao_original', 'unidade', 'preco', 'fonte', 'grupo']
-        for col in essential_cols:
-            if col not in df.columns:
-                raise ValueError(f"ERRO CRÍTICO: A coluna essencial '{col}' não foi encontrada em '{filepath}'.")
-
-        df.fillna('', inplace=True)
-        
-        # Aplica a normalização avançada na descrição original
-        print("INFO: Aplicando normalização de texto avançada...")
-        df['descricao_normalizada'] = df['descricao_original'].apply(self.normalizer.normalize)
-        
-        # A coluna 'descricao' que será usada para a indexação será a normalizada
-        df['descricao'] = df['descricao_normalizada']
-        
-        print(f"INFO: Pré-processamento concluído. {len(df)} registros carregados e normalizados.")
-        return df
+        usage = self.catalog.memory_usage()
+        if dataframe is not None:
+            before = dataframe.memory_usage(deep=True).sum()
+            print(f"INFO: Memória do catálogo: DataFrame de ingestão {before / 2**20:.1f} MB -> "
+                  f"catálogo compacto {usage['memoria'] / 2**20:.1f} MB "
+                  f"(+ {usage['mapeado'] / 2**20:.1f} MB de descrições mapeadas do disco).")
+        else:
+            print(f"INFO: Memória do catálogo compacto: {usage['memoria'] / 2**20:.1f} MB "
+                  f"(+ {usage['mapeado'] / 2**20:.1f} MB de descrições mapeadas do disco).")
 
-    def load_and_index_services(self, data_filepath, force_reindex=False):
+    def load_and_index_services(self, data_filepath, force_reindex=False, streaming=None, protected_generations=()):
         """
         Carrega os dados e índices. Se um cache válido existir, carrega dele.
-        Caso contrário, processa os dados e cria o cache para futuras execuções.
+        Se o arquivo de dados mudou desde a indexação, apenas as linhas novas ou
+        alteradas são reprocessadas. Caso contrário, processa os dados e cria o
+        cache para futuras execuções.
+
+        Vários processos (workers) podem chamar este método ao mesmo tempo: só
+        um deles constrói o índice, sob uma trava de arquivo, em um diretório
+        temporário publicado atomicamente; os demais esperam e mapeiam o resultado.
+
+        `streaming` força (True) ou desativa (False) a ingestão em streaming com
+        memória limitada; por padrão ela é usada para arquivos grandes.
+        `protected_generations` são diretórios de gerações ainda em uso por este
+        processo (por exemplo, a geração anterior guardada para rollback), que a
+        limpeza após a publicação não pode remover.
         """
-        cache_dir = os.path.join('dados', 'cache')
-        os.makedirs(cache_dir, exist_ok=True)
-        
-        # Define os caminhos para os arquivos de cache
-        df_cache_path = os.path.join(cache_dir, 'dataframe.pkl')
-        bm25_cache_path = os.path.join(cache_dir, 'bm25_index.pkl')
-        embeddings_cache_path = os.path.join(cache_dir, 'embeddings.pt')
+        cache_dir = self.cache_dir
+        self.data_filepath = data_filepath
+        os.makedirs(generations_dir(cache_dir), exist_ok=True)
 
         # --- LÓGICA DE CARREGAMENTO DO CACHE ---
-        if not force_reindex and all(os.path.exists(p) for p in [df_cache_path, bm25_cache_path, embeddings_cache_path]):
-            print("\nINFO: Cache válido encontrado! Carregando índices pré-processados...")
-            
-            self.dataframe = pd.read_pickle(df_cache_path)
-            with open(bm25_cache_path, 'rb') as f:
-                self.bm25_index = pickle.load(f)
-            self.corpus_embeddings = torch.load(embeddings_cache_path, map_location=self.device)
-            
+        if not force_reindex and self._load_current_generation(cache_dir, data_filepath):
             print("SUCESSO: Índices carregados do cache. Inicialização rápida concluída.")
             return
 
-        # --- LÓGICA DE PROCESSAMENTO (se não houver cache) ---
-        print("\nAVISO: Cache não encontrado ou 'force_reindex' ativado. Iniciando processamento completo...")
-        
-        self.dataframe = self._preprocess_data(data_filepath)
-        
-        corpus = self.dataframe['descricao'].tolist()
-        
-        print("INFO: Criando índice de palavra-chave (BM25)...")
-        tokenized_corpus = [doc.split(" ") for doc in corpus]
-        self.bm25_index = BM25Okapi(tokenized_corpus)
-        
-        print("INFO: Gerando embeddings semânticos... (Isso pode demorar)")
-        self.corpus_embeddings = self.model.encode(corpus, convert_to_tensor=True, show_progress_bar=True, device=self.device)
-        
-        # 3. Salvar os novos índices no cache
-        print("\nINFO: Salvando novos índices no cache para futuras inicializações...")
-        self.dataframe.to_pickle(df_cache_path)
-        with open(bm25_cache_path, 'wb') as f:
-            pickle.dump(self.bm25_index, f)
-        torch.save(self.corpus_embeddings, embeddings_cache_path)
-        
+        print("INFO: Aguardando a trava de construção do índice...")
+        with FileLock(os.path.join(cache_dir, LOCK_FILENAME)):
+            # Outro processo pode ter publicado um índice válido enquanto esperávamos
+            if not force_reindex and self._load_current_generation(cache_dir, data_filepath):
+                print("SUCESSO: Índice publicado por outro processo carregado do cache.")
+                return
+
+            # Só os textos nunca codificados por este modelo passam pelo encoder
+            embedding_store = self._get_embedding_store()
+            previous_dir = current_generation_dir(cache_dir)
+            build_dir = new_build_dir(cache_dir)
+            if streaming is None:
+                streaming = os.path.getsize(data_filepath) >= STREAMING_MIN_BYTES
+            if not force_reindex and previous_dir and self._generation_is_compatible(previous_dir):
+                print("AVISO: O arquivo de dados mudou desde a última indexação. Atualizando apenas as linhas alteradas...")
+                self._load_generation(previous_dir)
+                self._incremental_reindex(data_filepath, embedding_store, build_dir)
+            else:
+                # --- LÓGICA DE PROCESSAMENTO (se não houver cache) ---
+                print("\nAVISO: Cache não encontrado, incompatível ou 'force_reindex' ativado. Iniciando processamento completo...")
+                if streaming:
+                    self._streaming_reindex(data_filepath, embedding_store, build_dir)
+                else:
+                    self._full_reindex(data_filepath, embedding_store, build_dir)
+
+            generation_dir = publish_generation(cache_dir, build_dir)
+            prune_generations(cache_dir, protected=protected_generations)
+
+        # Reabre a geração publicada para que este processo também use os arquivos mapeados
+        self._load_generation(generation_dir)
         print("SUCESSO: Processamento concluído e cache criado.")
 
+    def _generation_is_compatible(self, generation_dir):
+        manifest = read_manifest(generation_dir)
+        return (is_compatible(manifest, self.model_name, TextNormalizer.VERSION)
+                and CatalogStore.exists(os.path.join(generation_dir, 'catalogo'))
+                and KeywordIndex.exists(os.path.join(generation_dir, 'bm25'))
+                and os.path.exists(os.path.join(generation_dir, 'embeddings.npy')))
+
+    def _load_current_generation(self, cache_dir, data_filepath) -> bool:
+        """Carrega a geração publicada se ela for compatível e corresponder ao arquivo de dados atual."""
+        generation_dir = current_generation_dir(cache_dir)
+        if not generation_dir or not self._generation_is_compatible(generation_dir):
+            return False
+        if not source_unchanged(read_manifest(generation_dir), data_filepath):
+            return False
+        print(f"\nINFO: Cache válido encontrado ({os.path.basename(generation_dir)})! Carregando índices pré-processados...")
+        self._load_generation(generation_dir)
+        return True
+
+    def _load_generation(self, generation_dir):
+        catalog = CatalogStore.load(os.path.join(generation_dir, 'catalogo'))
+        bm25_index = KeywordIndex.load(os.path.join(generation_dir, 'bm25'))
+        # Os embeddings são mapeados direto do disco, sem desserialização nem cópia
+        corpus_embeddings = torch.from_numpy(load_array(os.path.join(generation_dir, 'embeddings.npy'))).to(self.device)
+        self._swap_index(catalog, bm25_index, EmbeddingMatrix(corpus_embeddings))
+        self.generation_dir = generation_dir
+        deltas = self._replay_deltas(read_delta_log(generation_dir))
+        # Processos que carregam a mesma geração com o mesmo log têm o mesmo conteúdo (e id)
+        self.index_id = os.path.basename(generation_dir) + (f"+delta-{deltas}" if deltas else "")
+        self.price_report = self._read_price_report(generation_dir)
+        self._report_memory_footprint()
+
+    def load_bundle(self, bundle_path, verify=False):
+        """
+        Carrega um índice pré-construído a partir de um bundle de arquivo único
+        (ver `index_bundle`), mapeado do disco sem reconstrução.
+        """
+        print(f"INFO: Carregando índice do bundle '{bundle_path}'...")
+        bundle = IndexBundle(bundle_path)
+        if not is_compatible(bundle.manifest, self.model_name, TextNormalizer.VERSION):
+            raise ValueError(f"ERRO: O bundle '{bundle_path}' foi gerado com outro modelo, normalizador ou layout.")
+        if verify:
+            bundle.verify()
+        catalog = CatalogStore.load(bundle.section('catalogo'))
+        bm25_index = KeywordIndex.load(bundle.section('bm25'))
+        corpus_embeddings = torch.from_numpy(bundle.embeddings()).to(self.device)
+        self._swap_index(catalog, bm25_index, EmbeddingMatrix(corpus_embeddings))
+        deltas = self._replay_deltas(bundle.header['files'].get(DELTA_LOG_FILENAME, []))
+        self.index_id = (f"bundle-{bundle.manifest['source_sha256'][:16]}-{bundle.header['created_at']}"
+                         + (f"+delta-{deltas}" if deltas else ""))
+        self._report_memory_footprint()
+        print(f"SUCESSO: Índice do bundle carregado ({len(catalog)} registros).")
+
+    def load_versions(self, versions_dir):
+        """
+        Carrega as versões do catálogo encontradas em `versions_dir` (um arquivo
+        por versão). O índice compartilhado é reconstruído apenas quando o
+        conjunto de arquivos ou algum deles muda.
+        """
+        sources = discover_versions(versions_dir)
+        if not sources:
+            print(f"AVISO: Nenhuma versão de catálogo encontrada em '{versions_dir}'.")
+            return
+        cache_dir = os.path.join(self.cache_dir, 'versoes')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with FileLock(os.path.join(self.cache_dir, LOCK_FILENAME)):
+            if CatalogVersionSet.is_current(cache_dir, sources, self.model_name, TextNormalizer.VERSION):
+                print(f"INFO: Carregando {len(sources)} versões do catálogo do cache...")
+            else:
+                print(f"INFO: Indexando {len(sources)} versões do catálogo: {list(sources)}")
+                versions = CatalogVersionSet.build(sources, self.normalizer, self._get_embedding_store(),
+                                                   self._encode_texts, device=self.device)
+                versions.save(cache_dir, sources, self.model_name, TextNormalizer.VERSION)
+            self.versions = CatalogVersionSet.load(cache_dir, device=self.device)
+        print(f"SUCESSO: Versões do catálogo disponíveis: {self.versions.names()}")
+
+    def load_price_cube(self, prices_filepath):
+        """Carrega o cubo de preços regionais, reconstruindo-o só quando o arquivo muda."""
+        cache_dir = os.path.join(self.cache_dir, 'precos')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with FileLock(os.path.join(self.cache_dir, LOCK_FILENAME)):
+            if not PriceCube.is_current(cache_dir, prices_filepath):
+                print(f"INFO: Montando o cubo de preços a partir de '{prices_filepath}'...")
+                PriceCube.from_file(prices_filepath).save(cache_dir, prices_filepath)
+            self.price_cube = PriceCube.load(cache_dir)
+        info = self.price_cube.describe()
+        print(f"SUCESSO: Cubo de preços carregado: {info['itens']} itens × {len(info['ufs'])} UFs × "
+              f"{len(info['meses'])} meses × 2 regimes ({info['tamanho_mb']} MB).")
+
+    def _save_generation(self, generation_dir, data_filepath):
+        print("\nINFO: Salvando novos índices no cache para futuras inicializações...")
+        catalog, bm25_index, corpus_embeddings = self._snapshot()
+        catalog.save(os.path.join(generation_dir, 'catalogo'))
+        bm25_index.save(os.path.join(generation_dir, 'bm25'))
+        save_array(os.path.join(generation_dir, 'embeddings.npy'), corpus_embeddings.numpy())
+        self._write_price_report(generation_dir)
+        # O manifesto é gravado por último: só descreve uma geração completa
+        write_manifest(generation_dir, build_manifest(data_filepath, len(catalog), self.model_name, TextNormalizer.VERSION))
+
+    def _write_price_report(self, generation_dir):
+        if self.price_report is not None:
+            with open(os.path.join(generation_dir, PRICE_REPORT_FILENAME), 'w', encoding='utf-8') as f:
+                json.dump(self.price_report, f, indent=2, ensure_ascii=False)
+
+    @staticmethod
+    def _read_price_report(generation_dir):
+        try:
+            with open(os.path.join(generation_dir, PRICE_REPORT_FILENAME), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _full_reindex(self, data_filepath, embedding_store, build_dir):
+        """Processa todo o arquivo de dados e reconstrói todos os índices."""
+        print(f"INFO: Processando arquivo de dados principal: {data_filepath}")
+        # Normalização, tokenização do BM25 e conversão de preços rodam em paralelo
+        dataframe, self.bm25_index, report = ingest_file(data_filepath)
+        self.price_report = report_to_dict(report)
+        print(f"INFO: Pré-processamento concluído. {len(dataframe)} registros carregados e normalizados.")
+        self.catalog = CatalogStore.from_dataframe(dataframe)
+        self._report_memory_footprint(dataframe)
+        del dataframe
+
+        corpus = self.catalog.indexed_texts()
+        print(f"INFO: {len(corpus)} descrições distintas indexadas para {len(self.catalog)} registros.")
+
+        print("INFO: Gerando embeddings semânticos... (Isso pode demorar)")
+        self.corpus_embeddings = EmbeddingMatrix(
+            torch.from_numpy(embedding_store.encode(corpus, self._encode_texts)).to(self.device))
+        self._save_generation(build_dir, data_filepath)
+
+    def _streaming_reindex(self, data_filepath, embedding_store, build_dir):
+        """
+        Reconstrói todos os índices lendo o arquivo de dados em blocos. Catálogo e
+        embeddings são gravados em disco à medida que cada bloco fica pronto, de
+        forma que o pico de memória não depende do tamanho do arquivo.
+        """
+        print(f"INFO: Processando arquivo de dados principal em streaming: {data_filepath}")
+        self.bm25_index, rows, report = stream_ingest(
+            data_filepath, build_dir, lambda texts: embedding_store.encode(texts, self._encode_texts)
+        )
+        print(f"INFO: Pré-processamento concluído. {rows} registros carregados e normalizados.")
+        self.bm25_index.save(os.path.join(build_dir, 'bm25'))
+        self.price_report = report_to_dict(report)
+        self._write_price_report(build_dir)
+        write_manifest(build_dir, build_manifest(data_filepath, rows, self.model_name, TextNormalizer.VERSION))
+
+    def _incremental_reindex(self, data_filepath, embedding_store, build_dir):
+        """
+        Compara o arquivo de dados com o catálogo em cache, por código, e
+        reprocessa apenas as linhas novas ou alteradas. Linhas removidas saem
+        do índice e as estatísticas do BM25 são atualizadas sem reconstrução.
+        """
+        print(f"INFO: Processando arquivo de dados principal: {data_filepath}")
+        dataframe = read_source(data_filepath)
+        report = price_validation_report([price_issue_counts(dataframe)], dataframe['fonte'], dataframe['preco'])
+        print_price_report(report)
+        self.price_report = report_to_dict(report)
+        dataframe = dataframe.drop(columns=['preco_invalido'])
+        old_rows = self.catalog.match_rows(dataframe)
+        reused = old_rows >= 0
+        removed = len(self.catalog) - len(np.unique(old_rows[reused]))
+        print(f"INFO: Diferença por código: {int(reused.sum())} linhas inalteradas, "
+              f"{int((~reused).sum())} novas ou alteradas, {removed} linhas antigas descartadas (removidas ou substituídas).")
+
+        self._swap_index(*self._patch_index(self._snapshot(), dataframe, old_rows, embedding_store))
+        self._save_generation(build_dir, data_filepath)
+
+    def _patch_index(self, snapshot, dataframe, old_rows, embedding_store):
+        """
+        Monta um novo (catálogo, BM25, embeddings) para `dataframe`, sem alterar
+        o índice em uso. `old_rows[i]` é a linha do `snapshot` que continua valendo
+        para a linha i, ou -1; só essas linhas são normalizadas. Só as descrições
+        normalizadas que ainda não estavam no índice são tokenizadas e codificadas.
+        """
+        catalog, bm25_index, corpus_embeddings = snapshot
+        reused = old_rows >= 0
+        changed_positions = np.flatnonzero(~reused)
+
+        normalized = np.empty(len(dataframe), dtype=object)
+        normalized[reused] = catalog.column('descricao_normalizada').take(old_rows[reused])
+        normalized[changed_positions] = self.normalizer.normalize_many(dataframe['descricao_original'].iloc[changed_positions])
+        new_catalog = CatalogStore.from_dataframe(dataframe.assign(descricao_normalizada=normalized))
+
+        # Texto do índice atual que corresponde a cada texto distinto do novo catálogo, ou -1
+        texts = new_catalog.indexed_texts()
+        old_texts = pd.Index(catalog.indexed_texts()).get_indexer(texts)
+        added_texts = [texts[i] for i in np.flatnonzero(old_texts < 0)]
+
+        old_embeddings = corpus_embeddings.numpy()
+        embeddings = np.empty((len(texts), old_embeddings.shape[1]), dtype=np.float32)
+        embeddings[old_texts >= 0] = old_embeddings[old_texts[old_texts >= 0]]
+        if added_texts:
+            embeddings[old_texts < 0] = embedding_store.encode(added_texts, self._encode_texts)
+
+        return (new_catalog,
+                bm25_index.patch(old_texts, [doc.split(" ") for doc in added_texts],
+                                 doc_weights=new_catalog.text_weights()),
+                EmbeddingMatrix(torch.from_numpy(embeddings).to(self.device)))
+
+    def _get_embedding_store(self):
+        if self._embedding_store is None:
+            self._embedding_store = EmbeddingStore(os.path.join(self.cache_dir, 'embeddings.sqlite'), self.model_name)
+        return self._embedding_store
+
+    def _snapshot(self):
+        """Referências consistentes (catálogo, BM25, embeddings) do índice em uso."""
+        with self._swap_lock:
+            return self.catalog, self.bm25_index, self.corpus_embeddings
+
+    def _swap_index(self, catalog, bm25_index, corpus_embeddings):
+        with self._swap_lock:
+            self.catalog, self.bm25_index, self.corpus_embeddings = catalog, bm25_index, corpus_embeddings
+
+    def apply_delta(self, upserts: pd.DataFrame = None, deletes: list[tuple] = None, persist: bool = True) -> dict:
+        """
+        Atualiza o índice em execução sem reindexação.
+
+        `upserts` é um DataFrame já padronizado (codigo, descricao_original,
+        unidade, fonte, grupo, preco): uma linha com (fonte, codigo) existente é
+        substituída (a antiga é removida e a nova entra no final), as demais são
+        acrescentadas. `deletes` é uma lista de (codigo, fonte); com fonte None,
+        remove o código em todas as fontes. As remoções são aplicadas antes dos upserts.
+
+        O custo é o das linhas tocadas: só elas são normalizadas, só textos novos
+        são tokenizados e codificados, e catálogo, BM25 e embeddings recebem
+        apenas acréscimos e tombstones (ver `CatalogStore.apply_delta` e
+        `KeywordIndex.apply_delta`). O novo índice é montado fora da trava e
+        trocado de uma só vez: as buscas em andamento continuam no anterior. Com
+        `persist`, a atualização é registrada no log da geração em uso, que é
+        reaplicado ao carregá-la (sem a trava de construção do índice).
+        """
+        with self._update_lock:
+            catalog, bm25_index, corpus_embeddings = self._snapshot()
+            if upserts is None:
+                upserts = pd.DataFrame(columns=['codigo', 'descricao_original', 'unidade', 'fonte', 'grupo', 'preco'])
+            upserts = (upserts.astype({'codigo': str, 'fonte': str})
+                       .drop_duplicates(['fonte', 'codigo'], keep='last').reset_index(drop=True))
+            deletes = [(str(codigo), None if fonte is None else str(fonte)) for codigo, fonte in deletes or []]
+
+            # Só as linhas com os códigos envolvidos são examinadas
+            rows = catalog.rows_of_codes(sorted(set(upserts['codigo']) | {codigo for codigo, _ in deletes}))
+            keys = list(zip(np.asarray(catalog.column('fonte')[rows], dtype=object), catalog.column('codigo')[rows]))
+            delete_any_source = {codigo for codigo, fonte in deletes if fonte is None}
+            delete_pairs = {(fonte, codigo) for codigo, fonte in deletes if fonte is not None}
+            upsert_keys = set(zip(upserts['fonte'], upserts['codigo']))
+            deleted = np.array([key in delete_pairs or key[1] in delete_any_source for key in keys], dtype=bool)
+            upserted = np.array([key in upsert_keys for key in keys], dtype=bool)
+            updated = {key for key, is_update in zip(keys, upserted & ~deleted) if is_update}
+            removed_rows = rows[deleted | upserted]
+
+            appended = upserts.assign(descricao_normalizada=self.normalizer.normalize_many(upserts['descricao_original']))
+            new_catalog, new_texts = catalog.apply_delta(removed_rows, appended)
+            # Documentos do BM25 cujo número de linhas mudou: textos das linhas removidas e das novas
+            text_column = new_catalog.column(CatalogStore.INDEXED_TEXT_COLUMN)
+            text_ids = np.asarray(text_column.ids)
+            touched_texts = np.unique(np.concatenate([text_ids[removed_rows], text_ids[len(text_ids) - len(appended):]]))
+            documents = {int(text_id): text_column.values[text_id].split(" ") for text_id in touched_texts}
+            new_bm25 = bm25_index.apply_delta(documents, new_catalog.text_weights())
+            if new_texts:
+                corpus_embeddings = corpus_embeddings.append(self._get_embedding_store().encode(new_texts, self._encode_texts))
+            self._swap_index(new_catalog, new_bm25, corpus_embeddings)
+            # Até ser reaplicada de um log, a atualização tem um id próprio
+            self.index_id = f"{self.index_id}+delta-{uuid.uuid4().hex[:8]}"
+
+            summary = {'atualizados': len(updated), 'inseridos': len(upserts) - len(updated),
+                       'removidos': len(removed_rows) - len(updated),
+                       'total': len(new_catalog)}
+            print(f"SUCESSO: Atualização online aplicada: {summary['inseridos']} inseridos, "
+                  f"{summary['atualizados']} atualizados, {summary['removidos']} removidos ({summary['total']} linhas).")
+            if persist and self.generation_dir:
+                append_delta_log(self.generation_dir, {'upserts': upserts.to_dict('records'),
+                                                       'deletes': [list(item) for item in deletes]})
+            return summary
+
+    def _replay_deltas(self, records: list[dict]) -> int:
+        """Reaplica, em ordem, atualizações online registradas no log de uma geração."""
+        if records:
+            print(f"INFO: Reaplicando {len(records)} atualização(ões) online registradas para esta geração...")
+        for record in records:
+            upserts = pd.DataFrame(record['upserts']) if record['upserts'] else None
+            self.apply_delta(upserts, [tuple(item) for item in record['deletes']], persist=False)
+        return len(records)
+
     # Os métodos de busca (`find_similar_semantic`, `find_similar_keyword`, `hybrid_search`)
     # permanecem exatamente os mesmos da versão anterior, pois já estão corretos e otimizados.
     # O agente deve garantir que eles estejam presentes no arquivo.
-    def find_similar_semantic(self, query: str, top_k: int):
-        normalized_query = self.normalizer.normalize(query)
-        query_embedding = self.model.encode(normalized_query, convert_to_tensor=True, device=self.device)
-        cos_scores = util.cos_sim(query_embedding, self.corpus_embeddings)[0]
-        top_results = torch.topk(cos_scores, k=min(top_k, len(self.dataframe)))
-        return top_results.indices.cpu().numpy(), top_results.values.cpu().numpy()
+    def encode_queries(self, queries: list[str]) -> np.ndarray:
+        """Embeddings (float32, norma 1) das consultas normalizadas, codificadas em um único lote."""
+        vectors = np.asarray(self._encode_texts(self.normalizer.normalize_many(queries)),
+                             dtype=np.float32).reshape(len(queries), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def encode_query(self, query: str) -> np.ndarray:
+        """Embedding (float32, norma 1) da consulta normalizada, para comparar consultas entre si."""
+        return self.encode_queries([query])[0]
 
-    def find_similar_keyword(self, query: str, top_k: int):
+    def find_similar_semantic(self, query: str, top_k: int, snapshot=None, query_embedding: np.ndarray = None):
+        snapshot = snapshot or self._snapshot()
+        if query_embedding is None:
+            normalized_query = self.normalizer.normalize(query)
+            query_embedding = self.model.encode(normalized_query, convert_to_tensor=True, device=self.device)
+        else:
+            # Já codificada (ver encode_queries), por exemplo junto com as demais consultas de um lote
+            query_embedding = torch.from_numpy(query_embedding).to(self.device)
+        return self._top_semantic(snapshot, query_embedding, top_k)[0]
+
+    def semantic_candidates(self, query_embeddings: np.ndarray, versao: str = None, top_k: int = 100) -> list[tuple]:
+        """
+        Busca semântica inicial de várias consultas já codificadas (ver
+        `encode_queries`), com uma única multiplicação de matrizes contra os
+        embeddings do catálogo. Retorna, por consulta, (índice, linhas, scores)
+        para `hybrid_search(semantic_candidates=...)`, que usa o mesmo índice.
+        """
+        snapshot = self._search_snapshot(versao)
+        queries = torch.from_numpy(np.asarray(query_embeddings, dtype=np.float32)).to(self.device)
+        return [(snapshot, rows, scores) for rows, scores in self._top_semantic(snapshot, queries, top_k)]
+
+    @staticmethod
+    def _top_semantic(snapshot, query_embeddings: torch.Tensor, top_k: int) -> list[tuple]:
+        """(linhas, scores) dos `top_k` mais similares para cada consulta (uma por linha de `query_embeddings`)."""
+        catalog, _, corpus_embeddings = snapshot
+        # Similaridade por texto distinto; cada texto vale para todas as suas linhas
+        cos_scores = corpus_embeddings.similarity(query_embeddings)
+        missing = catalog.missing_texts()
+        if missing is not None:
+            # Versão do catálogo: textos de outras versões não têm linhas aqui
+            cos_scores[:, torch.from_numpy(missing).to(cos_scores.device)] = -torch.inf
+        top_k_texts = min(top_k, cos_scores.shape[1] - (0 if missing is None else int(missing.sum())))
+        top_results = torch.topk(cos_scores, k=top_k_texts, dim=1)
+        indices, values = top_results.indices.cpu().numpy(), top_results.values.cpu().numpy()
+        results = []
+        for text_ids, scores in zip(indices, values):
+            rows, positions = catalog.expand_texts(text_ids, top_k)
+            results.append((rows, scores[positions]))
+        return results
+
+    def find_similar_keyword(self, query: str, top_k: int, snapshot=None):
+        catalog, bm25_index, _ = snapshot or self._snapshot()
         normalized_query = self.normalizer.normalize(query)
         tokenized_query = normalized_query.split(" ")
-        doc_scores = self.bm25_index.get_scores(tokenized_query)
-        top_indices = sorted(range(len(doc_scores)), key=lambda i: doc_scores[i], reverse=True)[:top_k]
-        return top_indices
+        text_ids = bm25_index.top_k(tokenized_query, top_k, exclude=catalog.missing_texts())
+        return catalog.expand_texts(text_ids, top_k)[0].tolist()
+
+    def _search_snapshot(self, versao: str = None):
+        """Índice (catálogo, BM25, embeddings) da busca: o principal ou o de uma versão do catálogo."""
+        if versao:
+            if self.versions is None:
+                raise KeyError("Nenhuma versão de catálogo carregada")
+            return self.versions.snapshot(versao)
+        return self._snapshot()
 
     def hybrid_search(self, query: str, top_k: int = 5, alpha: float = 0.5, 
                       predicted_group: str = None, predicted_unit: str = None, 
                       group_boost: float = 1.5, unit_boost: float = 1.2,
-                      priority_list: list[str] = None):
+                      priority_list: list[str] = None, versao: str = None, query_embedding: np.ndarray = None,
+                      semantic_candidates: tuple = None):
         
+        # Todas as etapas usam o mesmo índice, mesmo que uma atualização online o troque no meio;
+        # com candidatos semânticos já calculados (ver `semantic_candidates`), o índice em que foram calculados
+        snapshot = semantic_candidates[0] if semantic_candidates is not None else self._search_snapshot(versao)
+        catalog = snapshot[0]
+
         # Inicializa o log detalhado do processo de raciocínio
         reasoning_log = []
         reasoning_log.append(f"🧠 **INÍCIO DO PROCESSO DE RACIOCÍNIO DA IA**")
@@ -157,14 +520,19 @@ class ServicoFinder:
                 reasoning_log.append(f"   • Unidade prevista: {predicted_unit} (boost: {unit_boost}x)")
         
         reasoning_log.append(f"\n🔍 **ETAPA 1: BUSCA SEMÂNTICA**")
-        reasoning_log.append(f"   • Processando embeddings da consulta...")
-        semantic_indices, semantic_scores = self.find_similar_semantic(query, top_k=100)
+        if semantic_candidates is not None:
+            reasoning_log.append(f"   • Similaridades calculadas junto com as demais consultas do lote...")
+            semantic_indices, semantic_scores = semantic_candidates[1:]
+        else:
+            reasoning_log.append(f"   • Processando embeddings da consulta...")
+            semantic_indices, semantic_scores = self.find_similar_semantic(query, top_k=100, snapshot=snapshot,
+                                                                           query_embedding=query_embedding)
         reasoning_log.append(f"   • ✅ Encontrados {len(semantic_indices)} resultados semânticos")
         reasoning_log.append(f"   • 🏆 Melhor score semântico: {max(semantic_scores):.4f}")
         
         reasoning_log.append(f"\n🔤 **ETAPA 2: BUSCA POR PALAVRAS-CHAVE**")
         reasoning_log.append(f"   • Aplicando algoritmo BM25...")
-        keyword_indices = self.find_similar_keyword(query, top_k=100)
+        keyword_indices = self.find_similar_keyword(query, top_k=100, snapshot=snapshot)
         reasoning_log.append(f"   • ✅ Encontrados {len(keyword_indices)} resultados por palavras-chave")
         
         semantic_score_map = {idx: score for idx, score in zip(semantic_indices, semantic_scores)}
@@ -183,9 +551,11 @@ class ServicoFinder:
         if predicted_group or predicted_unit:
             reasoning_log.append(f"\n🎯 **ETAPA 4: APLICAÇÃO DE BOOSTS INTELIGENTES**")
             boost_count = 0
+            grupos = catalog.column('grupo')
+            unidades = catalog.column('unidade')
             for idx in fused_scores:
-                item_group = self.dataframe.iloc[idx].get('grupo', '')
-                item_unit = self.dataframe.iloc[idx].get('unidade', '')
+                item_group = grupos[idx]
+                item_unit = unidades[idx]
                 original_score = fused_scores[idx]
                 
                 if predicted_group and item_group == predicted_group: 
@@ -205,9 +575,10 @@ class ServicoFinder:
             reasoning_log.append(f"\n🎯 **ETAPA 4.5: APLICAÇÃO DE BOOST DE PRIORIDADES**")
             reasoning_log.append(f"   • Lista de prioridades: {priority_list}")
             priority_boost_count = 0
+            fontes = catalog.column('fonte')
             
             for idx in fused_scores:
-                item_fonte = self.dataframe.iloc[idx].get('fonte', '')
+                item_fonte = fontes[idx]
                 original_score = fused_scores[idx]
                 
                 if item_fonte in priority_list:
@@ -233,8 +604,9 @@ class ServicoFinder:
                         reasoning_log.append(f"\n🎯 **ETAPA 4.5: APLICAÇÃO DE BOOST DE PRIORIDADES PADRÃO**")
                         reasoning_log.append(f"   • Usando prioridades padrão: {default_priorities}")
                         
+                        fontes = catalog.column('fonte')
                         for idx in fused_scores:
-                            item_fonte = self.dataframe.iloc[idx].get('fonte', '')
+                            item_fonte = fontes[idx]
                             if item_fonte in default_priorities:
                                 posicao_na_lista = default_priorities.index(item_fonte)
                                 boost_multiplier = 1 + (len(default_priorities) - posicao_na_lista) * 0.2
@@ -255,7 +627,7 @@ class ServicoFinder:
         top_semantic_score = 0.0
         if reranked_indices:
             top_item_index = reranked_indices[0]
-            top_original_index = self.dataframe.iloc[top_item_index].name
+            top_original_index = int(top_item_index)
             top_semantic_score = float(semantic_score_map.get(top_item_index, 0.0))
             
             reasoning_log.append(f"   • 🥇 Melhor resultado: índice {top_item_index} (score: {fused_scores[top_item_index]:.4f})")
@@ -263,13 +635,13 @@ class ServicoFinder:
         reasoning_log.append(f"\n🎯 **ETAPA 6: PREPARAÇÃO DOS RESULTADOS**")
         results = []
         for idx in reranked_indices[:top_k]:
-            item = self.dataframe.iloc[idx]
+            item = catalog.row(idx)
             result_item = {
                 'rank': len(results) + 1,
                 'score': float(fused_scores[idx]),
                 'codigo': item.get('codigo', 'N/A'),
                 'descricao': item.get('descricao_original', 'N/A'),
-                'preco': self._convert_price_to_float(item.get('preco')),
+                'preco': item.get('preco', 0.0),
                 'unidade': item.get('unidade', 'N/A'),
                 'fonte': item.get('fonte', 'N/A')
             }
@@ -0,0 +1,255 @@
+# /services/index_bundle.py
+import os
+import sys
+import json
+import struct
+import hashlib
+import argparse
+from datetime import datetime
+import numpy as np
+from backend.core.array_store import save_array, load_array
+from backend.core.file_lock import FileLock
+from backend.services.index_generations import (current_generation_dir, new_build_dir, publish_generation,
+                                                prune_generations, generations_dir, read_delta_log,
+                                                LOCK_FILENAME, DELTA_LOG_FILENAME)
+from backend.services.index_manifest import MANIFEST_FILENAME
+
+# Layout do arquivo:
+#   MAGIC (8 bytes) | tamanho do cabeçalho (uint64) | sha256 do cabeçalho (32 bytes) | cabeçalho JSON
+#   seguido dos arrays, cada um alinhado em ALIGNMENT bytes para poder ser mapeado diretamente.
+# O cabeçalho guarda os arquivos JSON da geração (manifesto, metadados do catálogo e do BM25,
+# log de atualizações online como lista) e, para cada array, offset, dtype, shape e sha256.
+MAGIC = b'ORCIDX\x00\x01'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+EMBEDDINGS_FILENAME = 'embeddings.npy'
+_PREAMBLE = struct.Struct('<8sQ32s')
+_BLOCK = 1 << 24
+
+
+def _byte_blocks(array: np.ndarray):
+    """Percorre os bytes de um array contíguo em blocos, sem copiá-lo inteiro."""
+    flat = np.ascontiguousarray(array).reshape(-1).view(np.uint8)
+    for start in range(0, len(flat), _BLOCK):
+        yield flat[start:start + _BLOCK]
+
+
+def _sha256(array: np.ndarray) -> str:
+    digest = hashlib.sha256()
+    for block in _byte_blocks(array):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def _align(position: int) -> int:
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def quantize_int8(embeddings: np.ndarray):
+    """
+    Quantização simétrica por linha: cada vetor vira int8 com uma escala float32.
+    Como a busca usa similaridade de cosseno, a escala por linha não altera a
+    direção dos vetores; o erro vem apenas do arredondamento para 127 níveis.
+    """
+    scale = np.abs(embeddings).max(axis=1).astype(np.float32) / 127
+    scale[scale == 0] = 1
+    quantized = np.rint(embeddings / scale[:, None]).clip(-127, 127).astype(np.int8)
+    return quantized, scale
+
+
+def export_bundle(generation_dir: str, bundle_path: str, quantize: bool = False) -> dict:
+    """
+    Empacota uma geração do cache (catálogo, BM25, embeddings e manifesto) em um
+    único arquivo versionado e com checksums. Com `quantize`, os embeddings são
+    gravados em int8 (arquivo ~4x menor).
+    """
+    files, arrays = {}, {}
+    for root, _, names in os.walk(generation_dir):
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            member = os.path.relpath(path, generation_dir).replace(os.sep, '/')
+            if name.endswith('.json'):
+                with open(path, 'r', encoding='utf-8') as f:
+                    files[member] = json.load(f)
+            elif name.endswith('.npy'):
+                arrays[member] = load_array(path)
+            elif name == DELTA_LOG_FILENAME:
+                files[member] = read_delta_log(root)
+    if MANIFEST_FILENAME not in files:
+        raise ValueError(f"ERRO: '{generation_dir}' não contém um manifesto; a geração está incompleta.")
+
+    quantization = None
+    if quantize:
+        arrays[EMBEDDINGS_FILENAME], arrays['embeddings.scale.npy'] = quantize_int8(np.asarray(arrays[EMBEDDINGS_FILENAME]))
+        quantization = {'tipo': 'int8', 'array': EMBEDDINGS_FILENAME, 'escala': 'embeddings.scale.npy'}
+
+    # Primeiro passo: checksums e shapes, para montar o cabeçalho com os offsets finais
+    segments = {
+        member: {'dtype': np.lib.format.dtype_to_descr(array.dtype), 'shape': list(array.shape),
+                 'nbytes': int(array.nbytes), 'sha256': _sha256(array)}
+        for member, array in sorted(arrays.items())
+    }
+    header = {'format_version': FORMAT_VERSION, 'created_at': datetime.now().isoformat(),
+              'quantization': quantization, 'files': files, 'arrays': segments}
+    # Os offsets dependem do tamanho do cabeçalho, que depende dos offsets: itera até estabilizar
+    header_bytes = b''
+    while True:
+        position = _align(_PREAMBLE.size + len(header_bytes))
+        for segment in segments.values():
+            segment['offset'] = position
+            position = _align(position + segment['nbytes'])
+        encoded = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        if len(encoded) == len(header_bytes):
+            break
+        header_bytes = encoded
+
+    tmp_path = f"{bundle_path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(_PREAMBLE.pack(MAGIC, len(header_bytes), hashlib.sha256(header_bytes).digest()))
+        f.write(header_bytes)
+        for member, segment in segments.items():
+            f.write(b'\0' * (segment['offset'] - f.tell()))
+            for block in _byte_blocks(arrays[member]):
+                f.write(block)
+        f.write(b'\0' * (_align(f.tell()) - f.tell()))
+    os.replace(tmp_path, bundle_path)
+    return header
+
+
+class IndexBundle:
+    """
+    Leitura de um bundle de índice. Os arrays são mapeados direto do arquivo,
+    sem cópia; a verificação completa dos checksums é opcional (`verify`), para
+    que a inicialização a partir de um bundle leve segundos.
+    """
+    def __init__(self, bundle_path: str):
+        self.path = bundle_path
+        with open(bundle_path, 'rb') as f:
+            magic, header_size, header_digest = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+            if magic != MAGIC:
+                raise ValueError(f"ERRO: '{bundle_path}' não é um bundle de índice.")
+            header_bytes = f.read(header_size)
+        if hashlib.sha256(header_bytes).digest() != header_digest:
+            raise ValueError(f"ERRO: Cabeçalho do bundle '{bundle_path}' corrompido.")
+        self.header = json.loads(header_bytes)
+        if self.header['format_version'] != FORMAT_VERSION:
+            raise ValueError(f"ERRO: Versão de bundle não suportada: {self.header['format_version']}.")
+        expected_size = max((s['offset'] + s['nbytes'] for s in self.header['arrays'].values()), default=0)
+        if os.path.getsize(bundle_path) < expected_size:
+            raise ValueError(f"ERRO: Bundle '{bundle_path}' truncado.")
+
+    @property
+    def manifest(self) -> dict:
+        return self.header['files'][MANIFEST_FILENAME]
+
+    def load_array(self, name: str, mmap: bool = True) -> np.ndarray:
+        segment = self.header['arrays'][name]
+        dtype, shape = np.dtype(segment['dtype']), tuple(segment['shape'])
+        if segment['nbytes'] == 0:
+            return np.empty(shape, dtype=dtype)
+        if mmap:
+            return np.memmap(self.path, dtype=dtype, mode='c', offset=segment['offset'], shape=shape)
+        with open(self.path, 'rb') as f:
+            f.seek(segment['offset'])
+            return np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+    def read_json(self, name: str) -> dict:
+        return self.header['files'][name]
+
+    def section(self, prefix: str):
+        """Visão de um subdiretório da geração (ex.: 'catalogo'), aceita pelos métodos `load`."""
+        return _BundleSection(self, prefix)
+
+    def embeddings(self) -> np.ndarray:
+        """Matriz de embeddings float32; se o bundle for quantizado, é reconstruída em memória."""
+        quantization = self.header.get('quantization')
+        if not quantization:
+            return self.load_array(EMBEDDINGS_FILENAME)
+        scale = self.load_array(quantization['escala'])
+        return self.load_array(quantization['array']).astype(np.float32) * scale[:, None]
+
+    def verify(self):
+        """Confere o sha256 de todos os arrays. Lança ValueError no primeiro divergente."""
+        for name, segment in self.header['arrays'].items():
+            if _sha256(self.load_array(name)) != segment['sha256']:
+                raise ValueError(f"ERRO: Checksum divergente para '{name}' no bundle '{self.path}'.")
+
+    def extract(self, generation_dir: str):
+        """Grava o conteúdo do bundle como uma geração do cache (layout de diretório)."""
+        quantization = self.header.get('quantization') or {}
+        for name in self.header['arrays']:
+            if name == quantization.get('escala'):
+                continue
+            array = self.embeddings() if name == quantization.get('array') else self.load_array(name)
+            path = os.path.join(generation_dir, *name.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            save_array(path, array)
+        # O manifesto vai por último: só descreve uma geração completa
+        for name, content in sorted(self.header['files'].items(), key=lambda item: item[0] == MANIFEST_FILENAME):
+            path = os.path.join(generation_dir, *name.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                if name == DELTA_LOG_FILENAME:
+                    f.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in content)
+                else:
+                    json.dump(content, f, ensure_ascii=False)
+
+
+class _BundleSection:
+    def __init__(self, bundle: IndexBundle, prefix: str):
+        self.bundle = bundle
+        self.prefix = prefix
+
+    def load_array(self, name: str, mmap: bool = True) -> np.ndarray:
+        return self.bundle.load_array(f"{self.prefix}/{name}", mmap=mmap)
+
+    def read_json(self, name: str) -> dict:
+        return self.bundle.read_json(f"{self.prefix}/{name}")
+
+
+def import_bundle(bundle_path: str, cache_dir: str) -> str:
+    """Verifica o bundle e o publica como nova geração do cache local."""
+    bundle = IndexBundle(bundle_path)
+    bundle.verify()
+    os.makedirs(generations_dir(cache_dir), exist_ok=True)
+    with FileLock(os.path.join(cache_dir, LOCK_FILENAME)):
+        build_dir = new_build_dir(cache_dir)
+        bundle.extract(build_dir)
+        generation_dir = publish_generation(cache_dir, build_dir)
+        prune_generations(cache_dir)
+    return generation_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exporta/importa o índice de busca em um único arquivo (bundle).")
+    parser.add_argument('--cache', default=os.path.join('dados', 'cache'), help="Diretório do cache do índice")
+    commands = parser.add_subparsers(dest='comando', required=True)
+    exportar = commands.add_parser('exportar', help="Empacota a geração publicada (ou a indicada) em um bundle")
+    exportar.add_argument('saida')
+    exportar.add_argument('--geracao', help="Diretório da geração (padrão: a publicada no cache)")
+    exportar.add_argument('--quantizar', action='store_true', help="Grava os embeddings em int8")
+    importar = commands.add_parser('importar', help="Verifica um bundle e o publica no cache local")
+    importar.add_argument('arquivo')
+    verificar = commands.add_parser('verificar', help="Confere os checksums de um bundle")
+    verificar.add_argument('arquivo')
+    args = parser.parse_args(argv)
+
+    if args.comando == 'exportar':
+        generation_dir = args.geracao or current_generation_dir(args.cache)
+        if not generation_dir:
+            print(f"ERRO: Nenhuma geração publicada em '{args.cache}'.")
+            return 1
+        header = export_bundle(generation_dir, args.saida, quantize=args.quantizar)
+        print(f"SUCESSO: Bundle '{args.saida}' gerado ({header['files'][MANIFEST_FILENAME]['rows']} registros, "
+              f"{os.path.getsize(args.saida) / 2**20:.1f} MB).")
+    elif args.comando == 'importar':
+        generation_dir = import_bundle(args.arquivo, args.cache)
+        print(f"SUCESSO: Bundle importado como geração {os.path.basename(generation_dir)}.")
+    else:
+        IndexBundle(args.arquivo).verify()
+        print(f"SUCESSO: Bundle '{args.arquivo}' íntegro.")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
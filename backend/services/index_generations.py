@@ -0,0 +1,106 @@
+# /services/index_generations.py
+import os
+import json
+import shutil
+from datetime import datetime
+
+# Layout do cache:
+#   dados/cache/geracoes/<id>/   -> uma geração completa e imutável do índice
+#   dados/cache/geracoes/<id>/deltas.jsonl -> atualizações online sobre a geração
+#                                   (só recebe linhas no final; reaplicado ao carregar)
+#   dados/cache/CURRENT          -> nome da geração em uso
+#   dados/cache/build.lock       -> trava de construção entre processos
+GENERATIONS_DIRNAME = 'geracoes'
+CURRENT_FILENAME = 'CURRENT'
+LOCK_FILENAME = 'build.lock'
+DELTA_LOG_FILENAME = 'deltas.jsonl'
+
+
+def generations_dir(cache_dir: str) -> str:
+    return os.path.join(cache_dir, GENERATIONS_DIRNAME)
+
+
+def current_generation_dir(cache_dir: str):
+    """Diretório da geração publicada, ou None se ainda não houver nenhuma."""
+    try:
+        with open(os.path.join(cache_dir, CURRENT_FILENAME), 'r', encoding='utf-8') as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    path = os.path.join(generations_dir(cache_dir), name)
+    return path if name and os.path.isdir(path) else None
+
+
+def new_build_dir(cache_dir: str) -> str:
+    """Diretório temporário, invisível aos leitores, onde uma nova geração é construída."""
+    path = os.path.join(generations_dir(cache_dir), f".build-{os.getpid()}-{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+    os.makedirs(path)
+    return path
+
+
+def publish_generation(cache_dir: str, build_dir: str) -> str:
+    """
+    Publica uma geração construída em `build_dir`: o diretório é renomeado para
+    seu nome definitivo e o ponteiro CURRENT é trocado de forma atômica.
+    """
+    name = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    final_dir = os.path.join(generations_dir(cache_dir), name)
+    os.rename(build_dir, final_dir)
+    set_current_generation(cache_dir, name)
+    return final_dir
+
+
+def set_current_generation(cache_dir: str, name: str):
+    pointer = os.path.join(cache_dir, CURRENT_FILENAME)
+    tmp_pointer = f"{pointer}.tmp-{os.getpid()}"
+    with open(tmp_pointer, 'w', encoding='utf-8') as f:
+        f.write(name)
+    os.replace(tmp_pointer, pointer)
+
+
+def prune_generations(cache_dir: str, keep: int = 2, protected=()):
+    """
+    Remove gerações antigas, mantendo as `keep` mais recentes, a publicada em
+    CURRENT e as de `protected` (em uso pelo processo, por exemplo a guardada
+    para rollback), além de construções interrompidas. Falhas são ignoradas:
+    no Windows uma geração ainda mapeada por outro processo não pode ser apagada.
+    """
+    base = generations_dir(cache_dir)
+    kept = {os.path.abspath(path) for path in (current_generation_dir(cache_dir), *protected) if path}
+    names = sorted(n for n in os.listdir(base) if not n.startswith('.'))
+    for name in names[:-keep] if keep else names:
+        path = os.path.join(base, name)
+        if os.path.abspath(path) not in kept:
+            shutil.rmtree(path, ignore_errors=True)
+    for name in os.listdir(base):
+        if name.startswith('.build-'):
+            shutil.rmtree(os.path.join(base, name), ignore_errors=True)
+
+
+def append_delta_log(generation_dir: str, record: dict):
+    """
+    Registra uma atualização online no log da geração. A linha é gravada com
+    uma única escrita em modo append, sem a trava de construção: vários
+    processos podem registrar ao mesmo tempo sem intercalar linhas.
+    """
+    line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+    fd = os.open(os.path.join(generation_dir, DELTA_LOG_FILENAME), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def read_delta_log(generation_dir: str) -> list[dict]:
+    """Atualizações registradas na geração, em ordem. Linhas incompletas (gravação interrompida) são ignoradas."""
+    records = []
+    try:
+        with open(os.path.join(generation_dir, DELTA_LOG_FILENAME), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    print(f"AVISO: Linha inválida ignorada no log de atualizações de '{generation_dir}'.")
+    except FileNotFoundError:
+        pass
+    return records
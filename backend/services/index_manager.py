@@ -0,0 +1,177 @@
+# /services/index_manager.py
+import os
+import threading
+from datetime import datetime
+from backend.services.finder import ServicoFinder
+from backend.services.index_generations import set_current_generation, LOCK_FILENAME
+from backend.core.file_lock import FileLock
+
+try:
+    from utils.logger import log_backend
+except ImportError:
+    # Fallback se o logger não estiver disponível
+    def log_backend(*args, **kwargs): pass
+
+# Consultas executadas em uma nova geração antes de ela entrar em produção
+WARMUP_QUERIES = ["concreto usinado 30mpa", "tubo pvc 100mm", "pintura latex acrilica"]
+
+
+class IndexManager:
+    """
+    Troca blue/green do índice de busca.
+    Mantém a geração em uso (`current`) e a anterior (`previous`, para rollback).
+    Uma reconstrução roda em uma thread em segundo plano, monta um
+    `ServicoFinder` completo e o aquece antes de trocar a referência. As
+    requisições obtêm o finder uma única vez (via `current`) e terminam na
+    geração em que começaram, mesmo que uma troca aconteça no meio.
+
+    Atualizações online (`apply_delta`) feitas durante uma reconstrução valem
+    na geração em uso e são registradas; antes da troca, a reconstrução as
+    reaplica na nova geração, sem que outra atualização entre no meio.
+    """
+    def __init__(self, finder: ServicoFinder, data_filepath: str):
+        self.data_filepath = data_filepath
+        self._current = finder
+        self._previous = None
+        self._lock = threading.Lock()
+        # Serializa as atualizações online com a reaplicação + troca ao final da reconstrução
+        self._delta_lock = threading.Lock()
+        # Atualizações aplicadas desde o início da reconstrução em andamento (None fora dela)
+        self._pending_deltas = None
+        self._rebuild_thread = None
+        self.status = {'estado': 'ocioso', 'inicio': None, 'fim': None, 'erro': None}
+
+    @property
+    def current(self) -> ServicoFinder:
+        return self._current
+
+    @property
+    def is_rebuilding(self) -> bool:
+        return self._rebuild_thread is not None and self._rebuild_thread.is_alive()
+
+    def start_rebuild(self, force_reindex: bool = True) -> bool:
+        """Dispara a reconstrução em segundo plano. Retorna False se já houver uma em andamento."""
+        with self._lock:
+            if self.is_rebuilding:
+                return False
+            self.status = {'estado': 'em andamento', 'inicio': datetime.now().isoformat(), 'fim': None, 'erro': None}
+            self._pending_deltas = []
+            self._rebuild_thread = threading.Thread(target=self._rebuild, args=(force_reindex,),
+                                                    name="index-rebuild", daemon=True)
+            self._rebuild_thread.start()
+            return True
+
+    def _rebuild(self, force_reindex: bool):
+        log_backend("Reconstrução do índice", "iniciada", self.data_filepath)
+        old = self._current
+        try:
+            finder = ServicoFinder(model_name=old.model_name, model=old.model)
+            # As gerações em uso e a guardada para rollback não podem ser removidas na publicação
+            in_use = [f.generation_dir for f in (old, self._previous) if f is not None]
+            finder.load_and_index_services(self.data_filepath, force_reindex=force_reindex,
+                                           protected_generations=in_use)
+            # Versões do catálogo e cubo de preços têm índices próprios e seguem os mesmos entre gerações
+            finder.versions = old.versions
+            finder.price_cube = old.price_cube
+            try:
+                self._warm_up(finder)
+            except Exception:
+                # A geração nova já foi publicada no cache: volta o ponteiro para a que segue em uso
+                self._publish(old)
+                raise
+            with self._delta_lock:
+                with self._lock:
+                    pending, self._pending_deltas = self._pending_deltas, None
+                if pending:
+                    print(f"INFO: Reaplicando {len(pending)} atualização(ões) online feitas durante a reconstrução...")
+                    # Sem geração nova (cache reaproveitado), as atualizações já estão no log dela
+                    persist = finder.generation_dir != old.generation_dir
+                    for upserts, deletes in pending:
+                        finder.apply_delta(upserts, deletes, persist=persist)
+                with self._lock:
+                    self._previous, self._current = self._current, finder
+                    self.status.update(estado='concluído', fim=datetime.now().isoformat())
+            generation = os.path.basename(finder.generation_dir or '')
+            print(f"SUCESSO: Nova geração do índice em uso ({generation}).")
+            log_backend("Reconstrução do índice", "concluída", generation)
+        except Exception as e:
+            with self._lock:
+                # As atualizações registradas já estão na geração que segue em uso
+                self._pending_deltas = None
+                self.status.update(estado='falhou', fim=datetime.now().isoformat(), erro=str(e))
+            print(f"ERRO: Falha na reconstrução do índice; a geração atual continua em uso: {e}")
+            log_backend("Reconstrução do índice", "falhou", str(e))
+
+    @staticmethod
+    def _warm_up(finder: ServicoFinder):
+        """Faz as páginas mapeadas e os caminhos de busca ficarem quentes antes da troca."""
+        print("INFO: Aquecendo a nova geração do índice...")
+        finder.corpus_embeddings.base.sum()
+        for query in WARMUP_QUERIES:
+            finder.hybrid_search(query, top_k=3)
+
+    def apply_delta(self, upserts=None, deletes=None) -> dict:
+        """
+        Aplica uma atualização online na geração em uso (ver `ServicoFinder.apply_delta`).
+        Se uma reconstrução estiver em andamento, a atualização também é
+        registrada para ser reaplicada na nova geração antes da troca.
+        """
+        with self._delta_lock:
+            summary = self._current.apply_delta(upserts, deletes)
+            with self._lock:
+                if self._pending_deltas is not None:
+                    self._pending_deltas.append((upserts, deletes))
+            return summary
+
+    def rollback(self) -> bool:
+        """
+        Volta para a geração anterior, que passa a ser também a geração publicada
+        no cache. Retorna False, sem trocar nada, se não houver geração anterior,
+        se houver uma reconstrução ou atualização online em andamento ou se o
+        CURRENT do cache não puder apontar para ela (geração removida do disco
+        ou trava de construção ocupada por outro processo).
+        """
+        if not self._delta_lock.acquire(blocking=False):
+            return False
+        try:
+            with self._lock:
+                if self._previous is None or self.is_rebuilding:
+                    return False
+                # A troca em memória só acontece depois que o cache já aponta para a geração
+                if not self._publish(self._previous, blocking=False):
+                    print("AVISO: Rollback recusado: não foi possível publicar a geração anterior no cache.")
+                    return False
+                self._previous, self._current = self._current, self._previous
+                generation_dir = self._current.generation_dir
+        finally:
+            self._delta_lock.release()
+
+        print(f"AVISO: Rollback do índice para a geração {os.path.basename(generation_dir or '')}.")
+        log_backend("Rollback do índice", "concluído", generation_dir or '')
+        return True
+
+    @staticmethod
+    def _publish(finder: ServicoFinder, blocking: bool = True) -> bool:
+        """
+        Aponta o CURRENT do cache para a geração de `finder`. Retorna False se ela
+        não existir mais em disco ou se, com `blocking=False`, a trava de
+        construção estiver ocupada.
+        """
+        generation_dir = finder.generation_dir
+        if not generation_dir or not os.path.isdir(generation_dir):
+            return False
+        lock = FileLock(os.path.join(finder.cache_dir, LOCK_FILENAME))
+        if not lock.acquire(blocking=blocking):
+            return False
+        try:
+            set_current_generation(finder.cache_dir, os.path.basename(generation_dir))
+        finally:
+            lock.release()
+        return True
+
+    def describe(self) -> dict:
+        return {
+            **self.status,
+            'geracao_atual': os.path.basename(self._current.generation_dir or ''),
+            'geracao_anterior': os.path.basename(self._previous.generation_dir or '') if self._previous else None,
+        }
@@ -0,0 +1,76 @@
+# /services/index_manifest.py
+import os
+import json
+import hashlib
+from datetime import datetime
+
+# Incrementar sempre que o layout dos arquivos de cache mudar
+SCHEMA_VERSION = 3
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def file_sha256(filepath: str) -> str:
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_manifest(source_path: str, rows: int, model_id: str, normalizer_version: int) -> dict:
+    """Descreve de onde e como o índice em cache foi construído."""
+    stat = os.stat(source_path)
+    return {
+        'schema_version': SCHEMA_VERSION,
+        'source_path': os.path.abspath(source_path),
+        'source_sha256': file_sha256(source_path),
+        'source_size': stat.st_size,
+        'source_mtime': stat.st_mtime,
+        'rows': rows,
+        'model_id': model_id,
+        'normalizer_version': normalizer_version,
+        'created_at': datetime.now().isoformat(),
+    }
+
+
+def read_manifest(cache_dir: str):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_manifest(cache_dir: str, manifest: dict):
+    path = os.path.join(cache_dir, MANIFEST_FILENAME)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def is_compatible(manifest, model_id: str, normalizer_version: int) -> bool:
+    """O cache só pode ser reaproveitado (mesmo que parcialmente) se foi gerado com o mesmo modelo, normalizador e layout."""
+    return (manifest is not None
+            and manifest.get('schema_version') == SCHEMA_VERSION
+            and manifest.get('model_id') == model_id
+            and manifest.get('normalizer_version') == normalizer_version)
+
+
+def source_unchanged(manifest: dict, source_path: str) -> bool:
+    """
+    Verifica se o arquivo fonte é o mesmo que gerou o cache.
+    Tamanho e data de modificação iguais evitam recalcular o hash a cada inicialização.
+    Sem o arquivo fonte (ex.: servidor que só recebe o bundle do índice), o cache
+    é a única cópia dos dados e continua valendo.
+    """
+    try:
+        stat = os.stat(source_path)
+    except FileNotFoundError:
+        print(f"AVISO: Arquivo fonte '{source_path}' não encontrado; usando o índice em cache sem verificar a origem.")
+        return True
+    if stat.st_size != manifest.get('source_size'):
+        return False
+    if stat.st_mtime == manifest.get('source_mtime'):
+        return True
+    return file_sha256(source_path) == manifest.get('source_sha256')
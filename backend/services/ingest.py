@@ -0,0 +1,304 @@
+# /services/ingest.py
+import os
+import json
+import math
+import itertools
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from backend.core.text_utils import TextNormalizer
+from backend.core.array_store import ArrayFileWriter, InternedTextColumn, TextColumn, load_array
+from backend.services.keyword_index import KeywordIndex
+from backend.services.catalog_store import CatalogWriter
+
+# Colunas do arquivo de origem -> padrão interno
+COLUMN_RENAMES = {
+    'codigo_da_composicao': 'codigo',
+    'descricao_completa_do_servico_prestado': 'descricao_original',
+    'unidade_de_medida': 'unidade',
+    'orgao_responsavel_pela_divulgacao': 'fonte',
+    'descricao_do_grupo_de_servico': 'grupo',
+    'precos_unitarios_dos_servicos': 'preco'
+}
+ESSENTIAL_COLUMNS = ['codigo', 'descricao_original', 'unidade', 'preco', 'fonte', 'grupo']
+
+# Com menos blocos que isto não há trabalho a dividir e o custo de subir o pool não compensa
+PARALLEL_MIN_CHUNKS = 2
+# Preços acima (ou abaixo) deste fator da mediana da fonte são reportados como extremos
+EXTREME_PRICE_FACTOR = 1000
+
+_worker_normalizer = None
+
+
+def standardize_columns(df: pd.DataFrame, filepath: str) -> pd.DataFrame:
+    """Renomeia as colunas para o padrão interno e garante que as essenciais existam."""
+    df = df.rename(columns=COLUMN_RENAMES, errors='ignore')
+    for col in ESSENTIAL_COLUMNS:
+        if col not in df.columns:
+            raise ValueError(f"ERRO CRÍTICO: A coluna essencial '{col}' não foi encontrada em '{filepath}'.")
+
+    # Apenas as colunas de texto são preenchidas; o preço não vira objeto misto
+    text_cols = [col for col in df.columns if col != 'preco']
+    df[text_cols] = df[text_cols].fillna('')
+    return df
+
+
+def parse_price(price_value) -> float:
+    """
+    Converte um preço no formato brasileiro ("1.234,56") para float.
+    Retorna NaN se o valor não puder ser convertido.
+    """
+    if isinstance(price_value, (int, float)):
+        return float(price_value)
+    if isinstance(price_value, str):
+        text = price_value.strip()
+        if text.startswith('R$'):
+            text = text[2:]
+        try:
+            return float(text.replace('.', '').replace(',', '.'))
+        except ValueError:
+            return math.nan
+    return math.nan
+
+
+def _parse_price_text(texts: np.ndarray) -> np.ndarray:
+    """
+    Converte um array de textos no formato brasileiro sem laço por elemento.
+    Os textos viram uma matriz de códigos de caractere (posição × linha); os
+    dígitos são acumulados posição a posição (Horner) em uma mantissa inteira,
+    dividida no final por 10^(casas decimais). A divisão de um inteiro exato por
+    uma potência de 10 é corretamente arredondada, então o resultado é idêntico
+    ao de `float()`. Formas pouco comuns (espaços, "R$", notação científica,
+    mais de 15 dígitos) caem em `parse_price`.
+    """
+    chars = np.asarray(texts, dtype=str)
+    if chars.dtype.itemsize == 0:
+        return np.full(len(chars), np.nan)
+    wide_codes = chars.view(np.uint32).reshape(len(chars), -1)
+    is_ascii = wide_codes.max(axis=1) < 128
+    codes = np.ascontiguousarray(wide_codes.T.astype(np.uint8))
+    digits = codes - np.uint8(48)
+    is_digit = digits < 10
+    is_comma = codes == 44
+
+    allowed = is_digit | is_comma | (codes == 46) | (codes == 0)
+    allowed[0] |= codes[0] == 45
+    digit_count = np.count_nonzero(is_digit, axis=0)
+    fast = (is_ascii & allowed.all(axis=0) & (np.count_nonzero(is_comma, axis=0) <= 1)
+            & (digit_count > 0) & (digit_count <= 15))
+
+    mantissa = np.zeros(len(chars), dtype=np.int64)
+    decimals = np.zeros(len(chars), dtype=np.int64)
+    after_comma = np.zeros(len(chars), dtype=bool)
+    for position in range(len(codes)):
+        digit = is_digit[position]
+        mantissa = np.where(digit, mantissa * 10 + digits[position], mantissa)
+        after_comma |= is_comma[position]
+        decimals += digit & after_comma
+
+    parsed = mantissa / np.power(10.0, decimals)
+    parsed = np.where(codes[0] == 45, -parsed, parsed)
+    parsed[~fast] = [parse_price(text) for text in np.asarray(texts, dtype=object)[~fast]]
+    return parsed
+
+
+def parse_price_series(values: pd.Series) -> pd.Series:
+    """
+    Conversão vetorizada de uma coluna de preços para float64 (NaN onde falhar).
+    Textos seguem o formato brasileiro ("1.234,56", "R$ 12,50"); valores que já
+    são numéricos são mantidos como estão.
+    """
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(np.float64)
+    raw = values.to_numpy(dtype=object)
+    if pd.api.types.infer_dtype(values, skipna=True) == 'string':
+        # Caso comum (leitura do CSV): só textos e valores ausentes
+        is_text = values.notna().to_numpy()
+        parsed = np.full(len(values), np.nan)
+    else:
+        # Coluna mista (ex.: payload JSON com números e textos): separa por tipo
+        is_text = values.map(type).eq(str).to_numpy()
+        parsed = np.array(pd.to_numeric(values.where(~is_text), errors='coerce'), dtype=np.float64)
+    if is_text.any():
+        parsed[is_text] = _parse_price_text(raw[is_text])
+    return pd.Series(parsed, index=values.index)
+
+
+def parse_prices(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte e valida a coluna de preço; valores inválidos viram 0.0 e são marcados."""
+    parsed = parse_price_series(df['preco'])
+    df['preco_invalido'] = parsed.isna() | np.isinf(parsed)
+    df['preco'] = parsed.where(~df['preco_invalido'], 0.0).astype(np.float64)
+    return df
+
+
+def price_issue_counts(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Contagens de problemas de preço por fonte em um bloco já convertido por
+    `parse_prices`. As contagens são aditivas entre blocos.
+    """
+    valid = ~df['preco_invalido']
+    issues = pd.DataFrame({
+        'fonte': df['fonte'].astype(str),
+        'total': 1,
+        'invalidos': df['preco_invalido'].astype(np.int64),
+        'zerados': (valid & (df['preco'] == 0)).astype(np.int64),
+        'negativos': (valid & (df['preco'] < 0)).astype(np.int64),
+    })
+    return issues.groupby('fonte', sort=True).sum()
+
+
+def price_validation_report(issue_counts: list[pd.DataFrame], fontes, precos) -> pd.DataFrame:
+    """
+    Relatório de validação de preços por fonte: totais de inválidos, zerados e
+    negativos (somados dos blocos) e de valores extremos, fora de um fator
+    EXTREME_PRICE_FACTOR da mediana dos preços positivos da mesma fonte.
+    `fontes` pode ser um pd.Categorical (ex.: códigos lidos do disco), sem
+    materializar o nome da fonte de cada linha.
+    """
+    report = pd.concat(issue_counts).groupby(level=0).sum() if issue_counts else pd.DataFrame(
+        columns=['total', 'invalidos', 'zerados', 'negativos'])
+    fontes = fontes if isinstance(fontes, pd.Categorical) else pd.Categorical(np.asarray(fontes, dtype=object))
+    prices = pd.DataFrame({'fonte': fontes.codes, 'preco': np.asarray(precos, dtype=np.float64)})
+    prices = prices[prices['preco'] > 0]
+    median = prices.groupby('fonte')['preco'].transform('median')
+    extreme = (prices['preco'] > median * EXTREME_PRICE_FACTOR) | (prices['preco'] < median / EXTREME_PRICE_FACTOR)
+    names = np.asarray(fontes.categories, dtype=object)
+    extremes = prices[extreme].groupby('fonte').size()
+    medians = prices.groupby('fonte')['preco'].median()
+    report['extremos'] = extremes.set_axis(names[extremes.index]).reindex(report.index, fill_value=0)
+    report['mediana'] = medians.set_axis(names[medians.index]).reindex(report.index).round(2)
+    return report.fillna({'extremos': 0}).astype({'extremos': np.int64})
+
+
+def print_price_report(report: pd.DataFrame):
+    issues = report[['invalidos', 'zerados', 'negativos', 'extremos']]
+    if not issues.to_numpy().any():
+        print("INFO: Validação de preços: nenhum problema encontrado.")
+        return
+    print(f"AVISO: {int(report['invalidos'].sum())} preços não puderam ser convertidos e foram registrados como 0.0.")
+    print("AVISO: Validação de preços por fonte (inválidos / zerados / negativos / extremos):")
+    for row in report[issues.any(axis=1)].itertuples():
+        print(f"   • {row.Index}: {row.invalidos} / {row.zerados} / {row.negativos} / {row.extremos} "
+              f"de {row.total} (mediana {row.mediana})")
+
+
+def report_to_dict(report: pd.DataFrame) -> dict:
+    """Relatório em formato serializável (fonte -> contagens), para o cache e a API."""
+    return json.loads(report.to_json(orient='index'))
+
+
+def process_chunk(chunk: pd.DataFrame):
+    """
+    Processa um bloco de linhas já padronizadas: normalização das descrições,
+    conversão/validação de preços e tokenização para o BM25.
+    Executado nos processos do pool; retorna o bloco e seus postings parciais.
+    """
+    global _worker_normalizer
+    if _worker_normalizer is None:
+        _worker_normalizer = TextNormalizer()
+
+    chunk = parse_prices(chunk)
+    chunk['descricao_normalizada'] = _worker_normalizer.normalize_many(chunk['descricao_original'])
+    postings = KeywordIndex.partial_postings(doc.split(" ") for doc in chunk['descricao_normalizada'])
+    return chunk, postings
+
+
+def read_source(filepath: str) -> pd.DataFrame:
+    """Lê o arquivo de origem inteiro, com colunas padronizadas e preço convertido."""
+    df = pd.read_csv(filepath, dtype={'codigo_da_composicao': str})
+    return parse_prices(standardize_columns(df, filepath))
+
+
+def iter_processed_chunks(filepath: str, workers: int = None, chunk_rows: int = 20000):
+    """
+    Lê o arquivo de origem em blocos de `chunk_rows` linhas e os processa em um
+    pool de processos. No máximo 2 blocos por processo ficam em voo, de forma
+    que a memória não cresce com o tamanho do arquivo. Os blocos processados
+    (e seus postings parciais) são entregues na ordem original. Arquivos com
+    menos de PARALLEL_MIN_CHUNKS blocos são processados neste processo.
+    """
+    reader = pd.read_csv(filepath, dtype={'codigo_da_composicao': str}, chunksize=chunk_rows)
+    workers = workers or os.cpu_count() or 1
+    # Os primeiros blocos são lidos antes de decidir: o número de linhas não é conhecido sem ler o arquivo
+    first_chunks = list(itertools.islice(reader, PARALLEL_MIN_CHUNKS))
+    chunks = itertools.chain(first_chunks, reader)
+    if workers == 1 or len(first_chunks) < PARALLEL_MIN_CHUNKS:
+        for chunk in chunks:
+            yield process_chunk(standardize_columns(chunk, filepath))
+        return
+
+    print(f"INFO: Ingestão paralela em blocos de {chunk_rows} registros ({workers} processos)...")
+    # 'spawn': a ingestão roda dentro do servidor (thread de reconstrução do índice), e um
+    # fork de processo com várias threads (uvicorn, torch) pode herdar locks travados
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(process_chunk, standardize_columns(chunk, filepath)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def ingest_file(filepath: str, workers: int = None, chunk_rows: int = 20000):
+    """
+    Pipeline de ingestão paralela. O arquivo é dividido em blocos processados
+    em um pool de processos; os resultados são unidos na ordem original.
+    Retorna o DataFrame pronto para o catálogo, o índice BM25 correspondente
+    (um documento por descrição normalizada distinta, com os mesmos ids do
+    catálogo) e o relatório de validação de preços.
+    """
+    results = list(iter_processed_chunks(filepath, workers, chunk_rows))
+    dataframe = pd.concat([chunk for chunk, _ in results], ignore_index=True)
+    text_ids = InternedTextColumn.from_texts(dataframe['descricao_normalizada']).ids
+    keyword_index = KeywordIndex.from_partial_postings([postings for _, postings in results], doc_groups=text_ids)
+    report = price_validation_report([price_issue_counts(dataframe)], dataframe['fonte'], dataframe['preco'])
+    print_price_report(report)
+    return dataframe.drop(columns=['preco_invalido']), keyword_index, report
+
+
+def stream_ingest(filepath: str, output_dir: str, encode_embeddings, workers: int = None, chunk_rows: int = 20000):
+    """
+    Ingestão em streaming, com memória limitada, para catálogos muito grandes.
+    Cada bloco processado é gravado imediatamente em `output_dir` (colunas do
+    catálogo e embeddings, via `encode_embeddings(textos) -> array`).
+    Embeddings e documentos do BM25 existem uma vez por descrição normalizada
+    distinta: de cada bloco só ficam os postings dos textos vistos pela
+    primeira vez, e as linhas repetidas entram apenas na contagem de peso.
+    O relatório de preços usa as contagens por bloco e, para medianas e
+    extremos, só as colunas numéricas gravadas (fonte e preço, mapeadas do disco).
+    Retorna o índice BM25, o número de registros e o relatório de preços.
+    """
+    catalog_dir = os.path.join(output_dir, 'catalogo')
+    catalog_writer = CatalogWriter(catalog_dir)
+    embeddings_writer = ArrayFileWriter(os.path.join(output_dir, 'embeddings.npy'), np.float32)
+    text_postings = []
+    text_weights = np.zeros(0, dtype=np.int64)
+    issue_counts = []
+    for chunk, postings in iter_processed_chunks(filepath, workers, chunk_rows):
+        known_texts = len(text_weights)
+        text_ids, new_texts = catalog_writer.append(chunk)['descricao_normalizada']
+        if new_texts:
+            embeddings_writer.append(encode_embeddings(new_texts))
+            # Primeira linha de cada texto novo, na ordem dos ids
+            new_rows = np.flatnonzero(text_ids >= known_texts)
+            first_rows = new_rows[np.unique(text_ids[new_rows], return_index=True)[1]]
+            text_postings.append(KeywordIndex.select_documents(postings, first_rows))
+        chunk_weights = np.bincount(text_ids, minlength=known_texts + len(new_texts))
+        chunk_weights[:known_texts] += text_weights
+        text_weights = chunk_weights
+        issue_counts.append(price_issue_counts(chunk))
+        print(f"INFO: Ingestão em streaming: {catalog_writer.rows} registros gravados...")
+
+    catalog_writer.close()
+    embeddings_writer.close()
+    # Os extremos dependem da mediana de cada fonte: calculados no final, sobre as colunas numéricas gravadas
+    fontes = pd.Categorical.from_codes(load_array(os.path.join(catalog_dir, 'fonte.codes.npy')),
+                                       TextColumn.load(catalog_dir, 'fonte.categories', mmap=False).to_list())
+    report = price_validation_report(issue_counts, fontes, load_array(os.path.join(catalog_dir, 'preco.npy')))
+    print_price_report(report)
+    keyword_index = KeywordIndex.from_partial_postings(text_postings, doc_weights=text_weights)
+    return keyword_index, catalog_writer.rows, report
@@ -0,0 +1,382 @@
+# /services/keyword_index.py
+import os
+import json
+import bisect
+from collections import Counter
+import numpy as np
+from backend.core.array_store import save_array, load_member, read_json_member, TextColumn
+
+
+class KeywordIndex:
+    """
+    Índice BM25 (variante Okapi) em arrays planos.
+    O vocabulário fica ordenado em uma coluna de texto e as listas invertidas são
+    guardadas em três vetores (offsets por termo, ids de documento e frequências),
+    de forma que o índice pode ser mapeado do disco e usado diretamente na busca.
+    Os scores são os mesmos do BM25Okapi do rank_bm25 com os parâmetros padrão.
+
+    Um documento pode representar várias linhas idênticas do corpus (mesma
+    descrição normalizada): `doc_weights` guarda quantas, e entra na frequência
+    de documentos, no tamanho do corpus e no comprimento médio. Assim o índice
+    tem um documento por texto distinto e os scores continuam iguais aos do
+    BM25 sobre todas as linhas.
+
+    Atualizações online (`apply_delta`) não reordenam os postings: documentos
+    novos ficam em um segmento à parte (termos que não estão no vocabulário
+    recebem ids a partir de len(vocab)), incorporado ao gravar.
+    """
+    META_FILENAME = 'bm25.json'
+
+    def __init__(self, vocab: TextColumn, postings_offsets: np.ndarray, doc_ids: np.ndarray,
+                 term_freqs: np.ndarray, doc_lengths: np.ndarray, idf: np.ndarray,
+                 doc_weights: np.ndarray = None, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.vocab = vocab
+        self.postings_offsets = postings_offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.idf = idf
+        self.doc_weights = np.ones(len(doc_lengths), dtype=np.int32) if doc_weights is None else doc_weights
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        total_weight = int(self.doc_weights.sum())
+        self.avgdl = float(np.dot(doc_lengths, self.doc_weights)) / total_weight if total_weight else 0.0
+        # Parte do denominador do BM25 que só depende do documento
+        self._length_norm = self.k1 * (1 - self.b + self.b * doc_lengths / self.avgdl) if self.avgdl else np.zeros(len(doc_lengths))
+        # Segmento das atualizações online: termo novo -> id e id do termo -> (documentos, frequências)
+        self._extra_terms = {}
+        self._extra_postings = {}
+        # Frequência de documentos ponderada por termo, calculada na primeira atualização
+        self._doc_freqs = None
+
+    @classmethod
+    def build(cls, tokenized_corpus, **params):
+        """Constrói o índice a partir do corpus já tokenizado (lista de listas de termos)."""
+        return cls.from_partial_postings([cls.partial_postings(tokenized_corpus)], **params)
+
+    @staticmethod
+    def partial_postings(tokenized_docs) -> dict:
+        """
+        Postings de um bloco de documentos, com vocabulário e ids de documento
+        locais ao bloco. Blocos podem ser gerados em paralelo e depois unidos
+        com `from_partial_postings`.
+        """
+        term_to_id = {}
+        term_ids, doc_ids, term_freqs, doc_lengths = [], [], [], []
+        for doc_id, tokens in enumerate(tokenized_docs):
+            doc_lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                term_ids.append(term_to_id.setdefault(term, len(term_to_id)))
+                doc_ids.append(doc_id)
+                term_freqs.append(freq)
+        return {
+            'terms': list(term_to_id),
+            'term_ids': np.array(term_ids, dtype=np.int64),
+            'doc_ids': np.array(doc_ids, dtype=np.int64),
+            'term_freqs': np.array(term_freqs, dtype=np.int32),
+            'doc_lengths': np.array(doc_lengths, dtype=np.int32),
+        }
+
+    @staticmethod
+    def select_documents(part: dict, docs: np.ndarray) -> dict:
+        """
+        Postings parciais restritos aos documentos `docs` (ids locais ao bloco),
+        renumerados na ordem dada. Termos sem ocorrência nesses documentos saem
+        do vocabulário do bloco.
+        """
+        docs = np.asarray(docs, dtype=np.int64)
+        new_doc_ids = np.full(len(part['doc_lengths']), -1, dtype=np.int64)
+        new_doc_ids[docs] = np.arange(len(docs))
+        keep = new_doc_ids[part['doc_ids']] >= 0
+        used_terms, term_ids = np.unique(part['term_ids'][keep], return_inverse=True)
+        return {
+            'terms': [part['terms'][i] for i in used_terms],
+            'term_ids': term_ids.reshape(-1).astype(np.int64),
+            'doc_ids': new_doc_ids[part['doc_ids'][keep]],
+            'term_freqs': part['term_freqs'][keep],
+            'doc_lengths': part['doc_lengths'][docs],
+        }
+
+    @classmethod
+    def from_partial_postings(cls, parts: list[dict], doc_groups: np.ndarray = None,
+                              doc_weights: np.ndarray = None, **params):
+        """
+        Une postings parciais, na ordem dada, em um único índice. Com
+        `doc_groups` (id do texto de cada documento), documentos do mesmo grupo
+        viram um só, de id igual ao do grupo (ver `_collapse_postings`). Se os
+        blocos já trazem um documento por texto, `doc_weights` dá o número de
+        linhas de cada um.
+        """
+        term_to_id = {}
+        term_ids, doc_ids, term_freqs, doc_lengths = [], [], [], []
+        doc_offset = 0
+        for part in parts:
+            local_to_global = np.array([term_to_id.setdefault(term, len(term_to_id)) for term in part['terms']],
+                                       dtype=np.int64)
+            term_ids.append(local_to_global[part['term_ids']])
+            doc_ids.append(part['doc_ids'] + doc_offset)
+            term_freqs.append(part['term_freqs'])
+            doc_lengths.append(part['doc_lengths'])
+            doc_offset += len(part['doc_lengths'])
+        if not parts:
+            term_ids, doc_ids, term_freqs, doc_lengths = [np.zeros(0, dtype=np.int64)] * 4
+        postings = (np.concatenate(term_ids), np.concatenate(doc_ids), np.concatenate(term_freqs))
+        doc_lengths = np.concatenate(doc_lengths)
+        if doc_groups is not None:
+            postings, doc_lengths, doc_weights = cls._collapse_postings(*postings, doc_lengths, doc_groups)
+        return cls.from_postings(list(term_to_id), *postings, doc_lengths, doc_weights=doc_weights, **params)
+
+    @staticmethod
+    def _collapse_postings(term_ids, doc_ids, term_freqs, doc_lengths, doc_groups):
+        """
+        Documentos com o mesmo id em `doc_groups` têm os mesmos tokens: mantém
+        só os postings da primeira ocorrência de cada grupo, renumerados pelo
+        id do grupo, e conta as ocorrências como peso do documento.
+        """
+        doc_groups = np.asarray(doc_groups, dtype=np.int64)
+        groups = int(doc_groups.max()) + 1 if len(doc_groups) else 0
+        first = np.zeros(len(doc_groups), dtype=bool)
+        first[np.unique(doc_groups, return_index=True)[1]] = True
+        keep = first[doc_ids]
+        group_lengths = np.zeros(groups, dtype=np.int32)
+        group_lengths[doc_groups[first]] = doc_lengths[first]
+        weights = np.bincount(doc_groups, minlength=groups).astype(np.int32)
+        return (term_ids[keep], doc_groups[doc_ids[keep]], term_freqs[keep]), group_lengths, weights
+
+    @classmethod
+    def from_postings(cls, terms: list[str], term_ids: np.ndarray, doc_ids: np.ndarray,
+                      term_freqs: np.ndarray, doc_lengths: np.ndarray, doc_weights: np.ndarray = None,
+                      k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        """
+        Monta o índice a partir de triplas (termo, documento, frequência) em qualquer ordem.
+        `doc_weights` é o número de linhas representadas por cada documento (padrão: 1).
+        """
+        if doc_weights is None:
+            doc_weights = np.ones(len(doc_lengths), dtype=np.int32)
+        # Descarta termos sem nenhuma ocorrência (ex.: após remover documentos)
+        used_terms, term_ids = np.unique(term_ids, return_inverse=True)
+        terms = [terms[i] for i in used_terms]
+
+        # Reordena o vocabulário e as triplas para termos em ordem lexicográfica
+        sorted_terms = sorted(range(len(terms)), key=terms.__getitem__)
+        rank = np.empty(len(terms), dtype=np.int64)
+        rank[sorted_terms] = np.arange(len(terms))
+        term_ids = rank[term_ids]
+        order = np.lexsort((doc_ids, term_ids))
+        term_ids, doc_ids, term_freqs = term_ids[order], doc_ids[order], term_freqs[order]
+
+        postings_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(terms)), out=postings_offsets[1:])
+        # Frequência de documentos em linhas do corpus: cada documento conta pelo seu peso
+        doc_freqs = np.bincount(term_ids, weights=doc_weights[doc_ids], minlength=len(terms))
+
+        idf = cls._compute_idf(doc_freqs, int(doc_weights.sum()), epsilon)
+        vocab = TextColumn.from_texts([terms[i] for i in sorted_terms])
+        return cls(vocab, postings_offsets, doc_ids.astype(np.int32), term_freqs.astype(np.int32),
+                   doc_lengths.astype(np.int32), idf, doc_weights=doc_weights.astype(np.int32),
+                   k1=k1, b=b, epsilon=epsilon)
+
+    def apply_delta(self, documents: dict, doc_weights: np.ndarray):
+        """
+        Novo índice (este não muda) com documentos novos e/ou pesos alterados.
+        `documents` dá os tokens de cada documento novo (ids em sequência a
+        partir de len(self)) e de cada documento existente cujo peso mudou;
+        `doc_weights` são os pesos de todos os documentos. Os postings dos
+        documentos novos vão para o segmento à parte e a frequência de
+        documentos muda só nos termos tocados; IDF e comprimento médio são
+        recalculados, então os scores são os de um índice reconstruído.
+        """
+        doc_weights = np.asarray(doc_weights, dtype=np.int32)
+        first_new = len(self)
+        new_docs = sorted(doc_id for doc_id in documents if doc_id >= first_new)
+        extra_terms = dict(self._extra_terms)
+        term_ids, doc_ids, term_freqs = [], [], []
+        for doc_id, tokens in documents.items():
+            for term, freq in Counter(tokens).items():
+                tid = self.term_id(term)
+                if tid is None:
+                    tid = extra_terms.setdefault(term, len(self.vocab) + len(extra_terms))
+                term_ids.append(tid)
+                doc_ids.append(doc_id)
+                term_freqs.append(freq)
+        term_ids = np.array(term_ids, dtype=np.int64)
+        doc_ids = np.array(doc_ids, dtype=np.int64)
+        term_freqs = np.array(term_freqs, dtype=np.int32)
+
+        old_weights = np.zeros(len(doc_weights), dtype=np.int64)
+        old_weights[:first_new] = self.doc_weights
+        doc_freqs = np.zeros(len(self.vocab) + len(extra_terms))
+        current = self._weighted_doc_freqs()
+        doc_freqs[:len(current)] = current
+        np.add.at(doc_freqs, term_ids, doc_weights[doc_ids] - old_weights[doc_ids])
+
+        extra_postings = dict(self._extra_postings)
+        added = doc_ids >= first_new
+        for tid in np.unique(term_ids[added]):
+            mask = added & (term_ids == tid)
+            docs, freqs = extra_postings.get(int(tid), (np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)))
+            extra_postings[int(tid)] = (np.concatenate([docs, doc_ids[mask].astype(np.int32)]),
+                                        np.concatenate([freqs, term_freqs[mask]]))
+
+        doc_lengths = np.concatenate([self.doc_lengths,
+                                      np.array([len(documents[doc_id]) for doc_id in new_docs], dtype=np.int32)])
+        index = KeywordIndex(self.vocab, self.postings_offsets, self.doc_ids, self.term_freqs, doc_lengths,
+                             self._compute_idf(doc_freqs, int(doc_weights.sum()), self.epsilon),
+                             doc_weights=doc_weights, k1=self.k1, b=self.b, epsilon=self.epsilon)
+        index._extra_terms, index._extra_postings, index._doc_freqs = extra_terms, extra_postings, doc_freqs
+        return index
+
+    def _weighted_doc_freqs(self) -> np.ndarray:
+        if self._doc_freqs is None:
+            term_ids = np.repeat(np.arange(len(self.vocab)), np.diff(self.postings_offsets))
+            self._doc_freqs = np.bincount(term_ids, weights=self.doc_weights[self.doc_ids], minlength=len(self.vocab))
+        return self._doc_freqs
+
+    def _compacted(self):
+        """Índice equivalente com o segmento das atualizações online incorporado aos postings ordenados."""
+        if not self._extra_postings:
+            return self
+        terms = self.vocab.to_list() + list(self._extra_terms)
+        term_ids = [np.repeat(np.arange(len(self.vocab)), np.diff(self.postings_offsets))]
+        doc_ids, term_freqs = [self.doc_ids], [self.term_freqs]
+        for tid, (docs, freqs) in self._extra_postings.items():
+            term_ids.append(np.full(len(docs), tid, dtype=np.int64))
+            doc_ids.append(docs)
+            term_freqs.append(freqs)
+        return self.from_postings(terms, np.concatenate(term_ids), np.concatenate(doc_ids).astype(np.int64),
+                                  np.concatenate(term_freqs), self.doc_lengths, doc_weights=self.doc_weights,
+                                  k1=self.k1, b=self.b, epsilon=self.epsilon)
+
+    def patch(self, old_rows: np.ndarray, new_documents, doc_weights: np.ndarray = None):
+        """
+        Gera um novo índice sem re-tokenizar o corpus inteiro.
+        `old_rows[i]` é a linha do índice atual que continua valendo para o
+        documento i do novo corpus, ou -1 quando o documento é novo/alterado;
+        nesse caso seus tokens vêm, em ordem, de `new_documents`.
+        `doc_weights` são os pesos do novo corpus (padrão: 1 por documento).
+        Linhas antigas não referenciadas são removidas e as estatísticas
+        (frequência de documentos, comprimentos, IDF) são recalculadas.
+        """
+        if self._extra_postings:
+            return self._compacted().patch(old_rows, new_documents, doc_weights=doc_weights)
+        old_rows = np.asarray(old_rows, dtype=np.int64)
+        reused = old_rows >= 0
+
+        # Postings antigos que sobrevivem, com os ids de documento remapeados
+        new_position = np.full(len(self.doc_lengths), -1, dtype=np.int64)
+        new_position[old_rows[reused]] = np.flatnonzero(reused)
+        old_term_ids = np.repeat(np.arange(len(self.vocab)), np.diff(self.postings_offsets))
+        remapped_docs = new_position[self.doc_ids]
+        keep = remapped_docs >= 0
+
+        terms = self.vocab.to_list()
+        term_to_id = {term: i for i, term in enumerate(terms)}
+        term_ids, doc_ids, term_freqs = [old_term_ids[keep]], [remapped_docs[keep]], [self.term_freqs[keep]]
+
+        doc_lengths = np.zeros(len(old_rows), dtype=np.int32)
+        doc_lengths[reused] = self.doc_lengths[old_rows[reused]]
+        added_term_ids, added_doc_ids, added_freqs = [], [], []
+        for doc_id, tokens in zip(np.flatnonzero(~reused), new_documents):
+            doc_lengths[doc_id] = len(tokens)
+            for term, freq in Counter(tokens).items():
+                if term not in term_to_id:
+                    term_to_id[term] = len(terms)
+                    terms.append(term)
+                added_term_ids.append(term_to_id[term])
+                added_doc_ids.append(doc_id)
+                added_freqs.append(freq)
+        term_ids.append(np.array(added_term_ids, dtype=np.int64))
+        doc_ids.append(np.array(added_doc_ids, dtype=np.int64))
+        term_freqs.append(np.array(added_freqs, dtype=np.int32))
+
+        return self.from_postings(terms, np.concatenate(term_ids), np.concatenate(doc_ids),
+                                  np.concatenate(term_freqs), doc_lengths, doc_weights=doc_weights,
+                                  k1=self.k1, b=self.b, epsilon=self.epsilon)
+
+    @staticmethod
+    def _compute_idf(doc_freqs: np.ndarray, corpus_size: int, epsilon: float) -> np.ndarray:
+        """IDF do BM25Okapi: valores negativos são trocados por epsilon * média do IDF."""
+        if len(doc_freqs) == 0:
+            return np.zeros(0, dtype=np.float64)
+        # Termos sem nenhuma linha com peso (ex.: só em documentos de peso 0) ficam
+        # fora da média, como no BM25Okapi, que só conhece os termos do corpus
+        present = doc_freqs > 0
+        idf = np.zeros(len(doc_freqs), dtype=np.float64)
+        idf[present] = np.log(corpus_size - doc_freqs[present] + 0.5) - np.log(doc_freqs[present] + 0.5)
+        if present.any():
+            idf[present & (idf < 0)] = epsilon * idf[present].mean()
+        return idf
+
+    def reweighted(self, doc_weights: np.ndarray):
+        """
+        O mesmo índice com outros pesos por documento (ex.: as linhas de uma
+        versão do catálogo). Os postings são compartilhados; só a frequência de
+        documentos, o IDF e o comprimento médio são recalculados, de modo que os
+        scores ficam iguais aos do BM25 sobre as linhas descritas pelos pesos.
+        """
+        doc_weights = np.asarray(doc_weights, dtype=np.int32)
+        term_ids = np.repeat(np.arange(len(self.vocab)), np.diff(self.postings_offsets))
+        doc_freqs = np.bincount(term_ids, weights=doc_weights[self.doc_ids], minlength=len(self.vocab))
+        idf = self._compute_idf(doc_freqs, int(doc_weights.sum()), self.epsilon)
+        return KeywordIndex(self.vocab, self.postings_offsets, self.doc_ids, self.term_freqs, self.doc_lengths,
+                            idf, doc_weights=doc_weights, k1=self.k1, b=self.b, epsilon=self.epsilon)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def term_id(self, term: str):
+        """Busca binária no vocabulário ordenado. Retorna None se o termo não existir."""
+        pos = bisect.bisect_left(self.vocab, term)
+        if pos < len(self.vocab) and self.vocab[pos] == term:
+            return pos
+        return self._extra_terms.get(term)
+
+    def get_scores(self, tokenized_query: list[str]) -> np.ndarray:
+        """Calcula o score BM25 de todos os documentos para a query tokenizada."""
+        scores = np.zeros(len(self.doc_lengths))
+        for term in tokenized_query:
+            tid = self.term_id(term)
+            if tid is None:
+                continue
+            segments = [self._extra_postings[tid]] if tid in self._extra_postings else []
+            if tid < len(self.vocab):
+                start, end = self.postings_offsets[tid], self.postings_offsets[tid + 1]
+                segments.append((self.doc_ids[start:end], self.term_freqs[start:end]))
+            for docs, tf in segments:
+                scores[docs] += self.idf[tid] * (tf * (self.k1 + 1) / (tf + self._length_norm[docs]))
+        return scores
+
+    def top_k(self, tokenized_query: list[str], top_k: int, exclude: np.ndarray = None) -> list[int]:
+        """
+        Índices dos top_k documentos; empates mantêm a ordem original dos documentos.
+        `exclude` (máscara booleana) retira documentos do ranking.
+        """
+        scores = self.get_scores(tokenized_query)
+        if exclude is not None:
+            scores[exclude] = -np.inf
+            top_k = min(top_k, len(scores) - int(exclude.sum()))
+        return np.argsort(-scores, kind='stable')[:top_k].tolist()
+
+    def save(self, directory: str):
+        if self._extra_postings:
+            return self._compacted().save(directory)
+        os.makedirs(directory, exist_ok=True)
+        self.vocab.save(directory, 'vocab')
+        for name in ('postings_offsets', 'doc_ids', 'term_freqs', 'doc_lengths', 'idf', 'doc_weights'):
+            save_array(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, self.META_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump({'k1': self.k1, 'b': self.b, 'epsilon': self.epsilon, 'documents': len(self)}, f)
+
+    @classmethod
+    def exists(cls, directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, cls.META_FILENAME))
+
+    @classmethod
+    def load(cls, directory):
+        """Carrega o índice de um diretório ou de uma seção de bundle."""
+        meta = read_json_member(directory, cls.META_FILENAME)
+        arrays = {name: load_member(directory, f"{name}.npy")
+                  for name in ('postings_offsets', 'doc_ids', 'term_freqs', 'doc_lengths', 'idf', 'doc_weights')}
+        return cls(TextColumn.load(directory, 'vocab'), **arrays,
+                   k1=meta['k1'], b=meta['b'], epsilon=meta['epsilon'])
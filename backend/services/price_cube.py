@@ -0,0 +1,134 @@
+# /services/price_cube.py
+import os
+import json
+import numpy as np
+import pandas as pd
+from backend.core.array_store import save_array, load_array, TextColumn
+from backend.services.ingest import parse_prices
+from backend.services.index_manifest import file_sha256, source_unchanged
+
+# Colunas do arquivo de preços regionais (formato longo, uma linha por preço)
+PRICE_COLUMNS = ['codigo', 'fonte', 'uf', 'mes', 'desonerado', 'preco']
+# Eixo de regime de desoneração da folha: índice 0 = não desonerado, 1 = desonerado
+DESONERACAO_AXIS = ['nao_desonerado', 'desonerado']
+_TRUE_VALUES = {'1', 'true', 'sim', 's', 'desonerado', 'com desoneracao', 'com desoneração'}
+
+
+class PriceCube:
+    """
+    Cubo denso de preços float32 com eixos categóricos:
+    item (fonte + código) × UF × mês de referência × desoneração.
+    Preços ausentes são NaN. O cubo fica em um .npy mapeado do disco e a
+    consulta é vetorizada, para milhares de itens de uma vez, sem duplicar
+    linhas do catálogo por região.
+    """
+    META_FILENAME = 'cubo.json'
+
+    def __init__(self, values: np.ndarray, fontes: list[str], codigos: list[str], ufs: list[str], meses: list[str],
+                 filled: int = None):
+        self.values = values
+        # Contado uma única vez: o cubo é grande e pode estar mapeado do disco
+        self.filled = int(np.count_nonzero(~np.isnan(values))) if filled is None else filled
+        self.ufs = ufs
+        self.meses = meses
+        self.item_index = pd.MultiIndex.from_arrays([fontes, codigos], names=['fonte', 'codigo'])
+        self._uf_index = pd.Index(ufs)
+        self._mes_index = pd.Index(meses)
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame):
+        """Monta o cubo a partir da tabela longa de preços (colunas em PRICE_COLUMNS)."""
+        df = df.astype({'codigo': str, 'fonte': str, 'mes': str})
+        df['uf'] = df['uf'].astype(str).str.strip().str.upper()
+        df['desonerado'] = df['desonerado'].astype(str).str.strip().str.lower().isin(_TRUE_VALUES).astype(np.int64)
+        df = parse_prices(df)
+        df = df[~df['preco_invalido']]
+
+        item_codes, items = pd.MultiIndex.from_frame(df[['fonte', 'codigo']]).factorize()
+        uf_codes = pd.Categorical(df['uf'])
+        mes_codes = pd.Categorical(df['mes'])
+        values = np.full((len(items), len(uf_codes.categories), len(mes_codes.categories), len(DESONERACAO_AXIS)),
+                         np.nan, dtype=np.float32)
+        # Em caso de linhas repetidas, vale a última
+        values[item_codes, uf_codes.codes, mes_codes.codes, df['desonerado'].to_numpy()] = df['preco'].to_numpy()
+        return cls(values, list(items.get_level_values(0)), list(items.get_level_values(1)),
+                   list(uf_codes.categories), list(mes_codes.categories))
+
+    @classmethod
+    def from_file(cls, filepath: str):
+        df = pd.read_csv(filepath, dtype={'codigo': str, 'mes': str})
+        missing = [col for col in PRICE_COLUMNS if col not in df.columns]
+        if missing:
+            raise ValueError(f"ERRO CRÍTICO: Colunas {missing} não encontradas no arquivo de preços '{filepath}'.")
+        return cls.from_dataframe(df[PRICE_COLUMNS])
+
+    def __len__(self):
+        return len(self.item_index)
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes
+
+    def item_rows(self, fontes, codigos) -> np.ndarray:
+        """Posição de cada (fonte, código) no eixo de itens, ou -1 se não houver preço."""
+        keys = pd.MultiIndex.from_arrays([pd.Index(fontes, dtype=object).astype(str),
+                                          pd.Index(codigos, dtype=object).astype(str)])
+        return self.item_index.get_indexer(keys)
+
+    def lookup(self, fontes, codigos, uf: str, mes: str = None, desonerado: bool = False) -> np.ndarray:
+        """
+        Preços de vários itens em um contexto (UF, mês, desoneração), vetorizado.
+        Sem `mes`, usa o mês mais recente com preço para cada item. Itens sem
+        preço no contexto retornam NaN.
+        """
+        rows = self.item_rows(fontes, codigos)
+        prices = np.full(len(rows), np.nan, dtype=np.float32)
+        uf_pos = self._uf_index.get_indexer([str(uf).upper()])[0]
+        if uf_pos < 0:
+            return prices
+        found = rows >= 0
+        by_month = self.values[rows[found], uf_pos, :, int(bool(desonerado))]
+        if mes is not None:
+            mes_pos = self._mes_index.get_indexer([str(mes)])[0]
+            if mes_pos >= 0:
+                prices[found] = by_month[:, mes_pos]
+            return prices
+        # Último mês com preço: percorre o eixo de meses de trás para frente
+        has_price = ~np.isnan(by_month)
+        last = by_month.shape[1] - 1 - np.argmax(has_price[:, ::-1], axis=1)
+        prices[found] = np.where(has_price.any(axis=1), by_month[np.arange(len(by_month)), last], np.nan)
+        return prices
+
+    def save(self, directory: str, source_path: str):
+        os.makedirs(directory, exist_ok=True)
+        save_array(os.path.join(directory, 'precos.npy'), self.values)
+        TextColumn.from_texts(self.item_index.get_level_values('fonte')).save(directory, 'fonte')
+        TextColumn.from_texts(self.item_index.get_level_values('codigo')).save(directory, 'codigo')
+        stat = os.stat(source_path)
+        with open(os.path.join(directory, self.META_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump({'ufs': self.ufs, 'meses': self.meses, 'desoneracao': DESONERACAO_AXIS,
+                       'precos_preenchidos': self.filled, 'source_sha256': file_sha256(source_path), 'source_size': stat.st_size,
+                       'source_mtime': stat.st_mtime}, f, ensure_ascii=False)
+
+    @classmethod
+    def is_current(cls, directory: str, source_path: str) -> bool:
+        try:
+            with open(os.path.join(directory, cls.META_FILENAME), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        return source_unchanged(meta, source_path)
+
+    @classmethod
+    def load(cls, directory: str):
+        with open(os.path.join(directory, cls.META_FILENAME), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(load_array(os.path.join(directory, 'precos.npy')),
+                   TextColumn.load(directory, 'fonte', mmap=False).to_list(),
+                   TextColumn.load(directory, 'codigo', mmap=False).to_list(),
+                   meta['ufs'], meta['meses'], filled=meta.get('precos_preenchidos'))
+
+    def describe(self) -> dict:
+        return {'itens': len(self), 'ufs': self.ufs, 'meses': self.meses, 'desoneracao': DESONERACAO_AXIS,
+                'precos_preenchidos': self.filled,
+                'tamanho_mb': round(self.nbytes / 2**20, 1)}
@@ -1,7 +1,7 @@
 # /app/reasoner.py
 import os
 import json
-from openai import OpenAI
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,7 +11,7 @@ class ReasonerAgent:
     Agente Raciocinador com capacidade de sugerir novas buscas em caso de falha.
     """
     def __init__(self):
-        self.client = OpenAI()
+        self.client = AsyncOpenAI()
         self.config = self._load_config()
         self.model = self.config.get('model', 'gpt-4o-mini')
         self.base_prompt = self.config.get('base_prompt', 'Você é um engenheiro de especificações sênior, extremamente detalhista.')
@@ -66,24 +66,38 @@ Sua resposta final DEVE ser um objeto JSON formatado EXATAMENTE da seguinte form
 """
         return prompt
 
-    def choose_best_option(self, user_query: str, search_results: list[dict], user_guidance: str = None) -> dict:
+    async def choose_best_option(self, user_query: str, search_results: list[dict], user_guidance: str = None,
+                                 on_token=None) -> dict:
         """
         Retorna um dicionário contendo a análise completa e a decisão do LLM.
         Aceita orientação manual do usuário para refinar o processo de decisão.
+        A chamada ao LLM é assíncrona: o event loop segue atendendo outras buscas.
+        Com `on_token`, a resposta é pedida em streaming e cada trecho de texto
+        recebido é repassado a `on_token(trecho)` à medida que chega.
         """
         if not search_results:
             return {"raciocinio": "Nenhum candidato inicial foi fornecido pelo recuperador.", "codigo_final": "N/A", "palavras_chave_para_nova_busca": user_query}
         
         prompt = self._build_expert_prompt(user_query, search_results, user_guidance)
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.0,
-                response_format={"type": "json_object"}
+                response_format={"type": "json_object"},
+                stream=on_token is not None
             )
-            
-            full_response_text = response.choices[0].message.content
+
+            if on_token is None:
+                full_response_text = response.choices[0].message.content
+            else:
+                chunks = []
+                async for chunk in response:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        chunks.append(delta)
+                        on_token(delta)
+                full_response_text = "".join(chunks)
             print(f"DEBUG: Resposta completa do LLM:\n---\n{full_response_text}\n---")
             
             result_json = json.loads(full_response_text)
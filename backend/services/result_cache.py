@@ -0,0 +1,145 @@
+# /services/result_cache.py
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Hash da configuração por caminho: ((caminho, tamanho, mtime), sha256)
+_config_digests = {}
+
+
+def config_digest(path: str = "agents_config.json") -> str:
+    """
+    sha256 do arquivo de configuração dos agentes (prompts, modelos, prioridades).
+    O hash é recalculado só quando tamanho ou data de modificação mudam.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return "sem-config"
+    signature = (path, stat.st_size, stat.st_mtime)
+    cached = _config_digests.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    _config_digests[path] = (signature, digest)
+    return digest
+
+
+class ResultCache:
+    """
+    Cache de respostas completas da busca em dois níveis: um LRU em memória,
+    por processo, e um SQLite em disco compartilhado por todos os workers.
+    A chave inclui o índice em uso e o hash da configuração dos agentes, de
+    forma que reindexações e mudanças de prompt invalidam o cache sozinhas.
+    Cada nível tem TTL e limite de itens próprios.
+    """
+    # A limpeza de expirados/excedentes no disco roda a cada N gravações
+    _PRUNE_EVERY = 100
+
+    def __init__(self, db_path: str, memory_items: int = 512, memory_ttl: float = 3600,
+                 disk_items: int = 50000, disk_ttl: float = 7 * 24 * 3600):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.db_path = db_path
+        self.memory_items = memory_items
+        self.memory_ttl = memory_ttl
+        self.disk_items = disk_items
+        self.disk_ttl = disk_ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.stats = {'hits_memoria': 0, 'hits_disco': 0, 'misses': 0, 'gravacoes': 0}
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS resultados ("
+            " chave TEXT PRIMARY KEY, valor TEXT NOT NULL, criado_em REAL NOT NULL, acessado_em REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS resultados_acesso ON resultados (acessado_em)")
+        self.conn.commit()
+
+    @classmethod
+    def from_env(cls, cache_dir: str):
+        """Cria o cache com limites e TTLs das variáveis de ambiente RESULT_CACHE_*."""
+        return cls(os.getenv("RESULT_CACHE_PATH", os.path.join(cache_dir, 'resultados.sqlite')),
+                   memory_items=int(os.getenv("RESULT_CACHE_MEMORY_ITEMS", 512)),
+                   memory_ttl=float(os.getenv("RESULT_CACHE_MEMORY_TTL", 3600)),
+                   disk_items=int(os.getenv("RESULT_CACHE_DISK_ITEMS", 50000)),
+                   disk_ttl=float(os.getenv("RESULT_CACHE_DISK_TTL", 7 * 24 * 3600)))
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """Retorna (valor, nível) — nível 'memoria' ou 'disco' — ou (None, None)."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] <= self.memory_ttl:
+                self._memory.move_to_end(key)
+                self.stats['hits_memoria'] += 1
+                return entry[1], 'memoria'
+            self._memory.pop(key, None)
+
+            row = self.conn.execute("SELECT valor, criado_em FROM resultados WHERE chave = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.disk_ttl:
+                self.stats['misses'] += 1
+                return None, None
+            self.conn.execute("UPDATE resultados SET acessado_em = ? WHERE chave = ?", (now, key))
+            self.conn.commit()
+            value = json.loads(row[0])
+            self._remember(key, value, now)
+            self.stats['hits_disco'] += 1
+            return value, 'disco'
+
+    def put(self, key: str, value):
+        now = time.time()
+        encoded = json.dumps(value, ensure_ascii=False, default=str)
+        with self._lock:
+            self._remember(key, value, now)
+            self.conn.execute("INSERT OR REPLACE INTO resultados (chave, valor, criado_em, acessado_em) VALUES (?, ?, ?, ?)",
+                              (key, encoded, now, now))
+            self._writes += 1
+            if self._writes % self._PRUNE_EVERY == 0:
+                self._prune_disk(now)
+            self.conn.commit()
+            self.stats['gravacoes'] += 1
+
+    def _remember(self, key, value, now):
+        self._memory[key] = (now, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _prune_disk(self, now):
+        """Remove os expirados e, acima do limite, os acessados há mais tempo."""
+        self.conn.execute("DELETE FROM resultados WHERE criado_em < ?", (now - self.disk_ttl,))
+        self.conn.execute("DELETE FROM resultados WHERE chave IN "
+                          "(SELECT chave FROM resultados ORDER BY acessado_em DESC LIMIT -1 OFFSET ?)",
+                          (self.disk_items,))
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self.conn.execute("DELETE FROM resultados")
+            self.conn.commit()
+
+    def describe(self) -> dict:
+        with self._lock:
+            disk_entries = self.conn.execute("SELECT COUNT(*) FROM resultados").fetchone()[0]
+            memory_entries = len(self._memory)
+            stats = dict(self.stats)
+        lookups = stats['hits_memoria'] + stats['hits_disco'] + stats['misses']
+        hits = stats['hits_memoria'] + stats['hits_disco']
+        return {
+            **stats,
+            'taxa_acerto': round(hits / lookups, 4) if lookups else None,
+            'memoria': {'itens': memory_entries, 'limite': self.memory_items, 'ttl_segundos': self.memory_ttl},
+            'disco': {'itens': disk_entries, 'limite': self.disk_items, 'ttl_segundos': self.disk_ttl,
+                      'arquivo': self.db_path},
+        }
@@ -0,0 +1,119 @@
+# /services/semantic_cache.py
+import re
+import json
+import threading
+from collections import OrderedDict
+import numpy as np
+from backend.services.result_cache import config_digest
+
+DEFAULT_SETTINGS = {'enabled': True, 'similarity_threshold': 0.97, 'max_entries': 2000}
+# Partições (índice + configuração + perfil/parâmetros) mantidas em memória
+MAX_PARTITIONS = 64
+_NUMBER = re.compile(r'\d+(?:[.,]\d+)?')
+
+
+def numeric_signature(normalized_query: str) -> str:
+    """
+    Números da consulta (dimensões, bitolas, resistências). Consultas com
+    números diferentes nunca compartilham resposta, por mais próximos que
+    sejam os embeddings ("tubo 100mm" x "tubo 150mm").
+    """
+    return ' '.join(sorted(_NUMBER.findall(normalized_query)))
+
+
+class SemanticAnswerCache:
+    """
+    Cache de respostas finais indexado pelo embedding da consulta. Uma nova
+    consulta cujo vetor tenha similaridade de cosseno acima do limiar
+    (`semantic_cache.similarity_threshold` em agents_config.json) com uma
+    consulta já respondida, na mesma partição (índice, configuração, perfil,
+    orientação e parâmetros) e com os mesmos números, recebe a resposta
+    guardada, sem classificação, recuperação ou raciocínio.
+    Fica em memória, por processo; cada partição guarda até `max_entries`
+    respostas em um buffer circular (a mais antiga é sobrescrita), cuja
+    capacidade dobra conforme enche, sem copiar a matriz a cada gravação.
+    """
+    def __init__(self, config_path: str = "agents_config.json"):
+        self.config_path = config_path
+        self._partitions = OrderedDict()
+        self._lock = threading.Lock()
+        self._settings = (None, DEFAULT_SETTINGS)
+        self.stats = {'hits': 0, 'misses': 0, 'gravacoes': 0}
+
+    def settings(self) -> dict:
+        """Configuração atual, relida apenas quando o arquivo muda."""
+        digest = config_digest(self.config_path)
+        if self._settings[0] != digest:
+            try:
+                with open(self.config_path, 'r', encoding='utf-8') as f:
+                    section = json.load(f).get('semantic_cache', {})
+            except (FileNotFoundError, json.JSONDecodeError):
+                section = {}
+            self._settings = (digest, {**DEFAULT_SETTINGS, **section})
+        return self._settings[1]
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.settings()['enabled'])
+
+    def lookup(self, partition, vector: np.ndarray, numbers: str):
+        """Retorna (resposta guardada, similaridade) da consulta mais próxima acima do limiar, ou (None, None)."""
+        threshold = float(self.settings()['similarity_threshold'])
+        with self._lock:
+            entries = self._partitions.get(partition)
+            if entries is None or not entries['tamanho']:
+                self.stats['misses'] += 1
+                return None, None
+            self._partitions.move_to_end(partition)
+            size = entries['tamanho']
+            similarities = entries['vetores'][:size] @ vector
+            similarities[entries['numeros'][:size] != numbers] = -np.inf
+            best = int(np.argmax(similarities))
+            if similarities[best] < threshold:
+                self.stats['misses'] += 1
+                return None, None
+            self.stats['hits'] += 1
+            return entries['respostas'][best], float(similarities[best])
+
+    def add(self, partition, vector: np.ndarray, numbers: str, query_text: str, outcome: dict):
+        max_entries = int(self.settings()['max_entries'])
+        with self._lock:
+            entries = self._partitions.get(partition)
+            if entries is None or entries['limite'] != max_entries:
+                entries = self._partitions[partition] = {
+                    'vetores': np.zeros((0, len(vector)), dtype=np.float32),
+                    'numeros': np.zeros(0, dtype=object), 'respostas': [],
+                    'tamanho': 0, 'proxima': 0, 'limite': max_entries}
+                self._partitions.move_to_end(partition)
+                while len(self._partitions) > MAX_PARTITIONS:
+                    self._partitions.popitem(last=False)
+            size, capacity = entries['tamanho'], len(entries['respostas'])
+            if size == capacity and capacity < max_entries:
+                # Cresce dobrando a capacidade (cópia amortizada) até o limite
+                capacity = min(max(2 * capacity, 16), max_entries)
+                vectors = np.zeros((capacity, len(vector)), dtype=np.float32)
+                vectors[:size] = entries['vetores'][:size]
+                numbers_buffer = np.empty(capacity, dtype=object)
+                numbers_buffer[:size] = entries['numeros'][:size]
+                entries['vetores'], entries['numeros'] = vectors, numbers_buffer
+                entries['respostas'] = entries['respostas'] + [None] * (capacity - size)
+            # Cheio: sobrescreve a resposta mais antiga
+            slot = entries['proxima']
+            entries['vetores'][slot] = vector
+            entries['numeros'][slot] = numbers
+            entries['respostas'][slot] = {'consulta': query_text, **outcome}
+            entries['tamanho'] = min(size + 1, max_entries)
+            entries['proxima'] = (slot + 1) % max_entries
+            self.stats['gravacoes'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._partitions.clear()
+
+    def describe(self) -> dict:
+        with self._lock:
+            entries = sum(p['tamanho'] for p in self._partitions.values())
+            stats = dict(self.stats)
+        lookups = stats['hits'] + stats['misses']
+        return {**stats, 'taxa_acerto': round(stats['hits'] / lookups, 4) if lookups else None,
+                'particoes': len(self._partitions), 'respostas': entries, **self.settings()}
@@ -2,6 +2,7 @@ import gradio as gr
 import requests
 import pandas as pd
 import time
+import json
 import sys
 from pathlib import Path
 
@@ -20,11 +21,45 @@ except ImportError:
 
 # --- Constantes ---
 API_URL = "http://127.0.0.1:8001/buscar"
+# Variante com eventos a cada etapa (Server-Sent Events)
+STREAM_URL = f"{API_URL}/stream"
+
+def iter_sse_events(response):
+    """Percorre os eventos (nome, dados) de uma resposta text/event-stream."""
+    response.encoding = 'utf-8'
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line.startswith('event:'):
+            event = line[6:].strip()
+        elif line.startswith('data:'):
+            data.append(line[5:].strip())
+        elif not line and event:
+            yield event, json.loads('\n'.join(data))
+            event, data = None, []
+
+def formatar_resultados(results):
+    """Converte os resultados da API no DataFrame exibido na página."""
+    df = pd.DataFrame(results)
+    df_display = df[['codigo', 'descricao', 'preco', 'unidade', 'fonte', 'score']].copy()
+    df_display.rename(columns={
+        'codigo': 'Código',
+        'descricao': 'Descrição',
+        'preco': 'Preço',
+        'unidade': 'Unidade',
+        'fonte': 'Fonte',
+        'score': 'Score Semântico'
+    }, inplace=True)
+    return df_display
 
 def buscar_servico_handler(texto_busca, top_k):
-    """Handler para realizar busca semântica."""
+    """
+    Handler para realizar busca semântica. Usa o endpoint de streaming e
+    atualiza a página a cada etapa: os candidatos da busca híbrida aparecem
+    em milissegundos e o raciocínio da IA é exibido enquanto é gerado.
+    """
     if not texto_busca.strip():
-        return pd.DataFrame(), gr.Markdown("**Status:** ❌ Por favor, insira um texto para busca."), ""
+        yield pd.DataFrame(), gr.Markdown("**Status:** ❌ Por favor, insira um texto para busca."), ""
+        return
     
     start_time = time.time()
     processing_log_text = ""
@@ -41,82 +76,102 @@ def buscar_servico_handler(texto_busca, top_k):
         }
         
         processing_log_text += "🚀 Enviando requisição para a API...\n"
+        yield pd.DataFrame(), gr.Markdown("**Status:** ⏳ Buscando..."), processing_log_text
         
-        request_start = time.time()
-        response = requests.post(API_URL, json=payload, timeout=60)
-        request_time = time.time() - request_start
-        
-        processing_log_text += f"⏱️ Tempo de requisição: {request_time:.2f}s\n"
-        
-        # Log da performance da requisição
-        log_performance(f"API Request - {texto_busca[:50]}", request_time)
-
-        if response.status_code == 200:
-            processing_log_text += "✅ Resposta recebida com sucesso\n"
-            processing_log_text += "🤖 Processando resultados da IA...\n"
-            
-            data = response.json()
-            results = data.get('results', [])
-            detailed_reasoning = data.get('detailed_reasoning', '')
-            execution_time = time.time() - start_time
-            
-            if not results:
-                log_search_results(texto_busca, 0, execution_time)
-                processing_log_text += "❌ Nenhum resultado encontrado\n"
-                return pd.DataFrame(), gr.Markdown("**Status:** Nenhum resultado encontrado."), processing_log_text
-            
-            # Log dos resultados
-            log_search_results(texto_busca, len(results), execution_time)
-            processing_log_text += f"📋 Encontrados {len(results)} resultados relevantes\n"
-            processing_log_text += f"⚡ Tempo total de processamento: {execution_time:.2f}s\n"
-            
-            # Converte os resultados para um DataFrame do Pandas
-            df = pd.DataFrame(results)
-            df_display = df[['codigo', 'descricao', 'preco', 'unidade', 'fonte', 'score']].copy()
-            df_display.rename(columns={
-                'codigo': 'Código',
-                'descricao': 'Descrição',
-                'preco': 'Preço',
-                'unidade': 'Unidade',
-                'fonte': 'Fonte',
-                'score': 'Score Semântico'
-            }, inplace=True)
-            
-            processing_log_text += "🎯 Resultados formatados e prontos para exibição\n"
-            
-            # Adiciona o log detalhado de raciocínio da IA
-            if detailed_reasoning:
-                processing_log_text += "\n" + "="*50 + "\n"
-                processing_log_text += "🧠 LOG DETALHADO DO RACIOCÍNIO DA IA:\n"
-                processing_log_text += "="*50 + "\n"
-                processing_log_text += detailed_reasoning + "\n"
-                processing_log_text += "="*50 + "\n"
+        with requests.post(STREAM_URL, json=payload, stream=True, timeout=60) as response:
+            if response.status_code != 200:
+                error_msg = f"Erro na API: {response.status_code} - {response.text}"
+                processing_log_text += f"❌ {error_msg}\n"
+                log_search_error(texto_busca, error_msg)
+                yield pd.DataFrame(), gr.Markdown(f"**Status:** ❌ {error_msg}"), processing_log_text
+                return
             
-            status_md = f"**Status:** ✅ Busca realizada com sucesso! Encontrados {len(results)} resultados."
-            return df_display, gr.Markdown(status_md), processing_log_text
-        else:
-            error_msg = f"Erro na API: {response.status_code} - {response.text}"
-            processing_log_text += f"❌ {error_msg}\n"
-            log_search_error(texto_busca, error_msg)
-            return pd.DataFrame(), gr.Markdown(f"**Status:** ❌ {error_msg}"), processing_log_text
+            df_display = pd.DataFrame()
+            status_md = "**Status:** ⏳ Classificando a consulta..."
+            live_reasoning = ""
+            for event, data in iter_sse_events(response):
+                elapsed = time.time() - start_time
+                
+                if event == 'classificacao':
+                    processing_log_text += f"🏷️ Classificação: grupo '{data['grupo']}', unidade '{data['unidade']}' ({elapsed:.2f}s)\n"
+                    status_md = "**Status:** ⏳ Buscando candidatos..."
+                
+                elif event == 'candidatos':
+                    df_display = formatar_resultados(data['results'])
+                    log_performance(f"Primeiros candidatos - {texto_busca[:50]}", elapsed)
+                    processing_log_text += f"📋 {len(data['results'])} candidatos preliminares em {elapsed:.2f}s\n"
+                    processing_log_text += "🤖 A IA está analisando os candidatos...\n"
+                    status_md = "**Status:** ⏳ Candidatos preliminares exibidos; a IA está escolhendo o melhor..."
+                
+                elif event == 'raciocinio_token':
+                    # O raciocínio em andamento é exibido abaixo do log, sem entrar nele
+                    live_reasoning += data['texto']
+                    yield df_display, gr.Markdown(status_md), processing_log_text + "\n🧠 Raciocínio da IA (ao vivo):\n" + live_reasoning
+                    continue
+                
+                elif event == 'decisao':
+                    processing_log_text += f"🎯 Decisão da IA: {data.get('codigo_final', 'N/A')} ({elapsed:.2f}s)\n"
+                
+                elif event == 'busca_refinada':
+                    df_display = formatar_resultados(data['results']) if data['results'] else df_display
+                    processing_log_text += f"🔄 Nova busca com palavras-chave refinadas: '{data['query']}'\n"
+                
+                elif event == 'erro':
+                    error_msg = f"Erro na API: {data['status']} - {data['detail']}"
+                    processing_log_text += f"❌ {error_msg}\n"
+                    log_search_error(texto_busca, error_msg)
+                    yield pd.DataFrame(), gr.Markdown(f"**Status:** ❌ {error_msg}"), processing_log_text
+                    return
+                
+                elif event == 'resultado':
+                    results = data.get('results', [])
+                    detailed_reasoning = data.get('detailed_reasoning', '')
+                    execution_time = time.time() - start_time
+                    log_performance(f"API Request - {texto_busca[:50]}", execution_time)
+                    
+                    if not results:
+                        log_search_results(texto_busca, 0, execution_time)
+                        processing_log_text += "❌ Nenhum resultado encontrado\n"
+                        yield pd.DataFrame(), gr.Markdown("**Status:** Nenhum resultado encontrado."), processing_log_text
+                        return
+                    
+                    # Log dos resultados
+                    log_search_results(texto_busca, len(results), execution_time)
+                    processing_log_text += f"✅ Encontrados {len(results)} resultados relevantes\n"
+                    processing_log_text += f"⚡ Tempo total de processamento: {execution_time:.2f}s\n"
+                    
+                    df_display = formatar_resultados(results)
+                    processing_log_text += "🎯 Resultados formatados e prontos para exibição\n"
+                    
+                    # Adiciona o log detalhado de raciocínio da IA
+                    if detailed_reasoning:
+                        processing_log_text += "\n" + "="*50 + "\n"
+                        processing_log_text += "🧠 LOG DETALHADO DO RACIOCÍNIO DA IA:\n"
+                        processing_log_text += "="*50 + "\n"
+                        processing_log_text += detailed_reasoning + "\n"
+                        processing_log_text += "="*50 + "\n"
+                    
+                    status_md = f"**Status:** ✅ Busca realizada com sucesso! Encontrados {len(results)} resultados."
+                
+                yield df_display, gr.Markdown(status_md), processing_log_text
             
     except requests.exceptions.Timeout:
         error_msg = "Timeout: A busca demorou muito para responder"
         processing_log_text += f"⏰ {error_msg}\n"
         log_search_error(texto_busca, error_msg)
-        return pd.DataFrame(), gr.Markdown(f"**Status:** ⏱️ {error_msg}"), processing_log_text
+        yield pd.DataFrame(), gr.Markdown(f"**Status:** ⏱️ {error_msg}"), processing_log_text
         
     except requests.exceptions.RequestException as e:
         error_msg = f"Erro de conexão com a API. Verifique se o backend está rodando. Detalhes: {e}"
         processing_log_text += f"🔌 {error_msg}\n"
         log_search_error(texto_busca, error_msg)
-        return pd.DataFrame(), gr.Markdown(f"**Status:** ❌ {error_msg}"), processing_log_text
+        yield pd.DataFrame(), gr.Markdown(f"**Status:** ❌ {error_msg}"), processing_log_text
         
     except Exception as e:
         error_msg = f"Erro inesperado: {str(e)}"
         processing_log_text += f"💥 {error_msg}\n"
         log_search_error(texto_busca, error_msg)
-        return pd.DataFrame(), gr.Markdown(f"**Status:** ❌ {error_msg}"), processing_log_text
+        yield pd.DataFrame(), gr.Markdown(f"**Status:** ❌ {error_msg}"), processing_log_text
 
 # --- Interface da Página de Busca Semântica ---
 with gr.Blocks() as busca_page:
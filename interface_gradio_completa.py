@@ -9,6 +9,10 @@ import io
 
 # --- Constantes ---
 API_URL = "http://localhost:8000/buscar"
+# Planilhas são enviadas em blocos para a busca em lote
+BATCH_URL = f"{API_URL}/lote"
+BATCH_SIZE = 50
+BATCH_TIMEOUT = 300
 DATABASE_PATH = "dados/banco_dados_servicos.txt"
 LOG_FILE = "processing_log.csv"
 TEMP_DIR = "temp_files"
@@ -99,6 +103,33 @@ def filter_database(query):
     filtered_df = full_db[full_db['Descrição'].str.contains(query, case=False, na=False)]
     return filtered_df
 
+def search_batch(queries):
+    """
+    Envia um bloco de descrições para /buscar/lote e retorna, na mesma ordem,
+    (melhor resultado ou None, status) de cada uma.
+    """
+    outcomes = [(None, None)] * len(queries)
+    try:
+        # A API valida cada descrição à parte: as curtas demais voltam como erro 422 só na sua posição
+        payload = {"consultas": [{"texto_busca": query, "top_k": 1} for query in queries]}
+        response = requests.post(BATCH_URL, json=payload, timeout=BATCH_TIMEOUT)
+    except Exception as e:
+        return [(None, f"ERRO_CONEXAO: {e}")] * len(queries)
+    if response.status_code != 200:
+        return [(None, f"ERRO_API_{response.status_code}")] * len(queries)
+
+    for i, item in enumerate(response.json()['resultados']):
+        results = (item.get('resposta') or {}).get('results', [])
+        if item['status'] == 'ok' and results:
+            outcomes[i] = (results[0], "SUCESSO")
+        elif item['status'] in ('ok', 'nao_encontrado'):
+            outcomes[i] = (None, "NENHUM_RESULTADO")
+        elif item['status_code'] == 422:
+            outcomes[i] = (None, "DESCRICAO_INVALIDA")
+        else:
+            outcomes[i] = (None, f"ERRO_API_{item['status_code']}")
+    return outcomes
+
 def process_excel_file(file_path, progress=gr.Progress()):
     """Processa arquivo Excel em lote"""
     if file_path is None:
@@ -128,44 +159,27 @@ def process_excel_file(file_path, progress=gr.Progress()):
         with open(log_path, 'w', newline='', encoding='utf-8') as log_file:
             log_file.write("linha_original;query;codigo_encontrado;descricao_encontrada;status\n")
 
-            # Itera sobre cada linha da planilha
-            for index, row in df_upload.iterrows():
-                query = row['descricao']
-                status = "FALHA"
-                
-                progress((index + 1) / total_rows, f"Processando linha {index + 1}/{total_rows}...")
-                
-                try:
-                    payload = {"texto_busca": str(query), "top_k": 1}
-                    response = requests.post(API_URL, json=payload, timeout=30)
-                    
-                    if response.status_code == 200:
-                        results = response.json().get('results', [])
-                        if results:
-                            top_result = results[0]
-                            # Preenche com os dados do primeiro resultado
-                            df_upload.at[index, 'codigo_encontrado'] = top_result.get('codigo', 'N/A')
-                            df_upload.at[index, 'fonte_encontrada'] = top_result.get('fonte', 'N/A')
-                            df_upload.at[index, 'descricao_encontrada'] = top_result.get('descricao', 'N/A')
-                            df_upload.at[index, 'unidade_encontrada'] = top_result.get('unidade', 'N/A')
-                            df_upload.at[index, 'valor_unitario_encontrado'] = top_result.get('preco', 0.0)
-                            status = "SUCESSO"
-                        else:
-                            status = "NENHUM_RESULTADO"
-                    else:
-                         status = f"ERRO_API_{response.status_code}"
+            # Envia a planilha em blocos de BATCH_SIZE linhas para a busca em lote
+            for start in range(0, total_rows, BATCH_SIZE):
+                chunk = df_upload.iloc[start:start + BATCH_SIZE]
+                progress(start / total_rows, f"Processando linhas {start + 1}-{start + len(chunk)}/{total_rows}...")
+                outcomes = search_batch([str(query) for query in chunk['descricao']])
 
-                except Exception as e:
-                    status = f"ERRO_CONEXAO: {e}"
+                for index, query, (top_result, status) in zip(chunk.index, chunk['descricao'], outcomes):
+                    if top_result:
+                        # Preenche com os dados do primeiro resultado
+                        df_upload.at[index, 'codigo_encontrado'] = top_result.get('codigo', 'N/A')
+                        df_upload.at[index, 'fonte_encontrada'] = top_result.get('fonte', 'N/A')
+                        df_upload.at[index, 'descricao_encontrada'] = top_result.get('descricao', 'N/A')
+                        df_upload.at[index, 'unidade_encontrada'] = top_result.get('unidade', 'N/A')
+                        df_upload.at[index, 'valor_unitario_encontrado'] = top_result.get('preco', 0.0)
 
-                # Grava no arquivo de log
-                log_file.write(f"{index+1};{query};{df_upload.at[index, 'codigo_encontrado']};{df_upload.at[index, 'descricao_encontrada']};{status}\n")
-                
-                # Salva o arquivo Excel completo a cada 5 linhas (ou na última linha)
-                if (index + 1) % 5 == 0 or (index + 1) == total_rows:
-                    df_upload.to_excel(temp_excel_path, index=False, engine='openpyxl')
-                
-                processed_count += 1
+                    # Grava no arquivo de log
+                    log_file.write(f"{index+1};{query};{df_upload.at[index, 'codigo_encontrado']};{df_upload.at[index, 'descricao_encontrada']};{status}\n")
+                    processed_count += 1
+
+                # Salva o arquivo Excel completo a cada bloco
+                df_upload.to_excel(temp_excel_path, index=False, engine='openpyxl')
 
         success_msg = f"✅ Processamento concluído! {processed_count}/{total_rows} linhas processadas.\n\nO resultado foi salvo em '{temp_excel_path}'"
         
@@ -0,0 +1,75 @@
+# /testes/normalizer_parity.py
+"""
+Verificação de paridade do TextNormalizer compilado (uma regex, uma passada)
+com a implementação original, que aplicava cada substituição em sequência.
+Percorre todas as descrições do catálogo e lista as que divergem.
+
+Uso: python testes/normalizer_parity.py [arquivo_do_catalogo]
+"""
+import re
+import sys
+import unicodedata
+from pathlib import Path
+
+# Permite importar o pacote backend executando o script a partir de qualquer diretório
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from backend.core.text_utils import TextNormalizer
+from backend.services.ingest import read_source
+
+DATA_FILE_PATH = "dados/banco_dados_servicos.txt"
+MAX_REPORTED = 20
+
+# Substituições exatamente como eram antes da compilação (aplicadas em ordem)
+LEGACY_SUBSTITUTIONS = {
+    r'\b(m2|m²)\b': ' metro_quadrado ', r'\b(m3|m³)\b': ' metro_cubico ',
+    r'\b(pol|polegadas|")\b': ' polegada ', r'\b(ø)\b': ' diametro ',
+    r'\b(conc)\b': 'concreto', r'\b(arm)\b': 'armado', r'\b(est)\b': 'estrutural',
+    r'\b(galv)\b': 'galvanizado', r'\b(exec)\b': 'execucao',
+    r'\b(fornec)\b': 'fornecimento', r'\b(inst)\b': 'instalacao',
+    r'\b(diam)\b': 'diametro', r'\bfck\b': 'fck', r'\b(mpa)\b': 'mpa',
+    r'\b(kv)\b': 'kv', r'\b(mm2|mm²)\b': 'mm2', r'\b(btu)\b': 'btu'
+}
+
+
+def legacy_normalize(text) -> str:
+    """Implementação original do TextNormalizer.normalize, usada como referência."""
+    if not isinstance(text, str): return ''
+    text = text.lower()
+    text = str(unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('utf-8', 'ignore'))
+
+    for pattern, replacement in LEGACY_SUBSTITUTIONS.items():
+        text = re.sub(pattern, replacement, text, flags=re.IGNORECASE)
+
+    text = re.sub(r'[^a-z0-9_., ]', ' ', text)
+    text = ' '.join(text.split())
+    return text
+
+
+def run_parity_check(data_file=None) -> bool:
+    """Compara as duas implementações em todas as descrições distintas do catálogo."""
+    data_file = data_file or (sys.argv[1] if len(sys.argv) > 1 else DATA_FILE_PATH)
+    try:
+        df = read_source(data_file)
+    except FileNotFoundError:
+        print(f"ERRO: Arquivo do catálogo '{data_file}' não encontrado.")
+        return False
+
+    texts = df['descricao_original'].unique().tolist()
+    print(f"INFO: Comparando normalizadores em {len(texts)} descrições distintas de '{data_file}'...")
+    compiled = TextNormalizer().normalize_many(texts)
+
+    mismatches = [(text, expected, got) for text, got in zip(texts, compiled)
+                  if (expected := legacy_normalize(text)) != got]
+    for text, expected, got in mismatches[:MAX_REPORTED]:
+        print(f"  • '{text}'\n      original:  '{expected}'\n      compilado: '{got}'")
+
+    if mismatches:
+        print(f"ERRO: {len(mismatches)} descrições normalizadas de forma diferente.")
+        return False
+    print("SUCESSO: Normalizador compilado idêntico ao original em todo o catálogo.")
+    return True
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_parity_check() else 1)